@@ -31,8 +31,9 @@ def evaluate_deep_features(features_file, labels_file, sulci_file='', hemi='',
     ----------
     features_file : string
         VTK surface file with feature numbers for vertex scalars
-    labels_file : string
+    labels_file : string or Surface
         VTK surface file with label numbers for vertex scalars
+        (or a Surface read from such a file)
     sulci_file : string
         VTK surface file with sulcus numbers for vertex scalars
     excludeIDs : list of integers
@@ -62,8 +63,8 @@ def evaluate_deep_features(features_file, labels_file, sulci_file='', hemi='',
     import os
     import sys
     import numpy as np
-    from mindboggle.utils.io_vtk import read_vtk, read_scalars, write_vtk
-    from mindboggle.utils.mesh import find_neighbors, remove_faces
+    from mindboggle.utils.io_vtk import read_scalars, write_vtk
+    from mindboggle.utils.mesh import Surface, remove_faces
     from mindboggle.utils.segment import extract_borders
     from mindboggle.utils.compute import source_to_target_distances
     from mindboggle.LABELS import DKTprotocol
@@ -72,8 +73,11 @@ def evaluate_deep_features(features_file, labels_file, sulci_file='', hemi='',
     #-------------------------------------------------------------------------
     # Load labels, features, and sulci:
     #-------------------------------------------------------------------------
-    faces, lines, indices, points, npoints, labels, scalar_names, \
-        input_vtk = read_vtk(labels_file, True, True)
+    surface = Surface.load(labels_file)
+    faces = surface.faces.tolist()
+    points = surface.points.tolist()
+    npoints = surface.npoints
+    labels = surface.scalar_values()
     features, name = read_scalars(features_file, True, True)
     if sulci_file:
         sulci, name = read_scalars(sulci_file, True, True)
@@ -91,7 +95,7 @@ def evaluate_deep_features(features_file, labels_file, sulci_file='', hemi='',
     #-------------------------------------------------------------------------
     # Calculate neighbor lists for all points:
     print('Find neighbors for all vertices...')
-    neighbor_lists = find_neighbors(faces, npoints)
+    neighbor_lists = surface.neighbor_lists
 
     # Find label border points in any of the sulci:
     print('Find label border points in any of the sulci...')
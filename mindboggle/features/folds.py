@@ -40,8 +40,9 @@ def extract_folds(depth_file, min_fold_size=50, tiny_depth=0.001, save_file=Fals
 
     Parameters
     ----------
-    depth_file : string
+    depth_file : string or Surface
         surface mesh file in VTK format with faces and depth scalar values
+        (or a Surface read from such a file)
     min_fold_size : integer
         minimum fold size (number of vertices)
     tiny_depth : float
@@ -103,8 +104,8 @@ def extract_folds(depth_file, min_fold_size=50, tiny_depth=0.001, save_file=Fals
     import numpy as np
     from time import time
     from scipy.ndimage.filters import gaussian_filter1d
-    from mindboggle.utils.io_vtk import rewrite_scalars, read_vtk
-    from mindboggle.utils.mesh import find_neighbors
+    from mindboggle.utils.io_vtk import rewrite_scalars
+    from mindboggle.utils.mesh import Surface
     from mindboggle.utils.morph import fill_holes
     from mindboggle.utils.segment import segment
 
@@ -116,13 +117,14 @@ def extract_folds(depth_file, min_fold_size=50, tiny_depth=0.001, save_file=Fals
     #-------------------------------------------------------------------------
     # Load depth values for all vertices
     #-------------------------------------------------------------------------
-    faces, lines, indices, points, npoints, depths, name, input_vtk = read_vtk(depth_file,
-        return_first=True, return_array=True)
+    surface = Surface.load(depth_file)
+    npoints = surface.npoints
+    depths = surface.scalar_values()
 
     #-------------------------------------------------------------------------
     # Find neighbors for each vertex
     #-------------------------------------------------------------------------
-    neighbor_lists = find_neighbors(faces, npoints)
+    neighbor_lists = surface.neighbor_lists
 
     #-------------------------------------------------------------------------
     # Compute histogram of depth measures
@@ -214,7 +216,7 @@ def extract_folds(depth_file, min_fold_size=50, tiny_depth=0.001, save_file=Fals
     if save_file:
 
         folds_file = os.path.join(os.getcwd(), 'folds.vtk')
-        rewrite_scalars(depth_file, folds_file, folds, 'folds', folds)
+        rewrite_scalars(surface.input_vtk, folds_file, folds, 'folds', folds)
 
         if not os.path.exists(folds_file):
             raise(IOError(folds_file + " not found"))
@@ -252,8 +254,9 @@ def extract_subfolds(depth_file, folds, min_size=10, depth_factor=0.25,
 
     Parameters
     ----------
-    depth_file : string
+    depth_file : string or Surface
         surface mesh file in VTK format with faces and depth scalar values
+        (or a Surface read from such a file)
     folds : list of integers
         fold numbers for all vertices (-1 for non-fold vertices)
     min_size : integer
@@ -310,8 +313,8 @@ def extract_subfolds(depth_file, folds, min_size=10, depth_factor=0.25,
     import os
     import numpy as np
     from time import time
-    from mindboggle.utils.io_vtk import rewrite_scalars, read_vtk
-    from mindboggle.utils.mesh import find_neighbors
+    from mindboggle.utils.io_vtk import rewrite_scalars
+    from mindboggle.utils.mesh import Surface
     from mindboggle.utils.segment import segment, propagate, watershed
 
     print("Segment folds into subfolds")
@@ -320,21 +323,22 @@ def extract_subfolds(depth_file, folds, min_size=10, depth_factor=0.25,
     #-------------------------------------------------------------------------
     # Load depth values for all vertices
     #-------------------------------------------------------------------------
-    faces, lines, indices, points, npoints, depths, \
-        name, input_vtk = read_vtk(depth_file, return_first=True, return_array=True)
+    surface = Surface.load(depth_file)
+    points = surface.points
+    depths = surface.scalar_values()
 
     #-------------------------------------------------------------------------
     # Find neighbors for each vertex
     #-------------------------------------------------------------------------
-    neighbor_lists = find_neighbors(faces, npoints)
+    neighbor_lists = surface.neighbor_lists
 
     #-------------------------------------------------------------------------
     # Segment folds into "watershed basins"
     #-------------------------------------------------------------------------
     indices_folds = [i for i,x in enumerate(folds) if x != -1]
-    subfolds, seed_indices = watershed(depths, points, indices_folds,
-                                 neighbor_lists, min_size, depth_factor=0.25,
-                                 depth_ratio=0.1, tolerance=0.01, regrow=True)
+    subfolds, seed_indices, basin_depths = watershed(depths, points,
+        indices_folds, neighbor_lists, min_size, depth_factor=0.25,
+        depth_ratio=0.1, tolerance=0.01, regrow=True)
 
     # Print statement
     n_subfolds = len([x for x in np.unique(subfolds) if x != -1])
@@ -346,7 +350,8 @@ def extract_subfolds(depth_file, folds, min_size=10, depth_factor=0.25,
     #-------------------------------------------------------------------------
     if save_file:
         subfolds_file = os.path.join(os.getcwd(), 'subfolds.vtk')
-        rewrite_scalars(depth_file, subfolds_file, subfolds, 'subfolds', subfolds)
+        rewrite_scalars(surface.input_vtk, subfolds_file, subfolds, 'subfolds',
+                        subfolds)
 
         if not os.path.exists(subfolds_file):
             raise(IOError(subfolds_file + " not found"))
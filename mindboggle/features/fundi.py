@@ -11,7 +11,8 @@ Copyright 2013,  Mindboggle team (http://mindboggle.info), Apache v2.0 License
 
 
 def extract_fundi(folds, curv_file, depth_file, min_separation=10,
-                  erode_ratio=0.1, erode_min_size=1, save_file=False):
+                  erode_ratio=0.1, erode_min_size=1, save_file=False,
+                  n_processes=1, ring_test=False):
     """
     Extract fundi from folds.
 
@@ -24,6 +25,13 @@ def extract_fundi(folds, curv_file, depth_file, min_separation=10,
         3. Connect anchor points using connect_points_erosion();
            inner anchors are removed if they result in endpoints.
 
+    Folds are independent of each other, so with n_processes > 1 they are
+    distributed across a pool of processes (largest folds first).
+    The mesh arrays are saved once to a temporary directory and loaded
+    by each process as read-only memory maps, rather than sent with
+    each fold. Fold skeletons are merged in fold order, as in serial mode,
+    so the result does not depend on the number of processes.
+
     Parameters
     ----------
     folds : numpy array or list of integers
@@ -41,6 +49,12 @@ def extract_fundi(folds, curv_file, depth_file, min_separation=10,
         in connect_points_erosion()
     save_file : Boolean
         save output VTK file?
+    n_processes : integer
+        number of processes to extract fundi from folds in parallel
+    ring_test : Boolean
+        test simple points around cyclically ordered one-rings
+        (faster, but on irregular meshes it can give different skeletons;
+        see mindboggle.utils.morph.topo_test())
 
     Returns
     -------
@@ -82,14 +96,17 @@ def extract_fundi(folds, curv_file, depth_file, min_separation=10,
 
     # Extract a skeleton to connect endpoints in a fold:
     import os
+    import shutil
+    import tempfile
     import numpy as np
     from time import time
 
     from mindboggle.utils.io_vtk import read_scalars, read_vtk, rewrite_scalars
     from mindboggle.utils.compute import median_abs_dev
     from mindboggle.utils.paths import find_max_values
-    from mindboggle.utils.mesh import find_neighbors_from_file, find_complete_faces
-    from mindboggle.utils.paths import find_outer_anchors, connect_points_erosion
+    from mindboggle.utils.mesh import Surface, find_complete_faces
+    from mindboggle.features.fundi import _fold_array_names, _fold_arrays, \
+        _load_fold_arrays, _set_fold_arrays, _extract_fold_skeleton
 
     if isinstance(folds, list):
         folds = np.array(folds)
@@ -100,13 +117,24 @@ def extract_fundi(folds, curv_file, depth_file, min_separation=10,
     values = curvs * depths
     values0 = [x for x in values if x > 0]
     thr = np.median(values0) + 2 * median_abs_dev(values0)
-    neighbor_lists = find_neighbors_from_file(curv_file)
+    surface = Surface.load(curv_file)
+    indptr, neighbors = surface.neighbor_csr
+    if ring_test:
+        ring_indptr, rings, ring_closed = surface.rings
+    else:
+        ring_indptr, rings, ring_closed = [np.array([], dtype=int)] * 3
+    arrays = [values, depths, indptr, neighbors, ring_indptr, rings,
+              ring_closed]
+
+    #-------------------------------------------------------------------------
+    # Find inner anchor points (the same for every fold):
+    #-------------------------------------------------------------------------
+    inner_anchors = find_max_values(points, values, min_separation, thr)
 
     #-------------------------------------------------------------------------
-    # Loop through folds:
+    # Extract a skeleton from each fold:
     #-------------------------------------------------------------------------
     t1 = time()
-    skeletons = []
     unique_fold_IDs = [x for x in np.unique(folds) if x != -1]
 
     if len(unique_fold_IDs) == 1:
@@ -115,40 +143,60 @@ def extract_fundi(folds, curv_file, depth_file, min_separation=10,
         print("Extract a fundus from each of {0} folds...".
               format(len(unique_fold_IDs)))
 
+    tasks = []
     for fold_ID in unique_fold_IDs:
-        indices_fold = [i for i,x in enumerate(folds) if x == fold_ID]
+        indices_fold = np.where(folds == fold_ID)[0].tolist()
         if indices_fold:
-            print('  Fold {0}:'.format(int(fold_ID)))
-
-            #-----------------------------------------------------------------
-            # Find outer anchor points on the boundary of the surface region,
-            # to serve as fundus endpoints:
-            #-----------------------------------------------------------------
-            outer_anchors, tracks = find_outer_anchors(indices_fold,
-                neighbor_lists, values, depths, min_separation)
-
-            #-----------------------------------------------------------------
-            # Find inner anchor points:
-            #-----------------------------------------------------------------
-            inner_anchors = find_max_values(points, values, min_separation, thr)
-
-            #-----------------------------------------------------------------
-            # Connect anchor points to create skeleton:
-            #-----------------------------------------------------------------
-            B = -1 * np.ones(npoints)
-            B[indices_fold] = 1
-            skeleton = connect_points_erosion(B, neighbor_lists,
-                outer_anchors, inner_anchors, values,
-                erode_ratio, erode_min_size, save_steps=[], save_vtk='')
-            if skeleton:
-                skeletons.extend(skeleton)
-
-            #-----------------------------------------------------------------
-            # Remove fundus vertices if they complete triangle faces:
-            #-----------------------------------------------------------------
-            Iremove = find_complete_faces(skeletons, faces)
-            if Iremove:
-                skeletons = list(frozenset(skeletons).difference(Iremove))
+            tasks.append((fold_ID, indices_fold, inner_anchors,
+                          min_separation, erode_ratio, erode_min_size))
+
+    skeletons_per_fold = {}
+    if n_processes > 1 and len(tasks) > 1:
+        import multiprocessing as mp
+
+        # Share the mesh arrays through memory-mapped files:
+        array_dir = tempfile.mkdtemp(prefix='mindboggle_fundi_')
+        try:
+            for name, array in zip(_fold_array_names, arrays):
+                np.save(os.path.join(array_dir, name + '.npy'), array)
+            process_pool = mp.Pool(min(n_processes, len(tasks)),
+                                   _load_fold_arrays, (array_dir,))
+            try:
+                # Start with the largest folds to balance the load:
+                tasks.sort(key=lambda x: len(x[1]), reverse=True)
+                for fold_ID, skeleton in \
+                        process_pool.imap_unordered(_extract_fold_skeleton,
+                                                    tasks):
+                    skeletons_per_fold[fold_ID] = skeleton
+                process_pool.close()
+            except:
+                process_pool.terminate()
+                raise
+            finally:
+                process_pool.join()
+        finally:
+            shutil.rmtree(array_dir, ignore_errors=True)
+    else:
+        _set_fold_arrays(arrays, surface.neighbor_lists)
+        try:
+            for task in tasks:
+                fold_ID, skeleton = _extract_fold_skeleton(task)
+                skeletons_per_fold[fold_ID] = skeleton
+        finally:
+            _fold_arrays.clear()
+
+    #-------------------------------------------------------------------------
+    # Merge the skeletons in fold order,
+    # removing fundus vertices if they complete triangle faces:
+    #-------------------------------------------------------------------------
+    skeletons = []
+    for fold_ID in unique_fold_IDs:
+        skeleton = skeletons_per_fold.get(fold_ID, [])
+        if skeleton:
+            skeletons.extend(skeleton)
+        Iremove = find_complete_faces(skeletons, faces)
+        if Iremove:
+            skeletons = list(frozenset(skeletons).difference(Iremove))
 
     indices = [x for x in skeletons if folds[x] != -1]
     fundus_per_fold = -1 * np.ones(npoints)
@@ -180,6 +228,72 @@ def extract_fundi(folds, curv_file, depth_file, min_separation=10,
     return fundus_per_fold,  n_fundi_in_folds, fundus_per_fold_file
 
 
+#-----------------------------------------------------------------------------
+# Arrays shared by the fold processes of extract_fundi():
+#-----------------------------------------------------------------------------
+_fold_array_names = ['values', 'depths', 'indptr', 'neighbors',
+                     'ring_indptr', 'rings', 'ring_closed']
+_fold_arrays = {}
+
+
+def _set_fold_arrays(arrays, neighbor_lists):
+    """Set the arrays used by _extract_fold_skeleton()."""
+    _fold_arrays.clear()
+    _fold_arrays.update(zip(_fold_array_names, arrays))
+    _fold_arrays['neighbor_lists'] = neighbor_lists
+
+
+def _load_fold_arrays(array_dir):
+    """Load the arrays saved by extract_fundi() as read-only memory maps."""
+    import os
+    import numpy as np
+
+    from mindboggle.utils.mesh import neighbor_lists_from_csr
+
+    arrays = [np.load(os.path.join(array_dir, name + '.npy'), mmap_mode='r')
+              for name in _fold_array_names]
+    _set_fold_arrays(arrays, neighbor_lists_from_csr(arrays[2], arrays[3]))
+
+
+def _extract_fold_skeleton(task):
+    """Find anchor points in a fold and connect them with a skeleton."""
+    import numpy as np
+
+    from mindboggle.utils.paths import find_outer_anchors, \
+        connect_points_erosion
+
+    fold_ID, indices_fold, inner_anchors, min_separation, erode_ratio, \
+        erode_min_size = task
+    values = _fold_arrays['values']
+    depths = _fold_arrays['depths']
+    neighbor_lists = _fold_arrays['neighbor_lists']
+    if len(_fold_arrays['ring_indptr']):
+        rings = (_fold_arrays['ring_indptr'], _fold_arrays['rings'],
+                 _fold_arrays['ring_closed'])
+    else:
+        rings = None
+    print('  Fold {0}:'.format(int(fold_ID)))
+
+    #-------------------------------------------------------------------------
+    # Find outer anchor points on the boundary of the surface region,
+    # to serve as fundus endpoints:
+    #-------------------------------------------------------------------------
+    outer_anchors, tracks = find_outer_anchors(indices_fold,
+        neighbor_lists, values, depths, min_separation)
+
+    #-------------------------------------------------------------------------
+    # Connect anchor points to create skeleton:
+    #-------------------------------------------------------------------------
+    B = -1 * np.ones(len(values))
+    B[indices_fold] = 1
+    skeleton = connect_points_erosion(B, neighbor_lists,
+        outer_anchors, inner_anchors, values,
+        erode_ratio, erode_min_size, save_steps=[], save_vtk='',
+        rings=rings)
+
+    return fold_ID, skeleton
+
+
 def segment_fundi(fundus_per_fold, sulci=[], vtk_file='', save_file=False):
     """
     Segment fundi by sulcus definitions.
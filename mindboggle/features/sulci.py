@@ -11,7 +11,7 @@ Copyright 2013,  Mindboggle team (http://mindboggle.info), Apache v2.0 License
 
 
 def extract_sulci(labels_file, folds_or_file, hemi, min_boundary=1,
-                  sulcus_names=[]):
+                  sulcus_names=[], n_processes=1):
     """
     Identify sulci from folds in a brain surface according to a labeling
     protocol that includes a list of label pairs defining each sulcus.
@@ -28,6 +28,13 @@ def extract_sulci(labels_file, folds_or_file, hemi, min_boundary=1,
         4. If there are remaining vertices, segment into sets of vertices
            connected to label boundaries, and assign a unique ID to each set.
 
+    Sulcus IDs are assigned to each fold independently of other folds,
+    so with n_processes > 1 folds are distributed across a pool of
+    processes (largest folds first), which load the mesh arrays as
+    read-only memory maps. Label propagation in a fold runs on the faces
+    of the fold alone, and boundary vertices are looked up by label pair
+    in a table built once per fold.
+
     Parameters
     ----------
     labels_file : string
@@ -40,6 +47,8 @@ def extract_sulci(labels_file, folds_or_file, hemi, min_boundary=1,
         minimum number of vertices for a sulcus label boundary segment
     sulcus_names : list of strings
         names of sulci
+    n_processes : integer
+        number of processes to extract sulci from folds in parallel
 
     Returns
     -------
@@ -71,14 +80,16 @@ def extract_sulci(labels_file, folds_or_file, hemi, min_boundary=1,
 
     """
     import os
+    import shutil
+    import tempfile
     from time import time
     import numpy as np
 
     from mindboggle.utils.io_vtk import read_scalars, read_vtk, rewrite_scalars
-    from mindboggle.utils.mesh import find_neighbors
-    from mindboggle.utils.segment import extract_borders, propagate, segment
+    from mindboggle.utils.mesh import Surface
     from mindboggle.LABELS import DKTprotocol
-
+    from mindboggle.features.sulci import _sulci_array_names, _sulci_arrays, \
+        _load_sulci_arrays, _set_sulci_arrays, _extract_fold_sulci
 
     # Load fold numbers if folds_or_file is a string:
     if isinstance(folds_or_file, str):
@@ -97,7 +108,10 @@ def extract_sulci(labels_file, folds_or_file, hemi, min_boundary=1,
 
     # Load points, faces, and neighbors:
     faces, o1, o2, points, npoints, labels, o3, o4 = read_vtk(labels_file)
-    neighbor_lists = find_neighbors(faces, npoints)
+    surface = Surface.load(labels_file)
+    indptr, neighbors = surface.neighbor_csr
+    arrays = [np.asarray(points), np.asarray(faces, dtype=int).reshape(-1, 3),
+              np.asarray(labels), indptr, neighbors]
 
     # Array of sulcus IDs for fold vertices, initialized as -1.
     # Since we do not touch gyral vertices and vertices whose labels
@@ -108,217 +122,48 @@ def extract_sulci(labels_file, folds_or_file, hemi, min_boundary=1,
     #-------------------------------------------------------------------------
     # Loop through folds
     #-------------------------------------------------------------------------
+    folds = np.asarray(folds)
     fold_numbers = [int(x) for x in np.unique(folds) if x != -1]
     n_folds = len(fold_numbers)
     print("Extract sulci from {0} folds...".format(n_folds))
     t0 = time()
-    for n_fold in fold_numbers:
-        fold = [i for i,x in enumerate(folds) if x == n_fold]
-        len_fold = len(fold)
-
-        # List the labels in this fold:
-        fold_labels = [labels[x] for x in fold]
-        unique_fold_labels = [int(x) for x in np.unique(fold_labels)
-                              if x != -1]
-
-        #---------------------------------------------------------------------
-        # NO MATCH -- fold has fewer than two labels
-        #---------------------------------------------------------------------
-        if len(unique_fold_labels) < 2:
-            # Ignore: sulci already initialized with -1 values:
-            if not unique_fold_labels:
-                print("  Fold {0} ({1} vertices): "
-                      "NO MATCH -- fold has no labels".
-                      format(n_fold, len_fold))
-            else:
-                print("  Fold {0} ({1} vertices): "
-                  "NO MATCH -- fold has only one label ({2})".
-                  format(n_fold, len_fold, unique_fold_labels[0]))
-            # Ignore: sulci already initialized with -1 values
-
-        else:
-            # Find all label boundary pairs within the fold:
-            indices_fold_pairs, fold_pairs, unique_fold_pairs = \
-                extract_borders(fold, labels, neighbor_lists,
-                                ignore_values=[], return_label_pairs=True)
-
-            # Find fold label pairs in the protocol (pairs are already sorted):
-            fold_pairs_in_protocol = [x for x in unique_fold_pairs
-                                      if x in dkt.unique_sulcus_label_pairs]
-
-            if unique_fold_labels:
-                print("  Fold {0} labels: {1} ({2} vertices)".format(n_fold,
-                      ', '.join([str(x) for x in unique_fold_labels]),
-                      len_fold))
-            #-----------------------------------------------------------------
-            # NO MATCH -- fold has no sulcus label pair
-            #-----------------------------------------------------------------
-            if not fold_pairs_in_protocol:
-                print("  Fold {0}: NO MATCH -- fold has no sulcus label pair".
-                      format(n_fold, len_fold))
-
-            #-----------------------------------------------------------------
-            # Possible matches
-            #-----------------------------------------------------------------
-            else:
-                print("  Fold {0} label pairs in protocol: {1}".format(n_fold,
-                      ', '.join([str(x) for x in fold_pairs_in_protocol])))
-
-                # Labels in the protocol (includes repeats across label pairs):
-                labels_in_pairs = [x for lst in fold_pairs_in_protocol
-                                   for x in lst]
-
-                # Labels that appear in one or more sulcus label boundary:
-                unique_labels = []
-                nonunique_labels = []
-                for label in np.unique(labels_in_pairs):
-                    if len([x for x in labels_in_pairs if x == label]) == 1:
-                        unique_labels.append(label)
-                    else:
-                        nonunique_labels.append(label)
-
-                #-------------------------------------------------------------
-                # Vertices whose labels are in only one sulcus label pair
-                #-------------------------------------------------------------
-                # Find vertices with a label that is in only one of the fold's
-                # label pairs (the other label in the pair can exist in other
-                # pairs). Assign the vertices the sulcus with the label pair
-                # if they are connected to the label boundary for that pair.
-                #-------------------------------------------------------------
-                if unique_labels:
-
-                    for pair in fold_pairs_in_protocol:
-
-                        # If one or both labels in label pair is/are unique:
-                        unique_labels_in_pair = [x for x in pair
-                                                 if x in unique_labels]
-                        n_unique = len(unique_labels_in_pair)
-                        if n_unique:
-
-                            ID = None
-                            for i, pair_list in enumerate(pair_lists):
-                                if not isinstance(pair_list, list):
-                                    pair_list = [pair_list]
-                                if pair in pair_list:
-                                    ID = i
-                                    break
-                            if ID:
-                                # Seeds from label boundary vertices
-                                # (fold_pairs and pair already sorted):
-                                indices_pair = [x for i,x
-                                    in enumerate(indices_fold_pairs)
-                                    if fold_pairs[i] == pair]
-
-                                # Vertices with unique label(s) in pair:
-                                indices_unique_labels = [fold[i]
-                                     for i,x in enumerate(fold_labels)
-                                     if x in dkt.unique_sulcus_label_pairs]
-
-                                # Propagate from seeds to labels in label pair:
-                                sulci2 = segment(indices_unique_labels,
-                                                 neighbor_lists,
-                                                 min_region_size=1,
-                                                 seed_lists=[indices_pair],
-                                                 keep_seeding=False,
-                                                 spread_within_labels=True,
-                                                 labels=labels)
-                                sulci[sulci2 != -1] = ID
-
-                                # Print statement:
-                                if n_unique == 1:
-                                    ps1 = '1 label'
-                                else:
-                                    ps1 = 'Both labels'
-                                if len(sulcus_names):
-                                    ps2 = sulcus_names[ID]
-                                else:
-                                    ps2 = ''
-                                print("    {0} unique to one fold pair: "
-                                      "{1} {2}".
-                                      format(ps1, ps2, unique_labels_in_pair))
-
-                #-------------------------------------------------------------
-                # Vertex labels shared by multiple label pairs
-                #-------------------------------------------------------------
-                # Propagate labels from label borders to vertices with labels
-                # that are shared by multiple label pairs in the fold.
-                #-------------------------------------------------------------
-                if len(nonunique_labels):
-                    # For each label shared by different label pairs:
-                    for label in nonunique_labels:
-                        # Print statement:
-                        print("    Propagate sulcus borders with label {0}".
-                              format(int(label)))
-
-                        # Construct seeds from label boundary vertices:
-                        seeds = -1 * np.ones(len(points))
-
-                        for ID, pair_list in enumerate(pair_lists):
-                            if not isinstance(pair_list, list):
-                                pair_list = [pair_list]
-                            label_pairs = [x for x in pair_list if label in x]
-                            for label_pair in label_pairs:
-                                indices_pair = [x for i,x
-                                    in enumerate(indices_fold_pairs)
-                                    if np.sort(fold_pairs[i]).
-                                    tolist() == label_pair]
-                                if indices_pair:
-
-                                    # Do not include short boundary segments:
-                                    if min_boundary > 1:
-                                        indices_pair2 = []
-                                        seeds2 = segment(indices_pair,
-                                                         neighbor_lists)
-                                        useeds2 = [x for x in
-                                                   np.unique(seeds2)
-                                                   if x != -1]
-                                        for seed2 in useeds2:
-                                            iseed2 = [i for i,x
-                                                      in enumerate(seeds2)
-                                                      if x == seed2]
-                                            if len(iseed2) >= min_boundary:
-                                                indices_pair2.extend(iseed2)
-                                            else:
-                                                if len(iseed2) == 1:
-                                                    print("    Remove "
-                                                          "assignment "
-                                                          "of ID {0} from "
-                                                          "1 vertex".
-                                                          format(seed2))
-                                                else:
-                                                    print("    Remove "
-                                                          "assignment "
-                                                          "of ID {0} from "
-                                                          "{1} vertices".
-                                                          format(seed2,
-                                                                 len(iseed2)))
-                                        indices_pair = indices_pair2
-
-                                    # Assign sulcus IDs to seeds:
-                                    seeds[indices_pair] = ID
-
-                        # Identify vertices with the label:
-                        label_array = -1 * np.ones(len(points))
-                        indices_label = [fold[i] for i,x
-                                         in enumerate(fold_labels)
-                                         if x == label]
-                        if len(indices_label):
-                            label_array[indices_label] = 1
-
-                            # Propagate from seeds to vertices with label:
-                            #indices_seeds = []
-                            #for seed in range(int(max(seeds))+1):
-                            #    indices_seeds.append([i for i,x
-                            #                          in enumerate(seeds)
-                            #                          if x == seed])
-                            #sulci2 = segment(indices_label, neighbor_lists,
-                            #                 50, indices_seeds, False, True,
-                            #                 labels)
-                            sulci2 = propagate(points, faces,
-                                               label_array, seeds, sulci,
-                                               max_iters=10000,
-                                               tol=0.001, sigma=5)
-                            sulci[sulci2 != -1] = sulci2[sulci2 != -1]
+    tasks = [(n_fold, np.where(folds == n_fold)[0].tolist(), pair_lists,
+              dkt.unique_sulcus_label_pairs, min_boundary, sulcus_names)
+             for n_fold in fold_numbers]
+
+    if n_processes > 1 and len(tasks) > 1:
+        import multiprocessing as mp
+
+        # Share the mesh arrays through memory-mapped files:
+        array_dir = tempfile.mkdtemp(prefix='mindboggle_sulci_')
+        try:
+            for name, array in zip(_sulci_array_names, arrays):
+                np.save(os.path.join(array_dir, name + '.npy'), array)
+            process_pool = mp.Pool(min(n_processes, len(tasks)),
+                                   _load_sulci_arrays, (array_dir,))
+            try:
+                # Start with the largest folds to balance the load:
+                tasks.sort(key=lambda x: len(x[1]), reverse=True)
+                for fold, fold_sulci in \
+                        process_pool.imap_unordered(_extract_fold_sulci,
+                                                    tasks):
+                    sulci[fold] = fold_sulci
+                process_pool.close()
+            except:
+                process_pool.terminate()
+                raise
+            finally:
+                process_pool.join()
+        finally:
+            shutil.rmtree(array_dir, ignore_errors=True)
+    else:
+        _set_sulci_arrays(arrays)
+        try:
+            for task in tasks:
+                fold, fold_sulci = _extract_fold_sulci(task)
+                sulci[fold] = fold_sulci
+        finally:
+            _sulci_arrays.clear()
 
     #-------------------------------------------------------------------------
     # Print out assigned sulci
@@ -365,4 +210,248 @@ def extract_sulci(labels_file, folds_or_file, hemi, min_boundary=1,
     return sulci, n_sulci, sulci_file
 
 
+#-----------------------------------------------------------------------------
+# Arrays shared by the fold processes of extract_sulci():
+#-----------------------------------------------------------------------------
+_sulci_array_names = ['points', 'faces', 'labels', 'indptr', 'neighbors']
+_sulci_arrays = {}
+
+
+def _set_sulci_arrays(arrays):
+    """Set the arrays used by _extract_fold_sulci()."""
+    _sulci_arrays.clear()
+    _sulci_arrays.update(zip(_sulci_array_names, arrays))
+
+
+def _load_sulci_arrays(array_dir):
+    """Load the arrays saved by extract_sulci() as read-only memory maps."""
+    import os
+    import numpy as np
+
+    _set_sulci_arrays([np.load(os.path.join(array_dir, name + '.npy'),
+                               mmap_mode='r')
+                       for name in _sulci_array_names])
+
+
+def _extract_fold_sulci(task):
+    """Assign sulcus IDs to the vertices of a fold (see extract_sulci())."""
+    import numpy as np
+
+    from mindboggle.utils.segment import extract_borders, propagate, segment
+
+    n_fold, fold, pair_lists, unique_sulcus_label_pairs, min_boundary, \
+        sulcus_names = task
+    points = _sulci_arrays['points']
+    faces = _sulci_arrays['faces']
+    labels = _sulci_arrays['labels']
+    neighbor_lists = (_sulci_arrays['indptr'], _sulci_arrays['neighbors'])
+    npoints = len(points)
+
+    # Sulcus IDs are only assigned to the fold's vertices:
+    sulci = -1 * np.ones(npoints)
+    len_fold = len(fold)
+
+    # List the labels in this fold:
+    fold_labels = labels[fold].tolist()
+    unique_fold_labels = [int(x) for x in np.unique(fold_labels)
+                          if x != -1]
+
+    #-------------------------------------------------------------------------
+    # NO MATCH -- fold has fewer than two labels
+    #-------------------------------------------------------------------------
+    if len(unique_fold_labels) < 2:
+        # Ignore: sulci already initialized with -1 values:
+        if not unique_fold_labels:
+            print("  Fold {0} ({1} vertices): "
+                  "NO MATCH -- fold has no labels".
+                  format(n_fold, len_fold))
+        else:
+            print("  Fold {0} ({1} vertices): "
+              "NO MATCH -- fold has only one label ({2})".
+              format(n_fold, len_fold, unique_fold_labels[0]))
+        # Ignore: sulci already initialized with -1 values
+        return fold, sulci[fold]
+
+    # Find all label boundary pairs within the fold:
+    indices_fold_pairs, fold_pairs, unique_fold_pairs = \
+        extract_borders(fold, labels, neighbor_lists,
+                        ignore_values=[], return_label_pairs=True)
+
+    # Index the label boundary vertices by (sorted) label pair:
+    indices_per_pair = {}
+    for index, fold_pair in zip(indices_fold_pairs, fold_pairs):
+        indices_per_pair.setdefault(tuple(fold_pair), []).append(index)
+
+    # Find fold label pairs in the protocol (pairs are already sorted):
+    fold_pairs_in_protocol = [x for x in unique_fold_pairs
+                              if x in unique_sulcus_label_pairs]
+
+    if unique_fold_labels:
+        print("  Fold {0} labels: {1} ({2} vertices)".format(n_fold,
+              ', '.join([str(x) for x in unique_fold_labels]),
+              len_fold))
+    #-------------------------------------------------------------------------
+    # NO MATCH -- fold has no sulcus label pair
+    #-------------------------------------------------------------------------
+    if not fold_pairs_in_protocol:
+        print("  Fold {0}: NO MATCH -- fold has no sulcus label pair".
+              format(n_fold, len_fold))
+        return fold, sulci[fold]
+
+    #-------------------------------------------------------------------------
+    # Possible matches
+    #-------------------------------------------------------------------------
+    print("  Fold {0} label pairs in protocol: {1}".format(n_fold,
+          ', '.join([str(x) for x in fold_pairs_in_protocol])))
+
+    # Labels in the protocol (includes repeats across label pairs):
+    labels_in_pairs = [x for lst in fold_pairs_in_protocol
+                       for x in lst]
+
+    # Labels that appear in one or more sulcus label boundary:
+    unique_labels = []
+    nonunique_labels = []
+    for label in np.unique(labels_in_pairs):
+        if len([x for x in labels_in_pairs if x == label]) == 1:
+            unique_labels.append(label)
+        else:
+            nonunique_labels.append(label)
+
+    #-------------------------------------------------------------------------
+    # Vertices whose labels are in only one sulcus label pair
+    #-------------------------------------------------------------------------
+    # Find vertices with a label that is in only one of the fold's
+    # label pairs (the other label in the pair can exist in other
+    # pairs). Assign the vertices the sulcus with the label pair
+    # if they are connected to the label boundary for that pair.
+    #-------------------------------------------------------------------------
+    if unique_labels:
+
+        # Vertices with unique label(s) in pair:
+        indices_unique_labels = [fold[i]
+             for i,x in enumerate(fold_labels)
+             if x in unique_sulcus_label_pairs]
+
+        for pair in fold_pairs_in_protocol:
+
+            # If one or both labels in label pair is/are unique:
+            unique_labels_in_pair = [x for x in pair
+                                     if x in unique_labels]
+            n_unique = len(unique_labels_in_pair)
+            if n_unique:
+
+                ID = None
+                for i, pair_list in enumerate(pair_lists):
+                    if not isinstance(pair_list, list):
+                        pair_list = [pair_list]
+                    if pair in pair_list:
+                        ID = i
+                        break
+                if ID:
+                    # Seeds from label boundary vertices
+                    # (fold_pairs and pair already sorted):
+                    indices_pair = indices_per_pair.get(tuple(pair), [])
+
+                    # Propagate from seeds to labels in label pair:
+                    sulci2 = segment(indices_unique_labels,
+                                     neighbor_lists,
+                                     min_region_size=1,
+                                     seed_lists=[indices_pair],
+                                     keep_seeding=False,
+                                     spread_within_labels=True,
+                                     labels=labels)
+                    sulci[sulci2 != -1] = ID
+
+                    # Print statement:
+                    if n_unique == 1:
+                        ps1 = '1 label'
+                    else:
+                        ps1 = 'Both labels'
+                    if len(sulcus_names):
+                        ps2 = sulcus_names[ID]
+                    else:
+                        ps2 = ''
+                    print("    {0} unique to one fold pair: "
+                          "{1} {2}".
+                          format(ps1, ps2, unique_labels_in_pair))
+
+    #-------------------------------------------------------------------------
+    # Vertex labels shared by multiple label pairs
+    #-------------------------------------------------------------------------
+    # Propagate labels from label borders to vertices with labels
+    # that are shared by multiple label pairs in the fold.
+    #-------------------------------------------------------------------------
+    if len(nonunique_labels):
+
+        # Faces of the fold (propagation is restricted to the fold):
+        in_fold = np.zeros(npoints, dtype=bool)
+        in_fold[fold] = True
+        fold_faces = faces[in_fold[faces].all(axis=1)].tolist()
+
+        # For each label shared by different label pairs:
+        for label in nonunique_labels:
+            # Print statement:
+            print("    Propagate sulcus borders with label {0}".
+                  format(int(label)))
+
+            # Construct seeds from label boundary vertices:
+            seeds = -1 * np.ones(npoints)
+
+            for ID, pair_list in enumerate(pair_lists):
+                if not isinstance(pair_list, list):
+                    pair_list = [pair_list]
+                label_pairs = [x for x in pair_list if label in x]
+                for label_pair in label_pairs:
+                    indices_pair = indices_per_pair.get(tuple(label_pair), [])
+                    if indices_pair:
+
+                        # Do not include short boundary segments:
+                        if min_boundary > 1:
+                            indices_pair2 = []
+                            seeds2 = segment(indices_pair,
+                                             neighbor_lists)
+                            useeds2 = [x for x in
+                                       np.unique(seeds2)
+                                       if x != -1]
+                            for seed2 in useeds2:
+                                iseed2 = np.where(seeds2 == seed2)[0].tolist()
+                                if len(iseed2) >= min_boundary:
+                                    indices_pair2.extend(iseed2)
+                                else:
+                                    if len(iseed2) == 1:
+                                        print("    Remove "
+                                              "assignment "
+                                              "of ID {0} from "
+                                              "1 vertex".
+                                              format(seed2))
+                                    else:
+                                        print("    Remove "
+                                              "assignment "
+                                              "of ID {0} from "
+                                              "{1} vertices".
+                                              format(seed2,
+                                                     len(iseed2)))
+                            indices_pair = indices_pair2
+
+                        # Assign sulcus IDs to seeds:
+                        seeds[indices_pair] = ID
+
+            # Identify vertices with the label:
+            label_array = -1 * np.ones(npoints)
+            indices_label = [fold[i] for i,x
+                             in enumerate(fold_labels)
+                             if x == label]
+            if len(indices_label) and fold_faces:
+                label_array[indices_label] = 1
+
+                # Propagate from seeds to vertices with label:
+                sulci2 = propagate(points, fold_faces,
+                                   label_array, seeds, sulci,
+                                   max_iters=10000,
+                                   tol=0.001, sigma=5)
+                sulci[sulci2 != -1] = sulci2[sulci2 != -1]
+
+    return fold, sulci[fold]
+
+
 #if __name__ == "__main__":
@@ -101,76 +101,23 @@ def _count_fundus_line_neighbors(index, neighbor_lists, fundus_line_indices):
 def _close_fundus_lines(points, fundus_line_indices,
                         neighbor_lists, endpoint_indices):
     import numpy as np
+    from mindboggle.utils.shortest_paths import edge_length_graph, \
+        shortest_paths
+
     closed_fundus_lines = np.zeros(len(points))
     closed_fundus_lines[fundus_line_indices] = 1
 
-    for endpoint in endpoint_indices:
-        path = _find_shortest_path_to_any(
-            endpoint, endpoint_indices, points, neighbor_lists)
+    # Connect each endpoint to its nearest other endpoint
+    # (by the sum of squared edge lengths):
+    graph = edge_length_graph(points, neighbor_lists, squared=True)
+    paths = shortest_paths(graph, endpoint_indices, endpoint_indices)
+    for endpoint, path in zip(endpoint_indices, paths):
+        if not path:
+            raise RuntimeError("No path found for endpoint %d" % endpoint)
         closed_fundus_lines[path] = 1.
 
     return closed_fundus_lines
 
-def _find_shortest_path_to_any(origin, targets, points, neighbor_lists):
-    import numpy as np
-    import Queue
-
-    open_queue = Queue.PriorityQueue()
-    distance_map = {}
-    predicessor_map = {}
-    closed_set = set()
-
-    cur = [0, origin]
-    open_queue.put(cur)
-    distance_map[origin] = cur
-    predicessor_map[origin] = None
-    first_point = None
-
-    while not open_queue.empty():
-        dist, vertex = open_queue.get()
-        if vertex != origin and vertex in targets:
-            first_point = predicessor_map[vertex]
-            break
-
-        added_any = False
-        for neighbor in neighbor_lists[vertex]:
-            if neighbor not in closed_set:
-                neighbor_dist = np.sum(
-                    (np.array(points[vertex]) -
-                     np.array(points[neighbor]))**2)
-                if neighbor not in distance_map:
-                    neighbor_obj = [dist + neighbor_dist, neighbor]
-                    distance_map[neighbor] = neighbor_obj
-                    open_queue.put(neighbor_obj)
-                    predicessor_map[neighbor] = vertex
-
-                if neighbor_dist + dist < distance_map[neighbor][0]:
-                    distance_map[neighbor][0] = neighbor_dist + dist
-                    predicessor_map[neighbor] = vertex
-                    added_any = True
-
-        closed_set.add(vertex)
-
-        # Hack to force resorting of the priority queue based on
-        # new values
-        if added_any:
-            dummy = [-1, -1]
-            open_queue.put(dummy)
-            open_queue.get()
-
-    # Trace back predicessors
-    if first_point is None:
-        raise RuntimeError("No path found for endpoint %d" % endpoint)
-
-    path = []
-    cur_point = first_point
-    while cur_point != origin:
-        path.append(cur_point)
-        cur_point = predicessor_map[cur_point]
-    path.append(origin)
-    path.reverse()
-    return path
-
 def main(argv):
     from mindboggle.utils.io_vtk import write_vtk
     closed_fundus_lines, points, faces = propagate_fundus_lines(argv[1],
@@ -166,7 +166,9 @@ class Bounds:
         Parameters
         ----------
         - faces and points of a vtk surface mesh
-        method: string (choice of algorithm)
+        method: string (choice of algorithm:
+                        "propagate_labels" (iterative weighted average) or
+                        "solve_labels" (direct solution of the same problem))
         realign: boolean (use label propagation for realigning boundaries?)
         kernel: function (used in constructing affinity matrix)
         sigma: float (gaussian kernel parameter)
@@ -201,6 +203,10 @@ class Bounds:
                   max_iters))
             # Construct self.learned_matrix matrix within method
             self.propagate_labels(realign, max_iters, tol, vis=vis)
+        elif method == "solve_labels":
+            print('Solve for propagated labels')
+            # Construct self.learned_matrix matrix within method
+            self.solve_labels(realign)
         else:
             print('That algorithm is not available.')
 
@@ -250,10 +256,37 @@ class Bounds:
     #-------------------------------------------------------------------------
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
-    def propagate_labels(self, realign, max_iters, tol, vis=True):
+    def clamped_vertices(self, realign):
+        """
+        Find the vertices whose label values are clamped during propagation.
+
+        Parameters
+        ----------
+        realign:    boolean (propagation is for realignment?)
+
+        Returns
+        -------
+        restore_indices: np array (Boolean array of all vertices,
+                         or indices of vertices for realignment)
+
+        """
+        if not realign:
+            restore_indices = self.seed_labels >= self.min_label
+        else:
+            restore_indices = np.hstack((self.label_boundary,
+                                         self.polyline_elements)).astype(int)
+
+        return restore_indices
+
+    def propagate_labels(self, realign, max_iters, tol, vis=True,
+                         dtype=np.float32):
         """
         Run iterative weighted average algorithm to propagate labels to unlabeled vertices.
 
+        All labels (columns of the label matrix) are propagated at once,
+        as a dense n x C block multiplied by the normalized affinity matrix.
+        A label stops being updated once it converges.
+
         Parameters
         ----------
         realign:    boolean (propagation is for realignment?)
@@ -261,10 +294,15 @@ class Bounds:
         tol:        float (threshold for terminating algorithm)
         vis:        boolean (incremental VTK files to visualize
                              progress of the algorithm?)
+        dtype:      numpy dtype (of the propagated label values)
+
         Returns
         -------
         self.learned_matrix: np array
              (n x C matrix of probabilities that vertex belongs to a given label)
+        self.iterations: np array (number of iterations per label)
+        self.residuals: np array (sum of absolute changes in the last
+                                  iteration per label)
 
         Features: Hard label clamps, probabilistic solution.
         See: Zhu and Ghahramani, 2002.
@@ -278,9 +316,12 @@ class Bounds:
         l of which are labeled, and u unlabeled.
         The algorithm takes as its input the affinity matrix W (self.affinity_matrix).
         From the affinity matrix, one may construct the diagonal degree matrix,
-        which is a measure of the total weight (or number of edges) attached to a vertex."""
+        which is a measure of the total weight (or number of edges) attached to a vertex.
+        Each iteration multiplies by the product of the two, which is computed once."""
 
         self.DDM = go.diagonal_degree_matrix(self.affinity_matrix, inverse=True)
+        transition_matrix = csr_matrix(self.DDM * self.affinity_matrix,
+                                       dtype=dtype)
 
         """ Next, we must initialize a vector to represent the results of the label
         propagation algorithm. It will contain l labels and u 0's.
@@ -297,26 +338,16 @@ class Bounds:
         average of adjacent vertices. An important caveat of this algorithm
         is that the labeled vertices remain fixed, or clamped.
         They should not be changed, and will need to be reset.
-        We accomplish the reset by recalling that self.seed_labels
-        stores the indexes of seed labels,
-        and self.Labels contains the actual labels.
         The algorithm repeats itself until either convergence or max_iters
         (which will prevent excessive computation time).
         We must also take care to solve the multi-label problem.
         To do so, we employ a one-vs-all framework, where each label is
         considered independently, and set against the rest of the labels.
         More specifically, self.label_matrix is an n x C matrix, where each
-        row represents a vertex and each column represents label membership.
-        We can go column by column and process the algorithm
-        iteratively. So, we'd start at the first column and see which vertices
-        get labeled. Then we'd move to the next column and label more vertices.
-        Because it is possible (likely) that some vertices will not receive any label,
-        and also to account for probabilistic labeling, we will assign a probability
-        of a vertex receiving a label. Then we can report these probabilities.
-        So, to begin, let us first construct this probabilistic label assignment:
-        This matrix will store a 1 for 100% probability, 0 for 0%, and
-        fractional values for the rest.
-        We will rename self.label_matrix for this purpose."""
+        row represents a vertex and each column represents label membership,
+        with 1 for 100% probability, -1 for 0%, and fractional values
+        for the rest. The columns are independent, so we update all
+        of the columns that have not yet converged in each iteration."""
 
         if not realign:
             self.learned_matrix = self.label_matrix
@@ -325,108 +356,67 @@ class Bounds:
             # one which has each segment assigned a different labels
             self.learned_matrix = self.label_segment_matrix
 
-        """ We will later change the -1s to 0s.
-        As vertices get labeled, we assign a confidence measure to the labeling
-        and store the value in this matrix.
-        Now, let us go column by column, and run the weighted averaging algorithm.
-        For each column, you're studying one label. Therefore, when updating
-        self.learned_matrix, you'll be working with one column at a time too.
-        If a label gets vertex, keep the fractional value, do not simply round
-        to 1 to assign membership."""
+        # Set up indices and values to be clamped during propagation
+        restore_indices = self.clamped_vertices(realign)
+        restore_values = self.learned_matrix[restore_indices].astype(dtype)
 
-        i = 0 # record of label number
-        for column in self.learned_matrix.T:
-
-            t0 = time()
+        t0 = time()
+        Y_hat_now = self.learned_matrix.astype(dtype)
+        C = Y_hat_now.shape[1]
+        for i in range(C):
             print('Number of initial members for label {0}: {1}'.format(
-                  i, np.nonzero(column==1)[0].size))
+                  i, np.nonzero(Y_hat_now[:, i]==1)[0].size))
 
-            # Set up indices and values to be clamped during propagation
-            if not realign:
-                restore_indices = self.seed_labels >= self.min_label
-                restore_values = column[restore_indices]
+        self.iterations = np.zeros(C, dtype=int)
+        self.residuals = np.zeros(C)
+        active = np.arange(C)
+        counter = 0
+        while len(active) and counter < max_iters:
+
+            """ The option will exist to visualize the proceedings of the algorithm.
+            The results of every 1000th iteration will be sent to vtk files
+            (one per label) which can then be visualized."""
+            if vis and not realign and not np.mod(counter,1000):
+                for i in active:
+                    filename = str(self.unique_labels[i])+'_'+str(counter)+'.vtk'
+                    LABELS = np.zeros(self.num_points)
+                    LABELS[:] = Y_hat_now[:, i]
+                    write_vtk(filename, self.Points, self.Vertices,
+                              [], self.Faces, [LABELS], scalar_type='int')
+
+            # n x (number of unconverged labels) matrix
+            if len(active) == C:
+                Y_hat_active = Y_hat_now
             else:
-                restore_indices = np.hstack((self.label_boundary,self.polyline_elements))
-                restore_values = column[restore_indices]
-
-            Y_hat_now = csr_matrix(column).transpose()
-            converged = False
-            counter = 0
-            while not converged and counter < max_iters:
-                """ The option will exist to visualize the proceedings of the algorithm.
-                The results of a number of the iterations will be sent to vtk
-                files which can then be visualized.
-                For the visualization, we will construct two types of vtk files.
-                The first will be the actual (manual) labels, as found in
-                self.Labels, with the label of interest highlighted (=1),
-                and the others blanked out (=-1).
-                The other vtk files will be the result of the algorithm."""
-                if vis and not realign:
-                    """First, we'll find out which label we're working with,
-                    by calling label_mapping. We'll then send that label to the
-                    method highlight() which will do the actual work of
-                    creating the vtk."""
-                    label = self.unique_labels[i]
-
-                    if not counter: # No need to do this more than once :-)
-                        self.highlight(label)
-
-                    """ Next, we'll construct vtk files, assuming that the
-                    iteration step is one we care about.
-                    For our purposes, let's see the early iterations in high
-                    density, once low density in the middle,
-                    and the last iteration before convergence or max_iters.
-                    So, the numbers of interest will be when counter is between
-                    0 and 10, and at 100.
-                    We'll also see max_iters/2, and max_iters (or convergence).
-                    """
-                    # Actually, just see if counter is a multiple of a number of interest.
-                    # set_of_interest = np.array([0,101,202,max_iters-2,max_iters-1])
-
-                    """ Let's define a file for output.
-                    We have the vertices and faces, and we have the labels
-                    which are found in column.todense().flatten()."""
-
-                    filename = str(label)+'_'+str(counter)+'.vtk'
-
-                    if not np.mod(counter,1000):
-                        LABELS = np.zeros(self.num_points)
-                        LABELS[:] = Y_hat_now.todense().T.flatten()
-                        write_vtk(filename, self.Points, self.Vertices,
-                                  [], self.Faces, [LABELS], scalar_type='int')
-
-                # column matrix
-                Y_hat_next = (self.DDM * self.affinity_matrix * Y_hat_now).todense()
-                # reset
-                Y_hat_next[restore_indices, 0] = restore_values
-                # check convergence
-                converged = (np.sum(np.abs(Y_hat_now.todense() - Y_hat_next)) < tol)
-                # print('Iteration number {0}, convergence = {1}'.format(counter,np.sum(np.abs(column.todense() - tmp)))
-                Y_hat_now = csr_matrix(Y_hat_next)
-                counter += 1
-
-            # Print out the number of iterations, so that we get a sense for future runs.
-            # It is also an indication of whether the algorithm converged.
-
-            if counter == max_iters:
-                print('Done in {0:.2f} seconds (the algorithm did not converge)'.
-                      format(time()-t0))
+                Y_hat_active = Y_hat_now[:, active]
+            Y_hat_next = transition_matrix * Y_hat_active
+            # reset
+            if len(active) == C:
+                Y_hat_next[restore_indices] = restore_values
             else:
-                print('Done in {0:.2f} seconds ({1} iterations)'.
-                      format(time()-t0, counter))
-
-            self.learned_matrix[:,i] = Y_hat_now.todense().flatten()
-
-            #print('There were {0} initial seed vertices for this label'.
-            # format(self.count_assigned_members(i))
-            #print('The file actually had {0} vertices for this label'.
-            # format(self.count_real_members(self.label_mapping[i]))
-            #print('Using only those vertices which crossed the threshold,
-            # there are now: '.format(self.count_real_members(i))
-            #pylab.plot(self.learned_matrix[:,i])
-            #pylab.show()
+                Y_hat_next[restore_indices] = restore_values[:, active]
+            # check convergence
+            residuals = np.sum(np.abs(Y_hat_next - Y_hat_active), axis=0,
+                               dtype=np.float64)
+            Y_hat_now[:, active] = Y_hat_next
+            counter += 1
+            self.iterations[active] = counter
+            self.residuals[active] = residuals
+            active = active[residuals >= tol]
+
+        # Print out the number of iterations, so that we get a sense for future runs.
+        # It is also an indication of whether the algorithm converged.
+        for i in range(C):
+            if self.iterations[i] == max_iters:
+                print('Label {0}: {1} iterations, residual {2:.6f} '
+                      '(the algorithm did not converge)'.
+                      format(i, self.iterations[i], self.residuals[i]))
+            else:
+                print('Label {0}: {1} iterations, residual {2:.6f}'.
+                      format(i, self.iterations[i], self.residuals[i]))
+        print('Done in {0:.2f} seconds'.format(time()-t0))
 
-            i += 1
+        self.learned_matrix[:] = Y_hat_now
 
         """ Before reporting the probabilistic assignment, we change all -1's,
         which indicates 0 probability that the vertex has that label.
@@ -441,6 +431,81 @@ class Bounds:
         """ self.learned_matrix is now complete."""
         return self.learned_matrix
 
+    def solve_labels(self, realign):
+        """
+        Solve for the label values that label propagation converges to.
+
+        Instead of iterating, solve the harmonic system of equations
+        for the unclamped vertices directly, with a sparse LU factorization
+        of the graph Laplacian restricted to those vertices
+        (one factorization for all labels).
+
+        Parameters
+        ----------
+        realign:    boolean (propagation is for realignment?)
+
+        Returns
+        -------
+        self.learned_matrix: np array
+             (n x C matrix of probabilities that vertex belongs to a given label)
+        self.iterations: np array (zeros: no iterations)
+        self.residuals: np array (sum of absolute changes per label
+                                  if propagation were to continue)
+
+        See: Zhu, Ghahramani and Lafferty, 2003.
+
+        """
+        from scipy.sparse import diags
+        from scipy.sparse.linalg import splu
+
+        if isinstance(self.seed_labels,int):
+            print('Please initialize the labels by calling self.initialize_seed_labels()')
+            return
+
+        if not realign:
+            self.learned_matrix = self.label_matrix
+        else:
+            self.learned_matrix = self.label_segment_matrix
+
+        t0 = time()
+        W = csr_matrix(self.affinity_matrix)
+        Y = self.learned_matrix.astype(np.float64)
+        C = Y.shape[1]
+
+        # Clamped and free vertices:
+        is_clamped = np.zeros(Y.shape[0], dtype=bool)
+        is_clamped[self.clamped_vertices(realign)] = True
+        clamped = np.nonzero(is_clamped)[0]
+        free = np.nonzero(~is_clamped)[0]
+
+        """ The values Y_u of the free vertices are the weighted averages
+        of their neighbors' values: D_uu Y_u = W_uu Y_u + W_ul Y_l,
+        so we solve (D_uu - W_uu) Y_u = W_ul Y_l.  The degrees include
+        the stability term of go.diagonal_degree_matrix(), so that free
+        vertices not connected to any clamped vertex remain at zero."""
+        degrees = np.asarray(W.sum(axis=1)).ravel() + 0.000001
+        W_free = W[free]
+        laplacian = diags(degrees[free]) - W_free[:, free]
+        if len(free):
+            Y[free] = splu(laplacian.tocsc()).solve(
+                np.asarray(W_free[:, clamped] * Y[clamped]))
+
+        # Residuals of one more iteration of propagate_labels():
+        self.DDM = go.diagonal_degree_matrix(W, inverse=True)
+        Y_next = self.DDM * W * Y
+        Y_next[clamped] = Y[clamped]
+        self.iterations = np.zeros(C, dtype=int)
+        self.residuals = np.sum(np.abs(Y_next - Y), axis=0)
+        for i in range(C):
+            print('Label {0}: residual {1:.6f}'.format(i, self.residuals[i]))
+        print('Done in {0:.2f} seconds'.format(time()-t0))
+
+        self.learned_matrix[:] = Y
+        self.learned_matrix += 1
+        self.learned_matrix /= 2
+
+        return self.learned_matrix
+
     ##########################################################################
     # ------------------------------------------------------------------------
     #     Finding label boundaries
@@ -35,12 +35,16 @@ Copyright 2013,  Mindboggle team (http://mindboggle.info), Apache v2.0 License
 """
 
 
-def computeAB(points, faces):
+def computeAB(points, faces, dtype='float64'):
     """
     Compute matrices for the Laplace-Beltrami operator.
 
     The matrices correspond to A and B from Reuter's 2009 article.
 
+    The local matrices of all triangles are computed at once by
+    broadcasting, and summed into A and B with a single sparse (COO)
+    construction, so memory grows in proportion to the number of faces.
+
     Note ::
         All points must be on faces. Otherwise, a singular matrix error
         is generated when inverting D.
@@ -52,11 +56,14 @@ def computeAB(points, faces):
 
     faces : list of lists of 3 integers
         each list contains indices to vertices that form a triangle on a mesh
+    dtype : string or numpy dtype
+        data type of A and B ('float32' to halve their memory; entries
+        are always computed and summed in double precision)
 
     Returns
     -------
-    A : numpy matrix
-    B : numpy matrix
+    A : scipy sparse matrix in csr format
+    B : scipy sparse matrix in csr format
 
     Examples
     --------
@@ -93,9 +100,8 @@ def computeAB(points, faces):
     import numpy as np
     from scipy import sparse
 
-    points = np.array(points)
-    faces = np.array(faces)
-    nfaces = faces.shape[0]
+    points = np.asarray(points, dtype=np.float64)
+    faces = np.asarray(faces, dtype=np.int32).reshape(-1, 3)
 
     # Linear local matrices on unit triangle:
     tB = (np.ones((3,3)) + np.eye(3)) / 24.0
@@ -112,13 +118,6 @@ def computeAB(points, faces):
                        [-0.5, 0.0, 0.5],
                        [-0.5, 0.5, 0.0]])
 
-    # Replicate into third dimension for each triangle
-    # (for tB, 1st index is the 3rd index in MATLAB):
-    tB = np.array([np.tile(tB, (1, 1)) for i in xrange(nfaces)])
-    tA00 = np.array([np.tile(tA00, (1, 1)) for i in xrange(nfaces)])
-    tA11 = np.array([np.tile(tA11, (1, 1)) for i in xrange(nfaces)])
-    tA0110 = np.array([np.tile(tA0110,(1, 1)) for i in xrange(nfaces)])
-
     # Compute vertex coordinates and a difference vector for each triangle:
     v1 = points[faces[:, 0], :]
     v2 = points[faces[:, 1], :]
@@ -126,58 +125,39 @@ def computeAB(points, faces):
     v2mv1 = v2 - v1
     v3mv1 = v3 - v1
 
-    def reshape_and_repeat(A):
-        """
-        For a given 1-D array A, run the MATLAB code below.
-
-            M = reshape(M,1,1,nfaces);
-            M = repmat(M,3,3);
-
-        Please note that a0 is a 3-D matrix, but the 3rd index in NumPy
-        is the 1st index in MATLAB.  Fortunately, nfaces is the size of A.
-
-        """
-        return np.array([np.ones((3,3))*x for x in A])
-
-    # Compute length^2 of v3mv1 for each triangle:
-    a0 = np.sum(v3mv1 * v3mv1, axis=1)
-    a0 = reshape_and_repeat(a0)
-
-    # Compute length^2 of v2mv1 for each triangle:
-    a1 = np.sum(v2mv1 * v2mv1, axis=1)
-    a1 = reshape_and_repeat(a1)
-
-    # Compute dot product (v2mv1*v3mv1) for each triangle:
-    a0110 = np.sum(v2mv1 * v3mv1, axis=1)
-    a0110 = reshape_and_repeat(a0110)
+    # Compute length^2 of v3mv1, length^2 of v2mv1,
+    # and dot product (v2mv1*v3mv1) for each triangle
+    # (as column vectors, to broadcast over the local matrices):
+    a0 = np.sum(v3mv1 * v3mv1, axis=1)[:, np.newaxis, np.newaxis]
+    a1 = np.sum(v2mv1 * v2mv1, axis=1)[:, np.newaxis, np.newaxis]
+    a0110 = np.sum(v2mv1 * v3mv1, axis=1)[:, np.newaxis, np.newaxis]
 
     # Compute cross product and 2*vol for each triangle:
     cr  = np.cross(v2mv1,v3mv1)
     vol = np.sqrt(np.sum(cr*cr, axis=1))
     # zero vol will cause division by zero below, so set to small value:
-    vol_mean = np.mean(vol)
-    vol = [vol_mean if x == 0 else x for x in vol]
-    vol = reshape_and_repeat(vol)
+    vol[vol == 0] = np.mean(vol)
+    vol = vol[:, np.newaxis, np.newaxis]
 
-    # Construct all local A and B matrices (guess: for each triangle):
+    # Construct all local A and B matrices (one 3x3 matrix per triangle):
     localB = vol * tB
     localA = (1.0/vol) * (a0*tA00 + a1*tA11 - a0110*tA0110)
 
-    # Construct row and col indices.
-    # (Note: J in numpy is I in MATLAB after flattening,
-    #  because numpy is row-major while MATLAB is column-major.)
-    J = np.array([np.tile(x, (3,1)) for x in faces])
-    I = np.array([np.transpose(np.tile(x, (3,1))) for x in faces])
-
-    # Flatten arrays and swap I and J:
-    J_new = I.flatten()
-    I_new = J.flatten()
-    localA = localA.flatten()
-    localB = localB.flatten()
-
-    # Construct sparse matrix:
-    A = sparse.csr_matrix((localA, (I_new, J_new)))
-    B = sparse.csr_matrix((localB, (I_new, J_new)))
+    # Construct row and col indices: entry [i,j] of a triangle's local
+    # matrices is added to [face[j], face[i]] of the global matrices:
+    nfaces = len(faces)
+    I = np.tile(faces, 3).ravel()
+    J = np.repeat(faces, 3, axis=1).ravel()
+
+    # Construct sparse matrices (summing entries in double precision):
+    npoints = faces.max() + 1 if nfaces else 0
+    A = sparse.coo_matrix((localA.ravel(), (I, J)),
+                          shape=(npoints, npoints)).tocsr()
+    B = sparse.coo_matrix((localB.ravel(), (I, J)),
+                          shape=(npoints, npoints)).tocsr()
+    if np.dtype(dtype) != A.dtype:
+        A = A.astype(dtype)
+        B = B.astype(dtype)
 
     return A, B
 
@@ -265,11 +245,85 @@ def wesd(EVAL1, EVAL2, Vol1, Vol2, show_error=False, N=3):
     return WESD
 
 
-def fem_laplacian(points, faces, spectrum_size=10, normalization=None):
+#-----------------------------------------------------------------------------
+# Factorizations of A kept for reuse, keyed by a hash of A:
+#-----------------------------------------------------------------------------
+_factorizations = {}
+_max_factorizations = 2
+
+# Names of the arrays of a spectrum in the on-disk cache (see fem_laplacian()):
+_spectrum_cache_names = ['eigenvalues', 'eigenvectors']
+
+
+def factorize_stiffness(A):
+    """
+    Return the inverse of A (as a sparse LU factorization) for eigsh().
+
+    The factorizations of the most recent matrices are kept,
+    so that computing another spectrum (or other eigenvectors)
+    of the same shape does not factorize A again.
+
+    Parameters
+    ----------
+    A : scipy sparse matrix
+        stiffness matrix (see computeAB())
+
+    Returns
+    -------
+    OPinv : scipy LinearOperator
+        solves A x = b for x, as eigsh's OPinv argument with sigma=0
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from mindboggle.shapes.laplace_beltrami import computeAB
+    >>> from mindboggle.shapes.laplace_beltrami import factorize_stiffness
+    >>> points = [[0,0,0], [1,0,0], [0,0,1], [0,1,1], [1,0,1], [0,1,0], [1,1,1], [1,1,0]]
+    >>> faces = [[0,2,4], [0,1,4], [2,3,4], [3,4,5], [3,5,6], [0,1,7]]
+    >>> A, B = computeAB(points, faces)
+    >>> OPinv = factorize_stiffness(A)
+    >>> OPinv is factorize_stiffness(A.copy())
+    True
+
+    """
+    from scipy.sparse.linalg import splu, LinearOperator
+
+    from mindboggle.utils.cache import hash_arrays
+    from mindboggle.shapes.laplace_beltrami import _factorizations, \
+        _max_factorizations
+
+    A = A.tocsc()
+    key = hash_arrays([A.indptr, A.indices, A.data])
+    if key not in _factorizations:
+        if len(_factorizations) >= _max_factorizations:
+            _factorizations.clear()
+        lu = splu(A)
+        _factorizations[key] = LinearOperator(A.shape, matvec=lu.solve,
+                                              dtype=A.dtype)
+
+    return _factorizations[key]
+
+
+def fem_laplacian(points, faces, spectrum_size=10, normalization=None,
+                  return_solver=False, return_eigenvectors=False,
+                  cache_spectrum=False):
     """
     Compute linear finite-element method Laplace-Beltrami spectrum
     after Martin Reuter's MATLAB code.
 
+    The eigsh eigensolver finds the eigenvalues nearest zero by
+    shift-invert, which requires a sparse LU factorization of A.
+    The factorizations of the most recent shapes are kept
+    (see factorize_stiffness()), so computing spectra of different sizes
+    for the same shape factorizes A only once.
+
+    With cache_spectrum, the eigenvalues and (float32) eigenvectors are
+    also stored in the on-disk cache ($MINDBOGGLE_CACHE, see
+    mindboggle.utils.cache), keyed by a hash of the points and faces.
+    A later request for the same mesh and the same or a smaller
+    spectrum_size is then served from disk, without computing A and B.
+    Spectra computed by lobpcg (if eigsh fails) are not cached.
+
     Note ::
 
         Compare fem_laplacian() with Martin Reuter's Matlab eigenvalues:
@@ -332,11 +386,23 @@ def fem_laplacian(points, faces, spectrum_size=10, normalization=None):
     normalization : string
         the method used to normalize eigenvalues ('area' or None)
         if "area", use area of the 2D structure as in Reuter et al. 2006
+    return_solver : Boolean
+        also return the name of the eigensolver?
+    return_eigenvectors : Boolean
+        also return the eigenvectors?
+    cache_spectrum : Boolean
+        load the eigenvalues and eigenvectors from (or save them to)
+        the on-disk cache?
 
     Returns
     -------
     spectrum : list
         first spectrum_size eigenvalues for Laplace-Beltrami spectrum
+    eigenvectors : numpy array of float32 (if return_eigenvectors)
+        one eigenvector (value per vertex) per column, in spectrum order
+    solver : string (if return_solver)
+        eigensolver used to compute the spectrum ('eigsh' or 'lobpcg',
+        or 'cache' if loaded from the on-disk cache)
 
     Examples
     --------
@@ -350,6 +416,10 @@ def fem_laplacian(points, faces, spectrum_size=10, normalization=None):
     [7.401486830834377e-17, 4.58359213500127, 4.799999999999998]
     >>> fem_laplacian(points, faces, spectrum_size=3, normalization="area")
     [1.2335811384723967e-17, 0.76393202250021175, 0.79999999999999949]
+    >>> spectrum, eigenvectors = fem_laplacian(points, faces, 3,
+    >>>                                        return_eigenvectors=True)
+    >>> eigenvectors.shape
+    (8, 3)
     >>> # Spectrum for entire left hemisphere of Twins-2-1:
     >>> import os
     >>> from mindboggle.utils.io_vtk import read_faces_points
@@ -399,49 +469,80 @@ def fem_laplacian(points, faces, spectrum_size=10, normalization=None):
     from scipy.sparse.linalg import eigsh, lobpcg
     import numpy as np
 
-    from mindboggle.shapes.laplace_beltrami import computeAB
-
-    #-----------------------------------------------------------------
-    # Compute A and B matrices (from Reuter et al., 2009):
-    #-----------------------------------------------------------------
-    A, B = computeAB(points, faces)
-    if A.shape[0] <= spectrum_size:
-        print("The 3D shape has too few vertices ({0} <= {1}). Skip.".
-              format(A.shape[0], spectrum_size))
-        return None
-
-    #-----------------------------------------------------------------
-    # Use the eigsh eigensolver:
-    #-----------------------------------------------------------------
-    try :
-
-        # eigs is for nonsymmetric matrices while
-        # eigsh is for real-symmetric or complex-Hermitian matrices:
-        eigenvalues, eigenvectors = eigsh(A, k=spectrum_size, M=B,
-                                          sigma=0)
-        spectrum = eigenvalues.tolist()
+    from mindboggle.utils.cache import cache_directory, hash_arrays, \
+        load_cached_arrays, save_cached_arrays
+    from mindboggle.shapes.laplace_beltrami import computeAB, \
+        factorize_stiffness, _spectrum_cache_names
 
     #-----------------------------------------------------------------
-    # Use the lobpcg eigensolver:
+    # Load the eigenvalues and eigenvectors from the on-disk cache:
     #-----------------------------------------------------------------
-    except RuntimeError:     
-           
-        print("eigsh() failed. Now try lobpcg.")
-        print("Warning: lobpcg can produce different results from "
-              "Reuter (2006) shapeDNA-tria software.")
-        # Initial eigenvector values:
-        init_eigenvecs = np.random.random((A.shape[0], spectrum_size))
-
-        # maxiter = 40 forces lobpcg to use 20 iterations.
-        # Strangely, largest=false finds largest eigenvalues
-        # and largest=True gives the smallest eigenvalues:
-        eigenvalues, eigenvectors =  lobpcg(A, init_eigenvecs, B=B,
-                                            largest=True, maxiter=40)
-        # Extract the real parts:
-        spectrum = [value.real for value in eigenvalues]
-
-        # For some reason, the eigenvalues from lobpcg are not sorted:
-        spectrum.sort()
+    key = ''
+    eigenvalues = None
+    if cache_spectrum and cache_directory():
+        key = 'spectrum_' + hash_arrays([np.asarray(points, dtype=np.float64),
+                                         np.asarray(faces, dtype=np.int64)])
+        arrays = load_cached_arrays(key, _spectrum_cache_names)
+        if arrays is not None and len(arrays[0]) >= spectrum_size:
+            eigenvalues = np.array(arrays[0][:spectrum_size])
+            eigenvectors = np.array(arrays[1][:, :spectrum_size])
+            solver = 'cache'
+
+    if eigenvalues is None:
+
+        #-------------------------------------------------------------
+        # Compute A and B matrices (from Reuter et al., 2009):
+        #-------------------------------------------------------------
+        A, B = computeAB(points, faces)
+        if A.shape[0] <= spectrum_size:
+            print("The 3D shape has too few vertices ({0} <= {1}). Skip.".
+                  format(A.shape[0], spectrum_size))
+            results = [None] + [None] * return_eigenvectors + \
+                      [''] * return_solver
+            return tuple(results) if len(results) > 1 else None
+
+        #-------------------------------------------------------------
+        # Use the eigsh eigensolver:
+        #-------------------------------------------------------------
+        try :
+
+            # eigs is for nonsymmetric matrices while
+            # eigsh is for real-symmetric or complex-Hermitian matrices
+            # (shift-invert about zero with the factorization of A):
+            eigenvalues, eigenvectors = eigsh(A, k=spectrum_size, M=B,
+                                              sigma=0,
+                                              OPinv=factorize_stiffness(A))
+            eigenvectors = eigenvectors.astype(np.float32)
+            solver = 'eigsh'
+            if key:
+                save_cached_arrays(key, _spectrum_cache_names,
+                                   [eigenvalues, eigenvectors])
+
+        #-------------------------------------------------------------
+        # Use the lobpcg eigensolver:
+        #-------------------------------------------------------------
+        except RuntimeError:
+
+            print("eigsh() failed. Now try lobpcg.")
+            print("Warning: lobpcg can produce different results from "
+                  "Reuter (2006) shapeDNA-tria software.")
+            # Initial eigenvector values:
+            init_eigenvecs = np.random.random((A.shape[0], spectrum_size))
+
+            # maxiter = 40 forces lobpcg to use 20 iterations.
+            # Strangely, largest=false finds largest eigenvalues
+            # and largest=True gives the smallest eigenvalues:
+            eigenvalues, eigenvectors =  lobpcg(A, init_eigenvecs, B=B,
+                                                largest=True, maxiter=40)
+
+            # Extract the real parts, and sort them
+            # (for some reason, the eigenvalues from lobpcg are not sorted):
+            order = np.argsort(eigenvalues.real, kind='mergesort')
+            eigenvalues = eigenvalues.real[order]
+            eigenvectors = eigenvectors.real[:, order].astype(np.float32)
+            solver = 'lobpcg'
+
+    spectrum = eigenvalues.tolist()
 
     #-----------------------------------------------------------------
     # Normalize by area:
@@ -452,11 +553,17 @@ def fem_laplacian(points, faces, spectrum_size=10, normalization=None):
     else:
         print("Compute linear FEM Laplace-Beltrami spectrum")
 
-    return spectrum
+    results = [spectrum]
+    if return_eigenvectors:
+        results.append(eigenvectors)
+    if return_solver:
+        results.append(solver)
+    return tuple(results) if len(results) > 1 else spectrum
 
 
 def spectrum_of_largest(points, faces, spectrum_size=10, exclude_labels=[-1],
-                        normalization=None, areas=None):
+                        normalization=None, areas=None, return_solver=False,
+                        cache_spectrum=False):
     """
     Compute Laplace-Beltrami spectrum on largest connected segment.
 
@@ -478,11 +585,19 @@ def spectrum_of_largest(points, faces, spectrum_size=10, exclude_labels=[-1],
         if "area", use area of the 2D structure as in Reuter et al. 2006
     areas : numpy array or list of floats (or None)
         surface area scalar values for all vertices
+    return_solver : Boolean
+        also return the name of the eigensolver?
+    cache_spectrum : Boolean
+        load the spectrum from (or save it to) the on-disk cache?
+        (see fem_laplacian())
 
     Returns
     -------
     spectrum : list
         first spectrum_size eigenvalues for Laplace-Beltrami spectrum
+    solver : string (if return_solver)
+        eigensolver used to compute the spectrum ('eigsh' or 'lobpcg',
+        or 'cache' if loaded from the on-disk cache)
 
     Examples
     --------
@@ -533,6 +648,7 @@ def spectrum_of_largest(points, faces, spectrum_size=10, exclude_labels=[-1],
 
     if isinstance(areas, list):
         areas = np.array(areas)
+    no_spectrum = (None, '') if return_solver else None
 
     # Check to see if there are enough points:
     min_points_faces = spectrum_size
@@ -541,7 +657,7 @@ def spectrum_of_largest(points, faces, spectrum_size=10, exclude_labels=[-1],
         print("The input size {0} ({1} faces) should be much larger "
               "than spectrum_size ({2})".
               format(npoints, len(faces), spectrum_size))
-        return None
+        return no_spectrum
     else:
 
         #---------------------------------------------------------------------
@@ -553,21 +669,20 @@ def spectrum_of_largest(points, faces, spectrum_size=10, exclude_labels=[-1],
         # Alert if the number of indices is small:
         if len(points) < min_points_faces:
             print("The input size {0} is too small.".format(len(points)))
-            return None
+            return no_spectrum
         elif faces:
 
             #-----------------------------------------------------------------
             # Compute spectrum:
             #-----------------------------------------------------------------
-            spectrum = fem_laplacian(points, faces, spectrum_size,
-                                     normalization)
-            return spectrum
+            return fem_laplacian(points, faces, spectrum_size, normalization,
+                                 return_solver, False, cache_spectrum)
         else:
-            return None
+            return no_spectrum
 
 
 def spectrum_from_file(vtk_file, spectrum_size=10, exclude_labels=[-1],
-                       normalization=None, area_file=''):
+                       normalization=None, area_file='', cache_spectrum=False):
     """
     Compute Laplace-Beltrami spectrum of a 3D shape in a VTK file.
 
@@ -584,6 +699,9 @@ def spectrum_from_file(vtk_file, spectrum_size=10, exclude_labels=[-1],
         if "area", use area of the 2D structure as in Reuter et al. 2006
     area_file :  string
         name of VTK file with surface area scalar values
+    cache_spectrum : Boolean
+        load the spectrum from (or save it to) the on-disk cache?
+        (see fem_laplacian())
 
     Returns
     -------
@@ -637,17 +755,25 @@ def spectrum_from_file(vtk_file, spectrum_size=10, exclude_labels=[-1],
         areas = None
 
     spectrum = spectrum_of_largest(points, faces, spectrum_size,
-                                   exclude_labels, normalization, areas)
+                                   exclude_labels, normalization, areas,
+                                   False, cache_spectrum)
 
     return spectrum
 
 
 def spectrum_per_label(vtk_file, spectrum_size=10, exclude_labels=[-1],
                        normalization='area', area_file='',
-                       largest_segment=True):
+                       largest_segment=True, n_processes=1,
+                       timing_file='', cache_spectrum=False):
     """
     Compute Laplace-Beltrami spectrum per labeled region in a file.
 
+    The vertices of all labels are found with a single sort of the labels,
+    and each label's faces are selected with a Boolean vertex mask.
+    With n_processes > 1, labels are distributed across a pool of
+    processes (largest labels first), which load the points, faces and
+    areas as read-only memory maps.
+
     Parameters
     ----------
     vtk_file : string
@@ -663,6 +789,14 @@ def spectrum_per_label(vtk_file, spectrum_size=10, exclude_labels=[-1],
         name of VTK file with surface area scalar values
     largest_segment :  Boolean
         compute spectrum only for largest segment with a given label?
+    n_processes : integer
+        number of processes to compute spectra of labels in parallel
+    timing_file : string
+        name of output table with the number of vertices, eigensolver,
+        and computation time (seconds) for each label (if not empty)
+    cache_spectrum : Boolean
+        load each label's spectrum from (or save it to) the on-disk cache?
+        (see fem_laplacian())
 
     Returns
     -------
@@ -694,10 +828,16 @@ def spectrum_per_label(vtk_file, spectrum_size=10, exclude_labels=[-1],
      [22])
 
     """
+    import os
+    import shutil
+    import tempfile
+    import numpy as np
+
     from mindboggle.utils.io_vtk import read_vtk, read_scalars
-    from mindboggle.utils.mesh import remove_faces, reindex_faces_points
-    from mindboggle.shapes.laplace_beltrami import fem_laplacian,\
-        spectrum_of_largest
+    from mindboggle.utils.io_table import write_columns
+    from mindboggle.shapes.laplace_beltrami import _spectrum_array_names, \
+        _spectrum_arrays, _load_spectrum_arrays, _set_spectrum_arrays, \
+        _label_spectrum
 
     # Read VTK surface mesh file:
     faces, u1, u2, points, u4, labels, u5, u6 = read_vtk(vtk_file)
@@ -708,42 +848,147 @@ def spectrum_per_label(vtk_file, spectrum_size=10, exclude_labels=[-1],
     else:
         areas = None
 
-    # Loop through labeled regions:
-    ulabels = []
-    [ulabels.append(int(x)) for x in labels if x not in ulabels
-     if x not in exclude_labels]
-    label_list = []
-    spectrum_lists = []
-    for label in ulabels:
-      #if label == 22:
-      #  print("DEBUG: COMPUTE FOR ONLY ONE LABEL")
-
-        # Determine the indices per label:
-        Ilabel = [i for i,x in enumerate(labels) if x == label]
-        print('{0} vertices for label {1}'.format(len(Ilabel), label))
-
-        # Remove background faces:
-        pick_faces = remove_faces(faces, Ilabel)
-        pick_faces, pick_points, o1 = reindex_faces_points(pick_faces, points)
-
-        # Compute Laplace-Beltrami spectrum for the label:
-        if largest_segment:
-            exclude_labels_inner = [-1]
-            spectrum = spectrum_of_largest(pick_points, pick_faces,
-                                           spectrum_size,
-                                           exclude_labels_inner,
-                                           normalization, areas)
-        else:
-            spectrum = fem_laplacian(pick_points, pick_faces,
-                                     spectrum_size, normalization)
-
-        # Append to a list of lists of spectra:
-        spectrum_lists.append(spectrum)
-        label_list.append(label)
+    #-------------------------------------------------------------------------
+    # Group vertex indices by label (in order of each label's first vertex):
+    #-------------------------------------------------------------------------
+    labels = np.asarray(labels)
+    order = np.argsort(labels, kind='mergesort')
+    sorted_labels = labels[order]
+    starts = np.flatnonzero(np.concatenate(([True], sorted_labels[1:] !=
+                                                    sorted_labels[:-1])))
+    stops = np.append(starts[1:], len(labels))
+    tasks = []
+    for start, stop in sorted(zip(starts.tolist(), stops.tolist()),
+                              key=lambda x: order[x[0]]):
+        label = sorted_labels[start]
+        if label not in exclude_labels:
+            tasks.append((int(label), np.sort(order[start:stop]).tolist(),
+                          spectrum_size, normalization, largest_segment,
+                          cache_spectrum))
+    ulabels = [x[0] for x in tasks]
+
+    #-------------------------------------------------------------------------
+    # Compute Laplace-Beltrami spectrum for each label:
+    #-------------------------------------------------------------------------
+    arrays = [np.asarray(points), np.asarray(faces, dtype=int).reshape(-1, 3),
+              np.asarray(areas if areas is not None else [])]
+    results = {}
+    if n_processes > 1 and len(tasks) > 1:
+        import multiprocessing as mp
+
+        # Share the mesh arrays through memory-mapped files:
+        array_dir = tempfile.mkdtemp(prefix='mindboggle_spectra_')
+        try:
+            for name, array in zip(_spectrum_array_names, arrays):
+                np.save(os.path.join(array_dir, name + '.npy'), array)
+            process_pool = mp.Pool(min(n_processes, len(tasks)),
+                                   _load_spectrum_arrays, (array_dir,))
+            try:
+                # Start with the largest labels to balance the load:
+                tasks.sort(key=lambda x: len(x[1]), reverse=True)
+                for result in process_pool.imap_unordered(_label_spectrum,
+                                                          tasks):
+                    results[result[0]] = result
+                process_pool.close()
+            except:
+                process_pool.terminate()
+                raise
+            finally:
+                process_pool.join()
+        finally:
+            shutil.rmtree(array_dir, ignore_errors=True)
+    else:
+        _set_spectrum_arrays(arrays)
+        try:
+            for task in tasks:
+                result = _label_spectrum(task)
+                results[result[0]] = result
+        finally:
+            _spectrum_arrays.clear()
+
+    # Append to a list of lists of spectra:
+    label_list = ulabels
+    spectrum_lists = [results[label][1] for label in label_list]
+
+    #-------------------------------------------------------------------------
+    # Write the number of vertices, eigensolver and time for each label:
+    #-------------------------------------------------------------------------
+    if timing_file:
+        columns = [[results[label][i] for label in label_list]
+                   for i in [4, 2, 3]]
+        write_columns([label_list] + columns,
+                      ['label', 'vertices', 'eigensolver', 'seconds'],
+                      delimiter=',', quote=True, input_table='',
+                      output_table=timing_file)
 
     return spectrum_lists, label_list
 
 
+#-----------------------------------------------------------------------------
+# Arrays shared by the label processes of spectrum_per_label():
+#-----------------------------------------------------------------------------
+_spectrum_array_names = ['points', 'faces', 'areas']
+_spectrum_arrays = {}
+
+
+def _set_spectrum_arrays(arrays):
+    """Set the arrays used by _label_spectrum()."""
+    _spectrum_arrays.clear()
+    _spectrum_arrays.update(zip(_spectrum_array_names, arrays))
+
+
+def _load_spectrum_arrays(array_dir):
+    """Load the arrays saved by spectrum_per_label() as memory maps."""
+    import os
+    import numpy as np
+
+    _set_spectrum_arrays([np.load(os.path.join(array_dir, name + '.npy'),
+                                  mmap_mode='r')
+                          for name in _spectrum_array_names])
+
+
+def _label_spectrum(task):
+    """Compute the spectrum of one label (see spectrum_per_label())."""
+    from time import time
+    import numpy as np
+
+    from mindboggle.utils.mesh import reindex_faces_points
+    from mindboggle.shapes.laplace_beltrami import fem_laplacian, \
+        spectrum_of_largest
+
+    label, Ilabel, spectrum_size, normalization, largest_segment, \
+        cache_spectrum = task
+    points = _spectrum_arrays['points']
+    faces = _spectrum_arrays['faces']
+    areas = _spectrum_arrays['areas']
+    if not len(areas):
+        areas = None
+    t0 = time()
+    print('{0} vertices for label {1}'.format(len(Ilabel), label))
+
+    # Remove background faces:
+    in_label = np.zeros(len(points), dtype=bool)
+    in_label[Ilabel] = True
+    pick_faces = faces[in_label[faces].all(axis=1)].tolist()
+    pick_faces, o1, indices = reindex_faces_points(pick_faces)
+    pick_points = np.asarray(points)[indices].tolist()
+
+    # Compute Laplace-Beltrami spectrum for the label:
+    if largest_segment:
+        exclude_labels_inner = [-1]
+        spectrum, solver = spectrum_of_largest(pick_points, pick_faces,
+                                               spectrum_size,
+                                               exclude_labels_inner,
+                                               normalization, areas, True,
+                                               cache_spectrum)
+    else:
+        spectrum, solver = fem_laplacian(pick_points, pick_faces,
+                                         spectrum_size, normalization, True,
+                                         False, cache_spectrum)
+
+    return label, spectrum, solver, time() - t0, len(Ilabel)
+
+
 #if __name__ == "__main__":
 
     # import numpy as np
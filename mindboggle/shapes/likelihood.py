@@ -306,7 +306,7 @@ def concatenate_sulcus_scalars(scalar_files, fold_files, label_files):
         names of surface mesh VTK files with scalar values to concatenate
     fold_files : list of strings (corr. to each list in scalar_files)
         VTK files with fold numbers as scalars (-1 for non-fold vertices)
-    label_files : list of strings (corr. to fold_files)
+    label_files : list of strings or Surfaces (corr. to fold_files)
         VTK files with label numbers (-1 for unlabeled vertices)
 
     Returns
@@ -335,7 +335,7 @@ def concatenate_sulcus_scalars(scalar_files, fold_files, label_files):
     import numpy as np
 
     from mindboggle.utils.io_vtk import read_scalars
-    from mindboggle.utils.mesh import find_neighbors_from_file
+    from mindboggle.utils.mesh import Surface
     from mindboggle.utils.segment import extract_borders
     from mindboggle.LABELS import DKTprotocol
 
@@ -358,9 +358,10 @@ def concatenate_sulcus_scalars(scalar_files, fold_files, label_files):
         scalars, name = read_scalars(scalar_file, True, True)
         if scalars.shape:
             folds, name = read_scalars(folds_file)
-            labels, name = read_scalars(labels_file)
+            labels_surface = Surface.load(labels_file)
+            labels = labels_surface.scalar_values().tolist()
             indices_folds = [i for i,x in enumerate(folds) if x != -1]
-            neighbor_lists = find_neighbors_from_file(labels_file)
+            neighbor_lists = labels_surface.neighbor_lists
 
             # Find all label border pairs within the folds:
             indices_label_pairs, label_pairs, unique_pairs = extract_borders(
@@ -1,11 +1,15 @@
 from __future__ import division
 
+import os
+import tempfile
 import numpy as np
 import scipy
 from scipy.misc import (factorial,
                         comb as nchoosek,
                         )
+from scipy.sparse import csr_matrix
 
+from mindboggle.utils.cache import cache_directory
 from .helpers import nest, autocat
 
 import logging
@@ -358,10 +362,293 @@ class KoehlMultiproc(KoehlOptimizations):
         return self.factorial_scalar(N)*moments_array
 
 
+class KoehlBatched(KoehlOptimizations):
+    # Koehl's recursions for blocks of faces at once: each block carries
+    # a leading face dimension, (B,3,3) vertices and (B,N+1,N+1,N+1) terms.
+    # The three term arrays of a block take about 3*B*(N+1)^3*8 bytes,
+    # so B is chosen per order N to keep them within batch_bytes.
+    batch_bytes = 64 * 2**20
+
+    def geometric_moments_exact(self, points_array, faces_array, N):
+        n_facets, n_vertices = faces_array.shape[:2]
+        assert n_vertices == 3
+        vertex_array = points_array[faces_array, ...]
+        moments_array = self.batch_contribution(vertex_array, N)
+        return self.factorial_scalar(N)*moments_array
+
+    def batch_contribution(self, vertex_array, N):
+        # Sum of the facet contributions of a (B,3,3) array of face vertices
+        moments_array = np.zeros([N+1, N+1, N+1])
+        levels = self.recursion_levels(N)
+        batch_size = self.batch_size(N)
+        for start in xrange(0, vertex_array.shape[0], batch_size):
+            block = vertex_array[start:start + batch_size]
+            Vf = self.facet_volumes(block)
+            Cf = self.batch_work_loop(block[:, 2, :], N, levels)
+            Df = self.batch_work_loop(block[:, 1, :], N, levels, Cf)
+            Sf = self.batch_work_loop(block[:, 0, :], N, levels, Df)
+            moments_array += np.dot(Vf, Sf).reshape([N+1, N+1, N+1])
+        return moments_array
+
+    def batch_size(self, N):
+        # Number of faces per block for order N
+        return max(1, self.batch_bytes // (3 * 8 * ((N+1)**3 + 1)))
+
+    def facet_volumes(self, vertex_array):
+        # Vertices are the columns of each matrix, as in facet_volume()
+        return np.linalg.det(np.transpose(vertex_array, (0, 2, 1)))
+
+    def recursion_levels(self, N):
+        # For each order n = i+j+k from 1 to N, the flat indices into an
+        # (N+1)^3 cube of the terms of that order and of their neighbors
+        # at (i-1,j,k), (i,j-1,k) and (i,j,k-1); neighbors outside the cube
+        # point to an extra zero term at index (N+1)^3.
+        i, j, k = np.mgrid[:N+1, :N+1, :N+1]
+        i, j, k = i.ravel(), j.ravel(), k.ravel()
+        order = i + j + k
+        size = (N+1)**3
+        levels = []
+        for n in xrange(N):
+            index = np.flatnonzero(order == n+1)
+            previous = [np.where(_x[index] > 0, index - _stride, size)
+                        for _x, _stride in ((i, (N+1)**2), (j, N+1), (k, 1))]
+            levels.append([index] + previous)
+        return levels
+
+    def batch_work_loop(self, vertices, N, levels, prev=None):
+        # work_loop() for a (B,3) array of vertices, on (B,(N+1)^3+1) terms
+        n_batch = vertices.shape[0]
+        size = (N+1)**3
+        Q = np.zeros([n_batch, size + 1])
+        Q[:, 0] = 1.0
+        x, y, z = [vertices[:, _i, np.newaxis] for _i in xrange(3)]
+        for index, index_x, index_y, index_z in levels:
+            _Q = Q[:, index_x]*x + Q[:, index_y]*y + Q[:, index_z]*z
+            if prev is not None:
+                _Q += prev[:, index]
+            Q[:, index] = _Q
+        return Q[:, :size]
+
+
+def _kbmp_geometric_moments_exact_worker(args):
+    self, vertex_array, N = args
+    return self.batch_contribution(vertex_array, N)
+
+
+class KoehlBatchedMultiproc(KoehlBatched):
+    # Send blocks of thousands of faces to each process
+    faces_per_task = 10000
+
+    def geometric_moments_exact(self, points_array, faces_array, N):
+        n_facets, n_vertices = faces_array.shape[:2]
+        assert n_vertices == 3
+        vertex_array = points_array[faces_array, ...]
+        tasks = [vertex_array[_i:_i + self.faces_per_task]
+                 for _i in xrange(0, n_facets, self.faces_per_task)]
+        n_processes = min(mp.cpu_count(), len(tasks))
+        if n_processes < 2:
+            moments_array = self.batch_contribution(vertex_array, N)
+        else:
+            moments_array = np.zeros([N+1, N+1, N+1])
+            process_pool = mp.Pool(n_processes)
+            try:
+                # Sum in task order, so that results are reproducible:
+                for result in process_pool.imap(
+                        _kbmp_geometric_moments_exact_worker,
+                        [(self, _task, N) for _task in tasks]):
+                    moments_array += result
+                process_pool.close()
+            except:
+                process_pool.terminate()
+                raise
+            finally:
+                process_pool.join()
+        return self.factorial_scalar(N)*moments_array
+
+
+# Coefficient tables per order N (see TabulatedZernike), kept in-process
+# and, if a cache directory is set ($MINDBOGGLE_CACHE), saved as .npz files:
+_coefficient_tables = {}
+_coefficient_tables_version = 1
+_coefficient_stages = ['V', 'W', 'X', 'Y', 'Z']
+
+
+class TabulatedZernike(SerialPipeline):
+    # SerialPipeline.zernike() as five sparse matrix products, with the
+    # index/weight arrays of each stage built only once per order N:
+    #   V = TV.G,  W = TW.V,  X = TX.W,  Y = TY.X,  Z = TZ.conj(Y)
+    # followed by the sign changes of SerialPipeline.zernike()'s last loop.
+
+    def factorial_scalar(self, N):
+        return self.coefficient_tables(N)['factorial_scalar']
+
+    def zernike(self, G, N):
+        tables = self.coefficient_tables(N)
+        V = tables['V'].dot(np.ravel(G))
+        W = tables['W'].dot(V)
+        X = tables['X'].dot(W)
+        Y = tables['Y'].dot(X)
+        Z = tables['Z'].dot(np.conj(Y))
+        flip_index = tables['flip_index']
+        Z[flip_index] = tables['flip_sign'] * np.conj(Z[flip_index])
+        return Z.reshape([N + 1, N + 1, N + 1])
+
+    def coefficient_tables(self, N):
+        if N not in _coefficient_tables:
+            arrays = self.load_coefficient_tables(N)
+            if arrays is None:
+                arrays = self.build_coefficient_tables(N)
+                self.save_coefficient_tables(N, arrays)
+            size = (N + 1)**3
+            tables = {}
+            for stage in _coefficient_stages:
+                tables[stage] = csr_matrix(
+                    (arrays[stage + '_weights'],
+                     (arrays[stage + '_rows'], arrays[stage + '_cols'])),
+                    shape=(size, size))
+            for name in ['flip_index', 'flip_sign', 'factorial_scalar']:
+                tables[name] = arrays[name]
+            _coefficient_tables[N] = tables
+        return _coefficient_tables[N]
+
+    def coefficient_file(self, N):
+        array_dir = cache_directory()
+        if not array_dir:
+            return ''
+        return os.path.join(array_dir, 'zernike_coefficients_v{0}_{1}.npz'.
+                            format(_coefficient_tables_version, N))
+
+    def load_coefficient_tables(self, N):
+        table_file = self.coefficient_file(N)
+        if not table_file or not os.path.exists(table_file):
+            return None
+        try:
+            npz = np.load(table_file)
+            arrays = dict([(name, npz[name]) for name in npz.files])
+            npz.close()
+        except (IOError, OSError, ValueError):
+            return None
+        LOG.debug('Loaded Zernike coefficient tables from %s', table_file)
+        return arrays
+
+    def save_coefficient_tables(self, N, arrays):
+        # Write to a temporary file and rename it, so that other processes
+        # only ever load complete files
+        table_file = self.coefficient_file(N)
+        if not table_file:
+            return
+        array_dir = os.path.dirname(table_file)
+        try:
+            if not os.path.isdir(array_dir):
+                os.makedirs(array_dir)
+            fd, temp_file = tempfile.mkstemp(prefix='.zernike',
+                                             suffix='.npz', dir=array_dir)
+            try:
+                f = os.fdopen(fd, 'wb')
+                np.savez(f, **arrays)
+                f.close()
+                os.rename(temp_file, table_file)
+            except:
+                if os.path.exists(temp_file):
+                    os.remove(temp_file)
+                raise
+        except (IOError, OSError):
+            LOG.warning('Unable to save Zernike coefficient tables to %s',
+                        table_file)
+
+    def build_coefficient_tables(self, N):
+        # The loops of SerialPipeline.zernike(), recording the index of each
+        # term and the index and weight of the term it is computed from
+        flat = lambda _i, _j, _k: (_i * (N + 1) + _j) * (N + 1) + _k
+        tables = dict([(stage, ([], [], [])) for stage in _coefficient_stages])
+
+        rows, cols, weights = tables['V']
+        for a, b, c, alpha in nest(lambda: xrange(N // 2 + 1),
+                                   lambda _a: xrange(N - 2 * _a + 1),
+                                   lambda _a, _b: xrange(N - 2 * _a - _b + 1),
+                                   lambda _a, _b, _c: xrange(_a + _c + 1),
+                                   ):
+            rows.append(flat(a, b, c))
+            cols.append(flat(2 * a + c - alpha, alpha, b))
+            weights.append(np.power(IMAG_CONST, alpha) *
+                           nchoosek(a + c, alpha))
+
+        rows, cols, weights = tables['W']
+        for a, b, c, alpha in nest(lambda: xrange(N // 2 + 1),
+                                   lambda _a: xrange(N - 2 * _a + 1),
+                                   lambda _a, _b: xrange(N - 2 * _a - _b + 1),
+                                   lambda _a, _b, _c: xrange(_a + 1),
+                                   ):
+            rows.append(flat(a, b, c))
+            cols.append(flat(a - alpha, b, c + 2 * alpha))
+            weights.append(np.power(-1, alpha) * np.power(2, a - alpha) *
+                           nchoosek(a, alpha))
+
+        rows, cols, weights = tables['X']
+        for a, b, c, alpha in nest(lambda: xrange(N // 2 + 1),
+                                   lambda _a: xrange(N - 2 * _a + 1),
+                                   lambda _a, _b: xrange(N - 2 * _a - _b + 1),
+                                   lambda _a, _b, _c: xrange(_a + 1),
+                                   ):
+            rows.append(flat(a, b, c))
+            cols.append(flat(a - alpha, b + 2 * alpha, c))
+            weights.append(nchoosek(a, alpha))
+
+        rows, cols, weights = tables['Y']
+        for l, nu, m, j in nest(lambda: xrange(N + 1),
+                                lambda _l: xrange((N - _l) // 2 + 1),
+                                lambda _l, _nu: xrange(_l + 1),
+                                lambda _l, _nu, _m: xrange((_l - _m) // 2 + 1),
+                                ):
+            rows.append(flat(l, nu, m))
+            cols.append(flat(nu + j, l - m - 2 * j, m))
+            weights.append(self.Yljm(l, j, m))
+
+        rows, cols, weights = tables['Z']
+        for n, l, m, nu, in nest(lambda: xrange(N + 1),
+                                 lambda _n: xrange(_n + 1),
+                                 lambda _n, _l: xrange(_l + 1),
+                                 lambda _n, _l, _m: xrange((_n - _l) // 2 + 1),
+                                 ):
+            k = (n - l) // 2
+            rows.append(flat(n, l, m))
+            cols.append(flat(l, nu, m))
+            weights.append((3 / (4 * PI_CONST)) * self.Qklnu(k, l, nu))
+
+        # The sign changes visit the same terms as in SerialPipeline.zernike()
+        # (whose ranges depend on n and l left over from the loop above):
+        flip_index = []
+        flip_sign = []
+        for n, l, m in nest(lambda: xrange(N + 1),
+                            lambda _n: xrange(n + 1),
+                            lambda _n, _l: xrange(l + 1),
+                            ):
+            flip_index.append(flat(n, l, m))
+            if np.mod(np.sum([n, l, m]), 2) == 0:
+                flip_sign.append(1)
+            else:
+                flip_sign.append(-1)
+
+        arrays = {'flip_index': np.array(flip_index, dtype=int),
+                  'flip_sign': np.array(flip_sign, dtype=int),
+                  'factorial_scalar':
+                      SerialPipeline.factorial_scalar(self, N)}
+        for stage in _coefficient_stages:
+            rows, cols, weights = tables[stage]
+            arrays[stage + '_rows'] = np.array(rows, dtype=int)
+            arrays[stage + '_cols'] = np.array(cols, dtype=int)
+            arrays[stage + '_weights'] = np.array(weights)
+        return arrays
+
+
 #DefaultPipeline = type('DefaultPipeline', (SerialPipeline,), {})
 #DefaultPipeline = type(
 #     'DefaultPipeline', (NumpyOptimizations, MultiprocPipeline,), {})
 #DefaultPipeline = type(
 #    'DefaultPipeline', (KoehlOptimizations, SerialPipeline), {})
+#DefaultPipeline = type(
+#    'DefaultPipeline', (KoehlMultiproc, SerialPipeline), {})
+#DefaultPipeline = type(
+#    'DefaultPipeline', (KoehlBatchedMultiproc, SerialPipeline), {})
 DefaultPipeline = type(
-    'DefaultPipeline', (KoehlMultiproc, SerialPipeline), {})
+    'DefaultPipeline', (KoehlBatchedMultiproc, TabulatedZernike), {})
@@ -0,0 +1,60 @@
+import numpy
+
+from ...pipelines import (SerialPipeline,
+                          KoehlOptimizations,
+                          KoehlBatched,
+                          TabulatedZernike,
+                          DefaultPipeline,
+                          )
+
+ALLOWED_ERROR = 1e-12
+ORDER = 6
+
+# A small irregular closed mesh: an octahedron with displaced vertices
+POINTS = numpy.array([[ 0.9,  0.1, -0.1],
+                      [-1.1,  0.2,  0.1],
+                      [ 0.1,  1.2,  0.2],
+                      [-0.2, -0.8,  0.1],
+                      [ 0.2, -0.1,  1.3],
+                      [ 0.1,  0.2, -0.7]])
+FACES = numpy.array([[0, 2, 4], [2, 1, 4], [1, 3, 4], [3, 0, 4],
+                     [2, 0, 5], [1, 2, 5], [3, 1, 5], [0, 3, 5]])
+
+KoehlPipeline = type('KoehlPipeline', (KoehlOptimizations, SerialPipeline), {})
+BatchedPipeline = type('BatchedPipeline', (KoehlBatched, SerialPipeline), {})
+
+
+def relative_error(a, b):
+    return numpy.max(numpy.abs(a - b)) / numpy.max(numpy.abs(a))
+
+
+def test_batched_moments():
+    G = KoehlPipeline().geometric_moments_exact(POINTS, FACES, ORDER)
+    # One block, several blocks, and one face per block:
+    for n_faces in [len(FACES), 3, 1]:
+        pl = BatchedPipeline()
+        pl.batch_bytes = n_faces * 3 * 8 * ((ORDER+1)**3 + 1)
+        assert pl.batch_size(ORDER) == n_faces
+        Gb = pl.geometric_moments_exact(POINTS, FACES, ORDER)
+        err = relative_error(G, Gb)
+        assert err < ALLOWED_ERROR, 'Batch size {}: Error ({}) > ALLOWED_ERROR ({})'.format(n_faces, err, ALLOWED_ERROR)
+    Gd = DefaultPipeline().geometric_moments_exact(POINTS, FACES, ORDER)
+    err = relative_error(G, Gd)
+    assert err < ALLOWED_ERROR, 'DefaultPipeline: Error ({}) > ALLOWED_ERROR ({})'.format(err, ALLOWED_ERROR)
+
+
+def test_tabulated_zernike():
+    G = KoehlPipeline().geometric_moments_exact(POINTS, FACES, ORDER)
+    serial, tabulated = SerialPipeline(), TabulatedZernike()
+    assert tabulated.factorial_scalar(ORDER).shape == serial.factorial_scalar(ORDER).shape
+    err = relative_error(serial.factorial_scalar(ORDER), tabulated.factorial_scalar(ORDER))
+    assert err < ALLOWED_ERROR, 'factorial_scalar: Error ({}) > ALLOWED_ERROR ({})'.format(err, ALLOWED_ERROR)
+    Z = serial.zernike(G, ORDER)
+    Zt = tabulated.zernike(G, ORDER)
+    assert Z.shape == Zt.shape, 'zernike: {} != {}'.format(Z.shape, Zt.shape)
+    err = relative_error(Z, Zt)
+    assert err < ALLOWED_ERROR, 'zernike: Error ({}) > ALLOWED_ERROR ({})'.format(err, ALLOWED_ERROR)
+    D = serial.feature_extraction(Z, ORDER)
+    Dt = tabulated.feature_extraction(Zt, ORDER)
+    err = relative_error(D, Dt)
+    assert err < ALLOWED_ERROR, 'feature_extraction: Error ({}) > ALLOWED_ERROR ({})'.format(err, ALLOWED_ERROR)
@@ -201,7 +201,12 @@ class VTKViewer(object):
 
     def AddFile(self, file_name, colorMap=None):
         file_name_lower = file_name.lower()
-        if file_name_lower.endswith('.vtk'):
+        if file_name_lower.endswith('.vtk') and \
+                VTKViewer.IsXMLFile(file_name):
+            # XML PolyData written with a .vtk extension:
+            polyData = VTKViewer.readPolyData(
+                file_name, vtk.vtkXMLPolyDataReader)
+        elif file_name_lower.endswith('.vtk'):
             polyData = VTKViewer.ReadLegacyVTK(file_name)
         elif file_name_lower.endswith(".vtp"):
             polyData = VTKViewer.readPolyData(
@@ -314,6 +319,12 @@ class VTKViewer(object):
         return VTKViewer.ConvertDataSetToSurface(
             reader.GetOutputPort())
 
+    @staticmethod
+    def IsXMLFile(file_name):
+        with open(file_name, 'rb') as f:
+            header = f.read(1024)
+        return header.lstrip().startswith(b'<')
+
     @staticmethod
     def ReadLegacyVTK(file_name):
         reader = vtk.vtkDataSetReader()
@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+"""
+Content-addressed on-disk cache of numpy arrays.
+
+Arrays derived from a surface mesh (such as its topology) are stored as
+.npy files in a subdirectory of the Mindboggle cache directory
+($MINDBOGGLE_CACHE), named by a hash of the arrays they were derived from.
+Cached arrays are loaded as read-only memory maps, so separate processes
+(such as nipype MultiProc workers) working on the same mesh share them
+instead of recomputing them.
+
+Files are written to temporary names and renamed into place, so concurrent
+writers never expose partially written files, and the least recently used
+entries are removed when the cache grows beyond a given size.
+
+Authors:
+    - agent, 2026  (agent@local)
+
+Copyright 2026,  Mindboggle team (http://mindboggle.info), Apache v2.0 License
+
+"""
+
+#-----------------------------------------------------------------------------
+# Cache settings:
+#-----------------------------------------------------------------------------
+cache_env = 'MINDBOGGLE_CACHE'
+arrays_subdir = 'arrays'
+max_cache_megabytes = 1024
+
+
+def cache_directory(cache=''):
+    """
+    Return the directory for cached arrays, or '' if caching is off.
+
+    The arrays are kept in a subdirectory of the cache directory set by
+    the $MINDBOGGLE_CACHE environment variable. Caching is off if neither
+    the cache argument nor the environment variable is set.
+
+    Parameters
+    ----------
+    cache : string
+        cache directory (default: $MINDBOGGLE_CACHE)
+
+    Returns
+    -------
+    array_dir : string
+        directory for cached arrays ('' if caching is off)
+
+    Examples
+    --------
+    >>> from mindboggle.utils.cache import cache_directory
+    >>> cache_directory('/tmp/mindboggle_cache')
+    '/tmp/mindboggle_cache/arrays'
+
+    """
+    import os
+
+    from mindboggle.utils.cache import cache_env, arrays_subdir
+
+    if not cache:
+        cache = os.environ.get(cache_env, '')
+    if not cache:
+        return ''
+
+    return os.path.join(cache, arrays_subdir)
+
+
+def hash_arrays(arrays):
+    """
+    Compute a hash from the dtypes, shapes and contents of numpy arrays.
+
+    Parameters
+    ----------
+    arrays : list of numpy arrays (or objects numpy can convert)
+        arrays to hash
+
+    Returns
+    -------
+    key : string
+        hexadecimal md5 hash
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from mindboggle.utils.cache import hash_arrays
+    >>> faces = np.array([[0,1,2],[0,2,3]], dtype=np.int32)
+    >>> key = hash_arrays([faces])
+    >>> key == hash_arrays([faces.copy()])
+    True
+    >>> key == hash_arrays([faces[::-1]])
+    False
+
+    """
+    import hashlib
+    import numpy as np
+
+    md5 = hashlib.md5()
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        md5.update(str(array.dtype).encode('ascii'))
+        md5.update(str(array.shape).encode('ascii'))
+        md5.update(array.tobytes() if hasattr(array, 'tobytes')
+                   else array.tostring())
+
+    return md5.hexdigest()
+
+
+def load_cached_arrays(key, names, cache=''):
+    """
+    Load arrays from the cache as read-only memory maps.
+
+    Loading an entry marks it as recently used.
+
+    Parameters
+    ----------
+    key : string
+        hash identifying the cache entry (see hash_arrays())
+    names : list of strings
+        names of the arrays to load
+    cache : string
+        cache directory (default: $MINDBOGGLE_CACHE)
+
+    Returns
+    -------
+    arrays : list of numpy arrays (None if any are not in the cache)
+        arrays in the order of names
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from mindboggle.utils.cache import save_cached_arrays, load_cached_arrays
+    >>> cache = '/tmp/mindboggle_cache'
+    >>> save_cached_arrays('example', ['a'], [np.arange(3)], cache)
+    >>> load_cached_arrays('example', ['a'], cache)
+    [memmap([0, 1, 2])]
+
+    """
+    import os
+    import numpy as np
+
+    from mindboggle.utils.cache import cache_directory
+
+    array_dir = cache_directory(cache)
+    if not array_dir:
+        return None
+    entry = os.path.join(array_dir, key)
+
+    arrays = []
+    try:
+        for name in names:
+            arrays.append(np.load(os.path.join(entry, name + '.npy'),
+                                  mmap_mode='r'))
+        os.utime(entry, None)
+    except (IOError, OSError, ValueError):
+        # Missing, or removed by another process while loading:
+        return None
+
+    return arrays
+
+
+def save_cached_arrays(key, names, arrays, cache='', max_megabytes=None):
+    """
+    Save arrays to the cache, then remove least recently used entries.
+
+    Each array is written to a temporary file and renamed, so that other
+    processes only ever see complete files. Failure to write to the cache
+    is not an error: the arrays are simply not cached.
+
+    Parameters
+    ----------
+    key : string
+        hash identifying the cache entry (see hash_arrays())
+    names : list of strings
+        names of the arrays
+    arrays : list of numpy arrays
+        arrays to save
+    cache : string
+        cache directory (default: $MINDBOGGLE_CACHE)
+    max_megabytes : integer
+        maximum size of the cached arrays (default: max_cache_megabytes)
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from mindboggle.utils.cache import save_cached_arrays
+    >>> save_cached_arrays('example', ['a'], [np.arange(3)],
+    >>>                    '/tmp/mindboggle_cache')
+
+    """
+    import os
+    import tempfile
+    import numpy as np
+
+    from mindboggle.utils.cache import cache_directory, prune_cache
+
+    array_dir = cache_directory(cache)
+    if not array_dir:
+        return
+    entry = os.path.join(array_dir, key)
+
+    try:
+        if not os.path.isdir(entry):
+            try:
+                os.makedirs(entry)
+            except OSError:
+                # Created by another process in the meantime:
+                if not os.path.isdir(entry):
+                    raise
+        for name, array in zip(names, arrays):
+            fd, temp_file = tempfile.mkstemp(prefix='.' + name, suffix='.npy',
+                                             dir=entry)
+            try:
+                f = os.fdopen(fd, 'wb')
+                np.save(f, np.asarray(array))
+                f.close()
+                os.rename(temp_file, os.path.join(entry, name + '.npy'))
+            except:
+                if os.path.exists(temp_file):
+                    os.remove(temp_file)
+                raise
+    except (IOError, OSError):
+        print("Unable to cache arrays in {0}".format(entry))
+        return
+
+    prune_cache(array_dir, max_megabytes, keep=[key])
+
+
+def prune_cache(array_dir, max_megabytes=None, keep=[]):
+    """
+    Remove least recently used cache entries until under a size limit.
+
+    Entries are renamed before they are deleted, so that other processes
+    never load from a partially deleted entry.
+
+    Parameters
+    ----------
+    array_dir : string
+        directory for cached arrays (see cache_directory())
+    max_megabytes : integer
+        maximum size of the cached arrays (default: max_cache_megabytes)
+    keep : list of strings
+        keys of entries not to remove
+
+    Examples
+    --------
+    >>> from mindboggle.utils.cache import cache_directory, prune_cache
+    >>> prune_cache(cache_directory('/tmp/mindboggle_cache'), 0)
+
+    """
+    import os
+    import uuid
+    import shutil
+
+    from mindboggle.utils.cache import max_cache_megabytes
+
+    if max_megabytes is None:
+        max_megabytes = max_cache_megabytes
+    max_bytes = max_megabytes * 1024 * 1024
+
+    #-------------------------------------------------------------------------
+    # Find the size and last use of each entry:
+    #-------------------------------------------------------------------------
+    entries = []
+    total = 0
+    try:
+        keys = os.listdir(array_dir)
+    except OSError:
+        return
+    for key in keys:
+        entry = os.path.join(array_dir, key)
+        if key.startswith('.removed.'):
+            # Left over if a writer added to an entry while it was deleted:
+            shutil.rmtree(entry, ignore_errors=True)
+            continue
+        if key.startswith('.') or not os.path.isdir(entry):
+            continue
+        try:
+            size = sum([os.path.getsize(os.path.join(entry, x))
+                        for x in os.listdir(entry)])
+            entries.append((os.path.getmtime(entry), size, key))
+        except OSError:
+            continue
+        total += size
+
+    #-------------------------------------------------------------------------
+    # Remove entries, oldest first:
+    #-------------------------------------------------------------------------
+    for mtime, size, key in sorted(entries):
+        if total <= max_bytes:
+            break
+        if key in keep:
+            continue
+        entry = os.path.join(array_dir, key)
+        removed = os.path.join(array_dir, '.removed.{0}.{1}.{2}'.
+                               format(key, os.getpid(), uuid.uuid4().hex))
+        try:
+            os.rename(entry, removed)
+        except OSError:
+            # Already removed by another process:
+            continue
+        shutil.rmtree(removed, ignore_errors=True)
+        total -= size
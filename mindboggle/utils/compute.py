@@ -443,6 +443,71 @@ def median_abs_dev(X, W=[], precision=1, c=1.0):
     return mad
 
 
+def percentile_per_group(values, indptr, p):
+    """
+    Compute a percentile of each of many groups of values at once.
+
+    The values of group i are values[indptr[i]:indptr[i+1]] (as for the
+    rows of a compressed sparse row matrix). All groups are sorted together,
+    and each percentile is linearly interpolated as in numpy.percentile().
+
+    Parameters
+    ----------
+    values : numpy array of floats
+        values of all groups, concatenated
+    indptr : numpy array of integers (length number of groups + 1)
+        offsets to the values of each group
+    p : float in range of [0,100]
+        percentile
+
+    Returns
+    -------
+    percentiles : numpy array of floats
+        percentile for each group (nan for empty groups)
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from mindboggle.utils.compute import percentile_per_group
+    >>> values = np.array([3, 1, 2, 10, 0, 5, 4, 3, 2, 1], dtype=float)
+    >>> indptr = np.array([0, 3, 4, 4, 10])
+    >>> percentile_per_group(values, indptr, 50)
+    array([ 2. , 10. ,  nan,  2.5])
+    >>> [np.percentile(values[0:3], 50), np.percentile(values[4:10], 50)]
+    [2.0, 2.5]
+
+    """
+    import numpy as np
+
+    values = np.asarray(values, dtype=np.float64)
+    indptr = np.asarray(indptr, dtype=np.int64)
+    counts = np.diff(indptr)
+    groups = np.repeat(np.arange(len(counts)), counts)
+
+    # Sort values within each group (rank all values, then sort integer keys
+    # packing group and rank, which is faster than a lexsort):
+    nvalues = len(values)
+    order = np.argsort(values)
+    keys = np.sort(groups[order] * nvalues + np.arange(nvalues))
+    sorted_values = values[order][keys % nvalues]
+
+    # Interpolate between the two values closest to each percentile:
+    percentiles = np.nan * np.ones(len(counts))
+    full = counts > 0
+    position = p / 100.0 * (counts[full] - 1)
+    below = np.floor(position).astype(np.int64)
+    above = np.minimum(below + 1, counts[full] - 1)
+    t = position - below
+    a = sorted_values[indptr[:-1][full] + below]
+    b = sorted_values[indptr[:-1][full] + above]
+    # (same arithmetic as numpy's linear interpolation, for equal results)
+    diff_b_a = b - a
+    percentiles[full] = np.where(t >= 0.5, b - diff_b_a * (1 - t),
+                                 a + diff_b_a * t)
+
+    return percentiles
+
+
 def means_per_label(values, labels, include_labels=[], exclude_labels=[], areas=[]):
     """
     Compute the mean value across vertices per label,
@@ -12,8 +12,6 @@ Authors:
 Copyright 2012,  Mindboggle team (http://mindboggle.info), Apache v2.0 License
 
 """
-import networkx as nx
-
 from mindboggle.utils.kernels import rbf_kernel
 
 
@@ -59,10 +57,13 @@ def diagonal_degree_matrix(W, inverse=False, square_root=False):
 #    Matrix weights and affinity matrix
 #-----------------------------------------------------------------------------
 def weight_graph(Nodes, Indices, Meshes, kernel=rbf_kernel, add_to_graph=True,
-                 G=nx.Graph(), sigma=20):
+                 G=None, sigma=20):
     """
     Construct weighted edges of a graph and compute an affinity matrix.
 
+    The kernel computes the weights of all edges at once, and the affinity
+    matrix is assembled from arrays of edges and weights in one step.
+
     Parameters
     ----------
     Nodes : numpy array
@@ -74,7 +75,7 @@ def weight_graph(Nodes, Indices, Meshes, kernel=rbf_kernel, add_to_graph=True,
         - inverse_distance: additional kernel where the weight is the inverse
           of the distance between two nodes
     add_to_graph :  boolean (add to graph?)
-    G :  networkx graph
+    G :  networkx graph (default: new graph, if add_to_graph)
     sigma :  float (parameter for rbf_kernel)
 
     Returns
@@ -84,9 +85,13 @@ def weight_graph(Nodes, Indices, Meshes, kernel=rbf_kernel, add_to_graph=True,
 
     """
     import numpy as np
-    from scipy.sparse import lil_matrix
+    from scipy.sparse import coo_matrix
     from mindboggle.utils.kernels import rbf_kernel, cotangent_kernel, inverse_distance
 
+    if add_to_graph and G is None:
+        import networkx as nx
+        G = nx.Graph()
+
     if kernel is rbf_kernel or kernel is inverse_distance:
         if kernel is rbf_kernel:
             print('Compute weights using rbf kernel (sigma={0})'.format(sigma))
@@ -95,26 +100,39 @@ def weight_graph(Nodes, Indices, Meshes, kernel=rbf_kernel, add_to_graph=True,
                   format(sigma))
 
         # Construct matrix of edge lines by breaking triangle into three edges.
+        Meshes = np.asarray(Meshes)
         if Meshes.shape[1] == 3:
             edge_mat = np.vstack((Meshes.T[0:2].T, Meshes.T[1:3].T, Meshes.T[:3:2].T))
         elif Meshes.shape[1] == 2:
             edge_mat = Meshes
-        # Augment matrix to contain edge weight in the third column
-        weighted_edges = np.asarray([[Indices[i], Indices[j],
-            kernel(Nodes[Indices[i]], Nodes[Indices[j]], sigma)]
-            for [i, j] in edge_mat])
+        edge_mat = np.asarray(Indices)[edge_mat].astype(np.int64)
+
+        # Keep one of each edge (edges are shared by faces),
+        # and compute edge weights
+        num_nodes = Nodes.shape[0]
+        edge_mat = np.sort(edge_mat, axis=1)
+        keys = np.sort(edge_mat[:, 0] * num_nodes + edge_mat[:, 1])
+        keys = keys[np.hstack(([True], keys[1:] != keys[:-1]))]
+        edge_mat = np.column_stack((keys // num_nodes, keys % num_nodes))
+        edge_weights = kernel(Nodes[edge_mat[:, 0]], Nodes[edge_mat[:, 1]],
+                              sigma)
 
         # Add weights to graph
         if add_to_graph:
             print('Add weighted edges to the graph')
-            G.add_weighted_edges_from(weighted_edges)
+            G.add_weighted_edges_from(zip(edge_mat[:, 0].tolist(),
+                                          edge_mat[:, 1].tolist(),
+                                          edge_weights.tolist()))
 
         # Construct affinity matrix
         print('Construct sparse affinity matrix of size {0}'.
-              format(Nodes.shape[0]))
-        affinity_matrix = lil_matrix((Nodes.shape[0], Nodes.shape[0]))
-        for [i, j, edge_weight] in weighted_edges:
-            affinity_matrix[i, j] = affinity_matrix[j, i] = edge_weight
+              format(num_nodes))
+        affinity_matrix = coo_matrix(
+            (np.hstack((edge_weights, edge_weights)),
+             (np.hstack((edge_mat[:, 0], edge_mat[:, 1])),
+              np.hstack((edge_mat[:, 1], edge_mat[:, 0])))),
+            shape=(num_nodes, num_nodes)).tocsr()
+        affinity_matrix.eliminate_zeros()
 
     elif kernel is cotangent_kernel:
         print('Compute weights using cotangents')
@@ -122,15 +140,11 @@ def weight_graph(Nodes, Indices, Meshes, kernel=rbf_kernel, add_to_graph=True,
 
         # Add weights to graph
         if add_to_graph:
-            edges = np.nonzero(affinity_matrix)
-            edge_mat = np.hstack((edges[0].T[:, np.newaxis],
-                                  edges[1].T[:, np.newaxis]))
-            weighted_edges = np.asarray([[edge_mat[i,0],
-                                          edge_mat[i,1],
-                                          affinity_matrix[edge_mat[i]]]
-                                          for i in range(affinity_matrix.shape[0])])
+            edges = affinity_matrix.tocoo()
             print('Add weighted edges to the graph')
-            G.add_weighted_edges_from(weighted_edges)
+            G.add_weighted_edges_from(zip(edges.row.tolist(),
+                                          edges.col.tolist(),
+                                          edges.data.tolist()))
 
     # Return the affinity matrix as a "compressed sparse row" matrix
     # (http://docs.scipy.org/doc/scipy/reference/sparse.html)
@@ -40,13 +40,9 @@ def read_vertices(Filename):
         It may not be the vertices in your 3-D surface.
 
     """
-    import vtk
-
-    Reader = vtk.vtkDataSetReader()
-    Reader.SetFileName(Filename)
-    Reader.Update()
+    from mindboggle.utils.io_vtk import read_vtk_polydata
 
-    Data = Reader.GetOutput()
+    Data, scalar_names = read_vtk_polydata(Filename, read_all_scalars=False)
 
     Vrts = Data.GetVerts()
     indices = [Vrts.GetData().GetValue(i) for i in range(1, Vrts.GetSize())]
@@ -75,13 +71,9 @@ def read_lines(Filename):
         each element is a scalar value corresponding to a vertex
 
     """
-    import vtk
-
-    Reader = vtk.vtkDataSetReader()
-    Reader.SetFileName(Filename)
-    Reader.Update()
+    from mindboggle.utils.io_vtk import read_vtk_polydata
 
-    Data = Reader.GetOutput()
+    Data, scalar_names = read_vtk_polydata(Filename)
     Lns = Data.GetLines()
 
     lines  = [[Lns.GetData().GetValue(j) for j in range(i*3+1, i*3+3) ]
@@ -89,15 +81,665 @@ def read_lines(Filename):
 
     PointData = Data.GetPointData()
     print("There are {0} scalars in file {1}".format(
-        Reader.GetNumberOfscalarsInFile(), Filename))
-    print("Loading the scalar {0}".format(Reader.GetScalarsNameInFile(0)))
-    ScalarsArray = PointData.GetArray(Reader.GetScalarsNameInFile(0))
+        len(scalar_names), Filename))
+    print("Loading the scalar {0}".format(scalar_names[0]))
+    ScalarsArray = PointData.GetArray(scalar_names[0])
     scalars = [ScalarsArray.GetValue(i)
                for i in range(0, ScalarsArray.GetSize())]
 
     return lines, scalars
 
 
+def read_vtk_arrays(input_vtk):
+    """
+    Load faces, lines, indices, points, #points,
+    and all scalar lookup tables from a VTK file as numpy arrays.
+
+    The arrays are taken directly from the data buffers of the VTK reader's
+    output (via vtk.util.numpy_support), so there is no per-element loop.
+    Points retain the precision stored in the file (float32 or float64).
+    Legacy ASCII, legacy binary and XML PolyData files are all accepted
+    (see vtk_file_format()).
+
+    Parameters
+    ----------
+    input_vtk : string
+        path/filename of a VTK format file
+
+    Returns
+    -------
+    faces : (F,3) numpy array of int32
+        indices of the 3 vertices that form each face on a surface mesh
+    lines : (L,2) numpy array of int32
+        indices of the 2 vertices of each line (edge) on a mesh
+    indices : 1-D numpy array of int32
+        indices of vertices in the VERTICES segment
+    points : (N,3) numpy array of floats
+        coordinates of the points
+    npoints : int
+        number of vertices in the mesh
+    scalars : list of 1-D numpy arrays
+        one array of scalar values per lookup table
+    scalar_names : list of strings
+        name of each lookup table
+    input_vtk : string
+        path/filename of the input VTK format file
+
+    Examples
+    --------
+    >>> import os
+    >>> from mindboggle.utils.io_vtk import read_vtk_arrays
+    >>> path = os.environ['MINDBOGGLE_DATA']
+    >>> input_vtk = os.path.join(path, 'arno', 'shapes', 'lh.pial.mean_curvature.vtk')
+    >>> faces, lines, indices, points, npoints, scalars, names, input_vtk = read_vtk_arrays(input_vtk)
+    >>> points.shape
+    (145069, 3)
+
+    """
+    import os
+    import numpy as np
+    from vtk.util.numpy_support import vtk_to_numpy
+
+    from mindboggle.utils.io_vtk import read_vtk_polydata
+
+    Data, names_in_file = read_vtk_polydata(input_vtk)
+    PointData = Data.GetPointData()
+
+    npoints = Data.GetNumberOfPoints()
+    if npoints > 0:
+        points = vtk_to_numpy(Data.GetPoints().GetData())
+    else:
+        points = np.zeros((0, 3))
+
+    # Cell arrays are stored as [n, i0, ..., i(n-1), n, ...]:
+    if Data.GetNumberOfPolys() > 0:
+        faces = vtk_to_numpy(Data.GetPolys().GetData())
+        faces = faces.reshape(-1, 4)[:, 1:].astype(np.int32)
+    else:
+        faces = np.zeros((0, 3), dtype=np.int32)
+
+    if Data.GetNumberOfLines() > 0:
+        lines = vtk_to_numpy(Data.GetLines().GetData())
+        lines = lines.reshape(-1, 3)[:, 1:].astype(np.int32)
+    else:
+        lines = np.zeros((0, 2), dtype=np.int32)
+
+    if Data.GetNumberOfVerts() > 0:
+        indices = vtk_to_numpy(Data.GetVerts().GetData())[1:].astype(np.int32)
+    else:
+        indices = np.zeros(0, dtype=np.int32)
+
+    scalars = []
+    scalar_names = []
+
+    for scalar_index, scalar_name in enumerate(names_in_file):
+
+        n_scalars = scalar_index + 1
+        if n_scalars == 1:
+            print("Load \"{0}\" scalars from {1}".
+                  format(scalar_name, os.path.basename(input_vtk)))
+        else:
+            print("Load \"{0}\" (of {1} scalars) from {2}".
+                  format(scalar_name, n_scalars,
+                         os.path.basename(input_vtk)))
+
+        scalar_array = PointData.GetArray(scalar_name)
+        if scalar_array:
+            scalars.append(vtk_to_numpy(scalar_array))
+            scalar_names.append(scalar_name)
+
+    return faces, lines, indices, points, npoints, scalars, scalar_names, \
+           input_vtk
+
+
+def read_vtk_polydata(input_vtk, read_all_scalars=True):
+    """
+    Read a VTK file with the VTK reader for its format.
+
+    Legacy ASCII and binary files are read with vtkDataSetReader,
+    and XML PolyData files with vtkXMLPolyDataReader
+    (see vtk_file_format()), whatever the file name's extension.
+
+    Parameters
+    ----------
+    input_vtk : string
+        path/filename of a VTK format file
+    read_all_scalars : Boolean
+        read all scalar lookup tables of a legacy file (not just the first)?
+
+    Returns
+    -------
+    Data : vtkPolyData
+        output of the VTK reader
+    scalar_names : list of strings
+        names of the scalar lookup tables in the file
+
+    Examples
+    --------
+    >>> import os
+    >>> from mindboggle.utils.io_vtk import read_vtk_polydata
+    >>> path = os.environ['MINDBOGGLE_DATA']
+    >>> input_vtk = os.path.join(path, 'arno', 'features', 'folds.vtk')
+    >>> Data, scalar_names = read_vtk_polydata(input_vtk)
+    >>> scalar_names
+    ['folds']
+
+    """
+    import vtk
+
+    from mindboggle.utils.io_vtk import vtk_file_format
+
+    if vtk_file_format(input_vtk) == 'vtp':
+        Reader = vtk.vtkXMLPolyDataReader()
+        Reader.SetFileName(input_vtk)
+        Reader.Update()
+        Data = Reader.GetOutput()
+        PointData = Data.GetPointData()
+        scalar_names = [PointData.GetArrayName(i)
+                        for i in range(PointData.GetNumberOfArrays())]
+    else:
+        Reader = vtk.vtkDataSetReader()
+        Reader.SetFileName(input_vtk)
+        if read_all_scalars:
+            Reader.ReadAllScalarsOn()  # Activate the reading of all scalars
+        Reader.Update()
+        Data = Reader.GetOutput()
+        scalar_names = [Reader.GetScalarsNameInFile(i)
+                        for i in range(Reader.GetNumberOfScalarsInFile())]
+
+    return Data, scalar_names
+
+
+def vtk_file_format(filename):
+    """
+    Detect the format of a VTK file from its header.
+
+    Parameters
+    ----------
+    filename : string
+        path/filename of a VTK format file
+
+    Returns
+    -------
+    file_format : string
+        'ascii' or 'binary' for legacy VTK files, 'vtp' for XML PolyData
+
+    Examples
+    --------
+    >>> import os
+    >>> from mindboggle.utils.io_vtk import vtk_file_format
+    >>> path = os.environ['MINDBOGGLE_DATA']
+    >>> vtk_file_format(os.path.join(path, 'arno', 'features', 'folds.vtk'))
+    'ascii'
+
+    """
+    Fp = open(filename, 'rb')
+    header = Fp.read(1024)
+    Fp.close()
+
+    if header.lstrip().startswith(b'<'):
+        file_format = 'vtp'
+    else:
+        # Legacy files: version line, title line, then ASCII or BINARY:
+        header_lines = header.split(b'\n')
+        if len(header_lines) > 2 and \
+                header_lines[2].strip().upper().startswith(b'BINARY'):
+            file_format = 'binary'
+        else:
+            file_format = 'ascii'
+
+    return file_format
+
+
+def get_vtk_format(file_format=''):
+    """
+    Resolve the output format for writing VTK files.
+
+    If no format is given, the pipeline-wide default is taken from the
+    MINDBOGGLE_VTK_FORMAT environment variable (set by the mindboggle
+    --vtk_format option), else 'ascii'.
+
+    Parameters
+    ----------
+    file_format : string
+        'ascii' or 'binary' (legacy VTK), 'vtp' (zlib-compressed XML
+        PolyData), or '' for the pipeline-wide default
+
+    Returns
+    -------
+    file_format : string
+        'ascii', 'binary' or 'vtp'
+
+    Examples
+    --------
+    >>> from mindboggle.utils.io_vtk import get_vtk_format
+    >>> get_vtk_format('BINARY')
+    'binary'
+
+    """
+    import os
+
+    if not file_format:
+        file_format = os.environ.get('MINDBOGGLE_VTK_FORMAT', 'ascii')
+    file_format = file_format.lower()
+    if file_format not in ['ascii', 'binary', 'vtp']:
+        raise ValueError("Unrecognized VTK file format: {0}".
+                         format(file_format))
+
+    return file_format
+
+
+def index_vtk_scalars(filename):
+    """
+    Find the byte offsets of the sections and scalar tables in a legacy
+    VTK file.
+
+    Only the section headers are read: ASCII files are searched for
+    keyword lines, and binary sections are skipped by their declared sizes.
+
+    Parameters
+    ----------
+    filename : string
+        path/filename of a legacy (ASCII or binary) VTK format file
+
+    Returns
+    -------
+    index : dictionary (or None if the file cannot be indexed)
+        'format', 'size' and 'mtime' of the file;
+        'sections': a list of [keyword, start, end] byte offsets of each
+        geometry section (POINTS, POLYGONS, ...);
+        'point_data': byte offset of the POINT_DATA line (or file size);
+        'npoints': number of points;
+        'tables': a list of dictionaries with the 'name', 'type', 'ncomp',
+        'start' and 'end' (byte offsets of the values) of each scalar table
+
+    Examples
+    --------
+    >>> import os
+    >>> from mindboggle.utils.io_vtk import index_vtk_scalars
+    >>> path = os.environ['MINDBOGGLE_DATA']
+    >>> input_vtk = os.path.join(path, 'arno', 'shapes', 'lh.pial.travel_depth.vtk')
+    >>> index = index_vtk_scalars(input_vtk)
+    >>> [x['name'] for x in index['tables']]
+    ['travel_depth']
+
+    """
+    import os
+    import re
+    import mmap
+
+    from mindboggle.utils.io_vtk import vtk_file_format
+
+    # Bytes per value of VTK types that can be skipped in binary files:
+    nbytes = {'float': 4, 'double': 8, 'int': 4, 'unsigned_int': 4,
+              'short': 2, 'unsigned_short': 2, 'char': 1,
+              'unsigned_char': 1, 'vtktypeint64': 8, 'vtktypeuint64': 8}
+    keyword = re.compile(b'\n[A-Z]')
+
+    file_format = vtk_file_format(filename)
+    if file_format == 'vtp':
+        return None
+    binary = file_format == 'binary'
+    stat = os.stat(filename)
+    if stat.st_size == 0:
+        return None
+
+    Fp = open(filename, 'rb')
+    mm = mmap.mmap(Fp.fileno(), 0, access=mmap.ACCESS_READ)
+    size = len(mm)
+
+    def next_line(pos):
+        # Return the next non-blank line, its start, and the position after:
+        while pos < size:
+            end = mm.find(b'\n', pos)
+            if end < 0:
+                end = size
+            line = mm[pos:end].strip()
+            if line:
+                return line, pos, end + 1
+            pos = end + 1
+        return b'', size, size
+
+    def next_keyword(pos):
+        # Return the start of the next line that begins with a keyword:
+        match = keyword.search(mm, pos)
+        if match:
+            return match.start() + 1
+        else:
+            return size
+
+    index = None
+    try:
+        # Header: version, title, ASCII/BINARY, DATASET lines
+        # (version 5 files store cells as offsets and connectivity):
+        version, start, pos = next_line(0)
+        if b'Version 5' in version:
+            return None
+        pos = mm.find(b'\n', pos) + 1
+        pos = mm.find(b'\n', pos) + 1
+        pos = mm.find(b'\n', pos) + 1
+
+        # Record the location of each geometry section:
+        sections = []
+        npoints = 0
+        point_data = size
+        while True:
+            line, start, pos = next_line(pos)
+            words = line.split()
+            if not words:
+                break
+            key = words[0].upper()
+            if key == b'POINT_DATA':
+                point_data = start
+                npoints = int(words[1])
+                break
+            elif binary:
+                if key == b'POINTS':
+                    npoints = int(words[1])
+                    end = pos + npoints * 3 * \
+                          nbytes[words[2].lower().decode()]
+                elif key in [b'VERTICES', b'LINES', b'POLYGONS',
+                             b'TRIANGLE_STRIPS']:
+                    end = pos + int(words[2]) * 4
+                else:
+                    return None
+            else:
+                if key == b'POINTS':
+                    npoints = int(words[1])
+                end = next_keyword(pos)
+            sections.append([key.decode(), start, end])
+            pos = end
+
+        # Record the location of each scalar table:
+        tables = []
+        while pos < size:
+            line, start, pos = next_line(pos)
+            words = line.split()
+            if not words:
+                break
+            key = words[0].upper()
+            if key == b'SCALARS':
+                vtk_type = words[2].lower().decode()
+                if len(words) > 3:
+                    ncomp = int(words[3])
+                else:
+                    ncomp = 1
+                line, start, pos2 = next_line(pos)
+                if line.upper().startswith(b'LOOKUP_TABLE'):
+                    pos = pos2
+                if binary:
+                    if vtk_type not in nbytes:
+                        break
+                    end = pos + npoints * ncomp * nbytes[vtk_type]
+                else:
+                    end = next_keyword(pos)
+                tables.append({'name': words[1].decode(), 'type': vtk_type,
+                               'ncomp': ncomp, 'start': pos, 'end': end})
+                pos = end
+            elif binary or key == b'CELL_DATA':
+                # Other sections of binary files can't be skipped safely:
+                break
+            else:
+                pos = next_keyword(pos)
+
+        index = {'format': file_format, 'size': stat.st_size,
+                 'mtime': stat.st_mtime, 'sections': sections,
+                 'point_data': point_data, 'npoints': npoints,
+                 'tables': tables}
+    except (ValueError, IndexError, KeyError):
+        index = None
+    finally:
+        mm.close()
+        Fp.close()
+
+    return index
+
+
+def read_vtk_index(filename, use_index=True):
+    """
+    Load (or create and store) the offset index of a legacy VTK file.
+
+    If a cache directory is set ($MINDBOGGLE_CACHE, see
+    mindboggle.utils.cache), the index from index_vtk_scalars() is stored
+    there in a small file named by a hash of the VTK file's path, size and
+    modification time, so it is reused until the VTK file changes.
+    Nothing is written next to the VTK file.
+
+    Parameters
+    ----------
+    filename : string
+        path/filename of a VTK format file
+    use_index : Boolean
+        read and store the offset index file in the cache directory?
+
+    Returns
+    -------
+    index : dictionary (or None if the file cannot be indexed)
+        see index_vtk_scalars()
+
+    Examples
+    --------
+    >>> import os
+    >>> from mindboggle.utils.io_vtk import read_vtk_index
+    >>> path = os.environ['MINDBOGGLE_DATA']
+    >>> input_vtk = os.path.join(path, 'arno', 'shapes', 'lh.pial.travel_depth.vtk')
+    >>> index = read_vtk_index(input_vtk)
+
+    """
+    import os
+    import json
+    import hashlib
+
+    from mindboggle.utils.io_vtk import index_vtk_scalars
+    from mindboggle.utils.cache import cache_directory
+
+    array_dir = cache_directory()
+    if not use_index or not array_dir:
+        return index_vtk_scalars(filename)
+
+    index = None
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    key = hashlib.md5(repr((os.path.abspath(filename), stat.st_size,
+                            stat.st_mtime)).encode('utf-8')).hexdigest()
+    index_file = os.path.join(array_dir, 'vtk_index_' + key + '.json')
+    if os.path.exists(index_file):
+        try:
+            index = json.load(open(index_file, 'r'))
+            if index['size'] != stat.st_size or \
+               index['mtime'] != stat.st_mtime or \
+               'sections' not in index:
+                index = None
+        except (IOError, OSError, ValueError, KeyError):
+            index = None
+
+    if index is None:
+        index = index_vtk_scalars(filename)
+        if index is not None:
+            # Write to a temporary file and rename, for concurrent readers:
+            try:
+                if not os.path.isdir(array_dir):
+                    os.makedirs(array_dir)
+                temp_file = '{0}.{1}'.format(index_file, os.getpid())
+                Fp = open(temp_file, 'w')
+                json.dump(index, Fp)
+                Fp.close()
+                os.rename(temp_file, index_file)
+            except (IOError, OSError):
+                pass
+
+    return index
+
+
+def read_scalar_arrays(filename, scalar_names=[], return_first=False,
+                       use_index=True):
+    """
+    Load scalar lookup tables from a VTK file without reading its geometry.
+
+    The scalar tables of a legacy VTK file are located with
+    read_vtk_index(), and only the requested tables are decoded.
+    If a cache directory is set ($MINDBOGGLE_CACHE), the index is stored
+    there, so that later reads seek directly to the tables.
+    XML PolyData files, and tables that cannot be located this way,
+    are read with read_vtk_arrays().
+
+    Parameters
+    ----------
+    filename : string
+        path/filename of a VTK format file
+    scalar_names : string or list of strings
+        names of the tables to load (all tables if empty)
+    return_first : Boolean
+        load only the first (requested) table?
+    use_index : Boolean
+        read and store the offset index file in the cache directory?
+
+    Returns
+    -------
+    scalars : list of numpy arrays
+        one array of scalar values per lookup table
+    scalar_names : list of strings
+        name of each lookup table
+
+    Examples
+    --------
+    >>> import os
+    >>> from mindboggle.utils.io_vtk import read_scalar_arrays
+    >>> path = os.environ['MINDBOGGLE_DATA']
+    >>> input_vtk = os.path.join(path, 'arno', 'shapes', 'lh.pial.travel_depth.vtk')
+    >>> scalars, names = read_scalar_arrays(input_vtk, 'travel_depth')
+    >>> names
+    ['travel_depth']
+
+    """
+    import os
+    import numpy as np
+
+    from mindboggle.utils.io_vtk import read_vtk_index, read_vtk_arrays
+
+    dtypes = {'float': 'f4', 'double': 'f8', 'int': 'i4',
+              'unsigned_int': 'u4', 'short': 'i2', 'unsigned_short': 'u2',
+              'char': 'i1', 'unsigned_char': 'u1', 'vtktypeint64': 'i8',
+              'vtktypeuint64': 'u8'}
+
+    if isinstance(scalar_names, str):
+        scalar_names = [scalar_names]
+
+    index = read_vtk_index(filename, use_index)
+
+    #-------------------------------------------------------------------------
+    # Select tables:
+    #-------------------------------------------------------------------------
+    if index is not None:
+        tables = [x for x in index['tables']
+                  if not scalar_names or x['name'] in scalar_names]
+        if scalar_names:
+            found = [x['name'] for x in tables]
+            if [x for x in scalar_names if x not in found]:
+                index = None
+        if [x for x in tables if x['type'] not in dtypes]:
+            index = None
+    if index is None:
+        faces, lines, indices, points, npoints, scalars, names, \
+            foo1 = read_vtk_arrays(filename)
+        if scalar_names:
+            scalars = [x for x, name in zip(scalars, names)
+                       if name in scalar_names]
+            names = [x for x in names if x in scalar_names]
+        if return_first:
+            scalars, names = scalars[0:1], names[0:1]
+        return scalars, names
+    if return_first:
+        tables = tables[0:1]
+
+    #-------------------------------------------------------------------------
+    # Decode the values of each selected table:
+    #-------------------------------------------------------------------------
+    scalars = []
+    names = []
+    Fp = open(filename, 'rb')
+    for table in tables:
+        print("Load \"{0}\" scalars from {1}".
+              format(table['name'], os.path.basename(filename)))
+        count = index['npoints'] * table['ncomp']
+        Fp.seek(table['start'])
+        data = Fp.read(table['end'] - table['start'])
+        dtype = np.dtype(dtypes[table['type']])
+        if index['format'] == 'binary':
+            scalar = np.frombuffer(data, dtype=dtype.newbyteorder('>'),
+                                   count=count).astype(dtype)
+        else:
+            scalar = np.array(data.split()[0:count],
+                              dtype=np.float64).astype(dtype)
+        if table['ncomp'] > 1:
+            scalar = scalar.reshape(-1, table['ncomp'])
+        scalars.append(scalar)
+        names.append(table['name'])
+    Fp.close()
+
+    return scalars, names
+
+
+def scalar_arrays_to_lists(scalars, scalar_names, return_first=True,
+                           return_array=False):
+    """
+    Convert scalar arrays from read_vtk_arrays() to the list API.
+
+    Values are converted to Python floats and integers (or to float64 and
+    int arrays if return_array), as if read one at a time from VTK.
+
+    Parameters
+    ----------
+    scalars : list of numpy arrays
+        one array of scalar values per lookup table
+    scalar_names : list of strings
+        name of each lookup table
+    return_first : Boolean
+        Return only the first list of scalar values?
+    return_array : Boolean (only if return_first)
+        Return first list of scalars as a numpy array?
+
+    Returns
+    -------
+    scalars : list or list of lists of floats or integers (or numpy array)
+        scalar values for the vertices of a mesh
+    scalar_names : string or list of strings
+        name(s) of lookup table(s)
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from mindboggle.utils.io_vtk import scalar_arrays_to_lists
+    >>> scalar_arrays_to_lists([np.array([1,2], dtype=np.float32)], ['a'])
+    ([1.0, 2.0], 'a')
+
+    """
+    import numpy as np
+
+    if return_first:
+        if scalars:
+            scalars = scalars[0]
+            if return_array:
+                if scalars.dtype.kind == 'f':
+                    scalars = scalars.astype(np.float64)
+                else:
+                    scalars = scalars.astype(int)
+            else:
+                scalars = scalars.tolist()
+        elif return_array:
+            scalars = np.array(scalars)
+        if scalar_names:
+            scalar_names = scalar_names[0]
+        else:
+            scalar_names = ''
+    else:
+        scalars = [x.tolist() for x in scalars]
+
+    return scalars, scalar_names
+
+
 def read_points(filename):
     """
     Load points of a VTK surface file.
@@ -113,18 +755,12 @@ def read_points(filename):
         each element is a list of 3-D coordinates of a surface mesh vertex
 
     """
-    import vtk
+    from mindboggle.utils.io_vtk import read_vtk_arrays
 
-    Reader = vtk.vtkDataSetReader()
-    Reader.SetFileName(filename)
-    Reader.ReadAllScalarsOn()  # Activate the reading of all scalars
-    Reader.Update()
-
-    Data = Reader.GetOutput()
-    points = [list(Data.GetPoint(point_id))
-              for point_id in range(Data.GetNumberOfPoints())]
+    faces, lines, indices, points, npoints, scalars, scalar_names, \
+        foo1 = read_vtk_arrays(filename)
 
-    return points
+    return points.tolist()
 
 
 def read_faces_points(filename):
@@ -155,26 +791,12 @@ def read_faces_points(filename):
     >>> faces, points, npoints = read_faces_points(folds_file)
 
     """
-    import vtk
-
-    Reader = vtk.vtkDataSetReader()
-    Reader.SetFileName(filename)
-    Reader.ReadAllScalarsOn()  # Activate the reading of all scalars
-    Reader.Update()
+    from mindboggle.utils.io_vtk import read_vtk_arrays
 
-    Data = Reader.GetOutput()
-    points = [list(Data.GetPoint(point_id))
-              for point_id in range(Data.GetNumberOfPoints())]
-    npoints = len(points)
-
-    if Data.GetNumberOfPolys() > 0:
-        faces = [[int(Data.GetPolys().GetData().GetValue(j))
-                  for j in range(i*4 + 1, i*4 + 4)]
-                  for i in range(Data.GetPolys().GetNumberOfCells())]
-    else:
-        faces = []
+    faces, lines, indices, points, npoints, scalars, scalar_names, \
+        foo1 = read_vtk_arrays(filename)
 
-    return faces, points, npoints
+    return faces.tolist(), points.tolist(), npoints
 
 
 def read_scalars(filename, return_first=True, return_array=False):
@@ -206,50 +828,14 @@ def read_scalars(filename, return_first=True, return_array=False):
     >>> mean_curvatures, name = read_scalars(curv_file)
 
     """
-    import os
-    import vtk
-    if return_first and return_array:
-        import numpy as np
+    from mindboggle.utils.io_vtk import read_scalar_arrays, \
+        scalar_arrays_to_lists
 
-    Reader = vtk.vtkDataSetReader()
-    Reader.SetFileName(filename)
-    Reader.ReadAllScalarsOn()  # Activate the reading of all scalars
-    Reader.Update()
-    Data = Reader.GetOutput()
-    PointData = Data.GetPointData()
+    scalars, scalar_names = read_scalar_arrays(filename,
+                                               return_first=return_first)
 
-    scalars = []
-    scalar_names = []
-    if Reader.GetNumberOfScalarsInFile() > 0:
-        for scalar_index in range(Reader.GetNumberOfScalarsInFile()):
-            scalar_name = Reader.GetScalarsNameInFile(scalar_index)
-
-            n_scalars = scalar_index + 1
-            if n_scalars == 1:
-                print("Load \"{0}\" scalars from {1}".
-                      format(scalar_name, os.path.basename(filename)))
-            else:
-                print("Load \"{0}\" (of {1} scalars) from {2}".
-                      format(scalar_name, n_scalars,
-                             os.path.basename(filename)))
-
-            scalar_array = PointData.GetArray(scalar_name)
-            scalar = [scalar_array.GetValue(i)
-                      for i in range(scalar_array.GetSize())]
-            scalars.append(scalar)
-            scalar_names.append(scalar_name)
-
-    if return_first:
-        if scalars:
-            scalars = scalars[0]
-        if return_array:
-            scalars = np.array(scalars)
-        if scalar_names:
-            scalar_names = scalar_names[0]
-        else:
-            scalar_names = ''
-
-    return scalars, scalar_names
+    return scalar_arrays_to_lists(scalars, scalar_names, return_first,
+                                  return_array)
 
 
 def read_vtk(input_vtk, return_first=True, return_array=False):
@@ -257,6 +843,8 @@ def read_vtk(input_vtk, return_first=True, return_array=False):
     Load faces, lines, indices, points, #points,
     and all scalar lookup tables from a VTK file.
 
+    This is a list-based wrapper around read_vtk_arrays().
+
     Note ::
 
         1. This supports copying lines, vertices (indices of points),
@@ -303,77 +891,16 @@ def read_vtk(input_vtk, return_first=True, return_array=False):
     >>> faces, lines, indices, points, npoints, depths, name, input_vtk = read_vtk(input_vtk)
 
     """
-    import os
-    import vtk
-    if return_first and return_array:
-        import numpy as np
-
-    Reader = vtk.vtkDataSetReader()
-    Reader.SetFileName(input_vtk)
-    Reader.ReadAllScalarsOn()  # Activate the reading of all scalars
-    Reader.Update()
-
-    Data = Reader.GetOutput()
-    PointData = Data.GetPointData()
-    points = [list(Data.GetPoint(point_id))
-              for point_id in range(0, Data.GetNumberOfPoints())]
-    npoints = len(points)
-
-    if Data.GetNumberOfPolys() > 0:
-        faces = [[int(Data.GetPolys().GetData().GetValue(j))
-                  for j in range(i*4 + 1, i*4 + 4)]
-                  for i in range(Data.GetPolys().GetNumberOfCells())]
-    else:
-        faces = []
-
-    if Data.GetNumberOfLines() > 0:
-        lines  = [[Data.GetLines().GetData().GetValue(j)
-                   for j in range(i*3+1, i*3+3) ]
-                   for i in range(Data.GetNumberOfLines())]
-    else:
-        lines = []
-
-    if Data.GetNumberOfVerts() > 0:
-       indices = [Data.GetVerts().GetData().GetValue(i)
-                  for i in range(1, Data.GetVerts().GetSize() )]
-    else:
-       indices = []
-
-    scalars = []
-    scalar_names = []
+    from mindboggle.utils.io_vtk import read_vtk_arrays, scalar_arrays_to_lists
 
-    if Reader.GetNumberOfScalarsInFile() > 0:
-        for scalar_index in range(Reader.GetNumberOfScalarsInFile()):
-            scalar_name = Reader.GetScalarsNameInFile(scalar_index)
-
-            n_scalars = scalar_index + 1
-            if n_scalars == 1:
-                print("Load \"{0}\" scalars from {1}".
-                      format(scalar_name, os.path.basename(input_vtk)))
-            else:
-                print("Load \"{0}\" (of {1} scalars) from {2}".
-                      format(scalar_name, n_scalars,
-                             os.path.basename(input_vtk)))
-
-            scalar_array = PointData.GetArray(scalar_name)
-            if scalar_array:
-                scalar = [scalar_array.GetValue(i)
-                          for i in range(scalar_array.GetSize())]
-                scalars.append(scalar)
-                scalar_names.append(scalar_name)
+    faces, lines, indices, points, npoints, scalars, scalar_names, \
+        input_vtk = read_vtk_arrays(input_vtk)
 
-    if return_first:
-        if scalars:
-            scalars = scalars[0]
-        if return_array:
-            scalars = np.array(scalars)
-        if scalar_names:
-            scalar_names = scalar_names[0]
-        else:
-            scalar_names = ''
+    scalars, scalar_names = scalar_arrays_to_lists(scalars, scalar_names,
+                                                   return_first, return_array)
 
-    return faces, lines, indices, points, npoints, scalars, scalar_names, \
-           input_vtk
+    return faces.tolist(), lines.tolist(), indices.tolist(), \
+           points.tolist(), npoints, scalars, scalar_names, input_vtk
 
 
 #=============================================================================
@@ -408,7 +935,7 @@ def write_header(Fp, Header='# vtk DataFile Version 2.0',
                                                    dataType))
 
 
-def write_points(Fp, points, dataType="float"):
+def write_points(Fp, points, dataType="float", binary=False):
     """
     Write coordinates of points, the POINTS section in DATASET POLYDATA::
 
@@ -423,11 +950,21 @@ def write_points(Fp, points, dataType="float"):
         ...
         p(n-1)x p(n-1)y p(n-1)z
 
+    If binary, the coordinates are written as one block of big-endian
+    values (for a file with a BINARY header).
+
     """
     import numpy as np
 
     Fp.write('POINTS {0} {1}\n'.format(len(points), dataType))
 
+    if binary:
+        from mindboggle.utils.io_vtk import binary_scalar_type
+        vtk_type, dtype = binary_scalar_type(dataType)
+        Fp.write(np.asarray(points, dtype=dtype).tobytes())
+        Fp.write('\n')
+        return
+
     n = np.shape(points)[1]
     for point in points:
         if n == 3:
@@ -440,7 +977,7 @@ def write_points(Fp, points, dataType="float"):
             print('ERROR: Unrecognized number of coordinates per point')
 
 
-def write_faces(Fp, faces):
+def write_faces(Fp, faces, binary=False):
     """
     Write indices to vertices forming triangular meshes or lines,
     the POLYGONS section in DATASET POLYDATA section:
@@ -449,6 +986,8 @@ def write_faces(Fp, faces):
         3 0 1 4
         ...
 
+    If binary, the cells are written as one block of big-endian integers.
+
     """
     import numpy as np
 
@@ -464,6 +1003,14 @@ def write_faces(Fp, faces):
     else:
         print('ERROR: Unrecognized number of vertices per face')
 
+    if binary:
+        cells = np.empty((len(faces), n + 1), dtype='>i4')
+        cells[:, 0] = n
+        cells[:, 1:] = faces
+        Fp.write(cells.tobytes())
+        Fp.write('\n')
+        return
+
     for face in faces:
         if n == 3:
             [V0, V1, V2] = face
@@ -473,7 +1020,7 @@ def write_faces(Fp, faces):
             Fp.write('{0} {1} {2}\n'.format(n, V0, V1))
 
 
-def write_lines(Fp, lines):
+def write_lines(Fp, lines, binary=False):
     """
     Save connected line segments to a VTK file.
 
@@ -484,12 +1031,14 @@ def write_lines(Fp, lines):
     lines : list of 2-tuples of integers
         each element is an edge on the mesh, consisting of 2 integers
         representing the 2 vertices of the edge
+    binary : Boolean
+        write big-endian binary values?
     """
 
-    write_faces(Fp, lines)
+    write_faces(Fp, lines, binary)
 
 
-def write_vertices(Fp, indices):
+def write_vertices(Fp, indices, binary=False):
     """
     Write indices to vertices, the VERTICES section
     in the DATASET POLYDATA section::
@@ -511,6 +1060,16 @@ def write_vertices(Fp, indices):
 
     """
 
+    if binary:
+        import numpy as np
+        Fp.write('VERTICES {0} {1}\n'.format(1, len(indices) + 1))
+        cell = np.empty(len(indices) + 1, dtype='>i4')
+        cell[0] = len(indices)
+        cell[1:] = indices
+        Fp.write(cell.tobytes())
+        Fp.write('\n')
+        return
+
     Fp.write('VERTICES {0} {1}\n{2} '.format(
              1, len(indices) + 1, len(indices)))
     [Fp.write('{0} '.format(i)) for i in indices]
@@ -518,7 +1077,7 @@ def write_vertices(Fp, indices):
 
 
 def write_scalars(Fp, scalars, scalar_name, begin_scalars=True,
-                  scalar_type='float'):
+                  scalar_type='float', binary=False):
     """
     Write per-VERTEX values as a scalar lookup table into a VTK file::
 
@@ -545,11 +1104,24 @@ def write_scalars(Fp, scalars, scalar_name, begin_scalars=True,
         True if the first vertex lookup table in a VTK file
     scalar_type : string
         type of scalars ('float' or 'int')
+    binary : Boolean
+        write big-endian binary values (see binary_scalar_type())?
 
     """
 
     if begin_scalars:
         Fp.write('POINT_DATA {0}\n'.format(len(scalars)))
+
+    if binary:
+        import numpy as np
+        from mindboggle.utils.io_vtk import binary_scalar_type
+        vtk_type, dtype = binary_scalar_type(scalar_type)
+        Fp.write('SCALARS {0} {1}\n'.format(scalar_name, vtk_type))
+        Fp.write('LOOKUP_TABLE {0}\n'.format(scalar_name))
+        Fp.write(np.asarray(scalars, dtype=dtype).tobytes())
+        Fp.write('\n')
+        return
+
     Fp.write('SCALARS {0} {1}\n'.format(scalar_name, scalar_type))
     Fp.write('LOOKUP_TABLE {0}\n'.format(scalar_name))
     for Value in scalars:
@@ -557,9 +1129,160 @@ def write_scalars(Fp, scalars, scalar_name, begin_scalars=True,
     Fp.write('\n')
 
 
-def write_vtk(output_vtk, points, indices=[], lines=[], faces=[],
+def binary_scalar_type(scalar_type):
+    """
+    Map a scalar type name to a VTK type name and a big-endian numpy dtype.
+
+    Type names are those used for ASCII output, including Python and numpy
+    type names returned by type(x).__name__ (such as 'int' or 'float64').
+    As with ASCII output, 'float' values are stored in single precision.
+
+    Parameters
+    ----------
+    scalar_type : string
+        type of scalars (such as 'float', 'double', 'int')
+
+    Returns
+    -------
+    vtk_type : string
+        VTK data type name ('float', 'double' or 'int')
+    dtype : string
+        big-endian numpy dtype string
+
+    Examples
+    --------
+    >>> from mindboggle.utils.io_vtk import binary_scalar_type
+    >>> binary_scalar_type('int64')
+    ('int', '>i4')
+
+    """
+    if scalar_type in ['double', 'float64']:
+        vtk_type, dtype = 'double', '>f8'
+    elif scalar_type.startswith('float'):
+        vtk_type, dtype = 'float', '>f4'
+    else:
+        vtk_type, dtype = 'int', '>i4'
+
+    return vtk_type, dtype
+
+
+def write_vtp(output_vtk, points, indices=[], lines=[], faces=[],
               scalars=[], scalar_names=['scalars'], scalar_type='float'):
     """
+    Save a surface mesh and scalars to a zlib-compressed XML PolyData file.
+
+    Data are stored as raw (unencoded) appended binary blocks.
+    The file is read back by read_vtk_arrays() and the other readers,
+    which detect the format from the file header.
+
+    Parameters
+    ----------
+    output_vtk : string
+        path of the output file (a .vtp extension is conventional)
+    points :  list of 3-tuples of floats (or numpy array)
+        each element has 3 numbers representing the coordinates of the points
+    indices : list of integers
+        indices of vertices
+    lines : list of 2-tuples of integers
+        each element is an edge on the mesh
+    faces : list of 3-tuples of integers
+        indices to the three vertices of a face on the mesh
+    scalars : list of lists of floats (or single list or array of floats)
+        each list (lookup table) contains values assigned to the vertices
+    scalar_names : string or list of strings
+        each element is the name of a scalar list (lookup table)
+    scalar_type : string or list of strings
+        type of scalars (see binary_scalar_type()), one for all lists
+        or one per list
+
+    Returns
+    -------
+    output_vtk : string
+        path of the output file
+
+    Examples
+    --------
+    >>> import os
+    >>> from mindboggle.utils.io_vtk import read_vtk_arrays, write_vtp
+    >>> path = os.environ['MINDBOGGLE_DATA']
+    >>> input_vtk = os.path.join(path, 'arno', 'shapes', 'lh.pial.mean_curvature.vtk')
+    >>> faces, lines, indices, points, npoints, scalars, names, input_vtk = read_vtk_arrays(input_vtk)
+    >>> write_vtp('write_vtp.vtp', points, indices, lines, faces, scalars, names)
+
+    """
+    import os
+    import numpy as np
+    import vtk
+    from vtk.util.numpy_support import numpy_to_vtk, numpy_to_vtkIdTypeArray
+
+    from mindboggle.utils.io_vtk import binary_scalar_type, scalars_checker
+
+    def cell_array(cells):
+        cells = np.asarray(cells)
+        ncells, n = cells.shape
+        ids = np.empty((ncells, n + 1), dtype=np.int64)
+        ids[:, 0] = n
+        ids[:, 1:] = cells
+        vtk_cells = vtk.vtkCellArray()
+        vtk_cells.SetCells(ncells, numpy_to_vtkIdTypeArray(ids.ravel(),
+                                                           deep=1))
+        return vtk_cells
+
+    polydata = vtk.vtkPolyData()
+    vtk_points = vtk.vtkPoints()
+    vtk_points.SetData(numpy_to_vtk(np.asarray(points, dtype=np.float32),
+                                    deep=1))
+    polydata.SetPoints(vtk_points)
+    if len(indices):
+        polydata.SetVerts(cell_array([indices]))
+    if len(lines):
+        polydata.SetLines(cell_array(np.asarray(lines)[:, 0:2]))
+    if len(faces):
+        polydata.SetPolys(cell_array(faces))
+
+    if len(scalars):
+        scalars, scalar_names = scalars_checker(scalars, scalar_names)
+        PointData = polydata.GetPointData()
+        for i, scalar_list in enumerate(scalars):
+            if len(scalar_names) < i + 1:
+                scalar_name = scalar_names[0]
+            else:
+                scalar_name = scalar_names[i]
+            if isinstance(scalar_type, list):
+                vtk_type, dtype = binary_scalar_type(scalar_type[i])
+            else:
+                vtk_type, dtype = binary_scalar_type(scalar_type)
+            array = np.asarray(scalar_list, dtype=dtype[1:])
+            vtk_array = numpy_to_vtk(array, deep=1)
+            vtk_array.SetName(scalar_name)
+            if i == 0:
+                PointData.SetScalars(vtk_array)
+            else:
+                PointData.AddArray(vtk_array)
+
+    output_vtk = os.path.join(os.getcwd(), output_vtk)
+
+    writer = vtk.vtkXMLPolyDataWriter()
+    writer.SetFileName(output_vtk)
+    if hasattr(writer, 'SetInputData'):
+        writer.SetInputData(polydata)
+    else:
+        writer.SetInput(polydata)
+    writer.SetCompressor(vtk.vtkZLibDataCompressor())
+    writer.SetDataModeToAppended()
+    writer.EncodeAppendedDataOff()
+    writer.Write()
+
+    if not os.path.exists(output_vtk):
+        raise(IOError(output_vtk + " not found"))
+
+    return output_vtk
+
+
+def write_vtk(output_vtk, points, indices=[], lines=[], faces=[],
+              scalars=[], scalar_names=['scalars'], scalar_type='float',
+              file_format=''):
+    """
     Save lists of scalars into the lookup table of a VTK-format file.
 
     Scalar definition includes specification of a lookup table.
@@ -588,6 +1311,9 @@ def write_vtk(output_vtk, points, indices=[], lines=[], faces=[],
         each element is the name of a scalar list (lookup table)
     scalar_type : string
         type of scalars ('float' or 'int')
+    file_format : string
+        'ascii' or 'binary' (legacy VTK), 'vtp' (zlib-compressed XML
+        PolyData), or '' for the pipeline-wide default (see get_vtk_format())
 
     Examples
     --------
@@ -625,27 +1351,40 @@ def write_vtk(output_vtk, points, indices=[], lines=[], faces=[],
     import numpy as np
 
     from mindboggle.utils.io_vtk import write_header, write_points, \
-        write_vertices, write_faces, write_scalars, scalars_checker
-
-    # Convert numpy arrays to lists
-    if isinstance(faces, np.ndarray):
-        faces = faces.tolist()
-    if isinstance(points, np.ndarray):
-        points = points.tolist()
+        write_vertices, write_faces, write_scalars, scalars_checker, \
+        get_vtk_format, write_vtp
+
+    file_format = get_vtk_format(file_format)
+    if file_format == 'vtp':
+        return write_vtp(output_vtk, points, indices, lines, faces,
+                         scalars, scalar_names, scalar_type)
+    binary = file_format == 'binary'
+
+    # Convert numpy arrays to lists (binary output writes arrays directly)
+    if not binary:
+        if isinstance(faces, np.ndarray):
+            faces = faces.tolist()
+        if isinstance(points, np.ndarray):
+            points = points.tolist()
 
     output_vtk = os.path.join(os.getcwd(), output_vtk)
 
-    Fp = open(output_vtk,'w')
-    write_header(Fp)
-    write_points(Fp, points)
-    if indices:
-        write_vertices(Fp, indices)
-    if lines:
+    if binary:
+        Fp = open(output_vtk,'wb')
+        write_header(Fp, fileType='BINARY')
+    else:
+        Fp = open(output_vtk,'w')
+        write_header(Fp)
+    write_points(Fp, points, binary=binary)
+    if len(indices):
+        write_vertices(Fp, indices, binary)
+    if len(lines):
         for i in range(0,len(lines)):
             lines[i] = [lines[i][0], lines[i][1]]
-        write_faces(Fp, lines) # write_faces can write either lines or faces
-    if faces:
-        write_faces(Fp, faces)
+        # write_faces can write either lines or faces:
+        write_faces(Fp, lines, binary)
+    if len(faces):
+        write_faces(Fp, faces, binary)
     scalars, scalar_names = scalars_checker(scalars, scalar_names)
     if len(scalars):
 
@@ -653,14 +1392,16 @@ def write_vtk(output_vtk, points, indices=[], lines=[], faces=[],
             if i == 0:
                 scalar_name = scalar_names[i]
                 write_scalars(Fp, scalar_list, scalar_name,
-                              begin_scalars=True, scalar_type=scalar_type)
+                              begin_scalars=True, scalar_type=scalar_type,
+                              binary=binary)
             else:
                 if len(scalar_names) < i + 1:
                     scalar_name = scalar_names[0]
                 else:
                     scalar_name = scalar_names[i]
                 write_scalars(Fp, scalar_list, scalar_name,
-                              begin_scalars=False, scalar_type=scalar_type)
+                              begin_scalars=False, scalar_type=scalar_type,
+                              binary=binary)
     Fp.close()
 
     if not os.path.exists(output_vtk):
@@ -671,10 +1412,15 @@ def write_vtk(output_vtk, points, indices=[], lines=[], faces=[],
 
 def rewrite_scalars(input_vtk, output_vtk, new_scalars,
                     new_scalar_names=['scalars'], filter_scalars=[],
-                    background_value=-1):
+                    background_value=-1, file_format='', copy_geometry=True):
     """
     Load VTK format file and save a subset of scalars into a new file.
 
+    If copy_geometry and the input is a legacy VTK file in the output format,
+    its geometry sections are copied byte-for-byte (located with
+    read_vtk_index()) and only the new scalar tables are formatted.
+    With filter_scalars, only the POLYGONS section is rewritten.
+
     Parameters
     ----------
     input_vtk : string
@@ -689,6 +1435,11 @@ def rewrite_scalars(input_vtk, output_vtk, new_scalars,
         scalar values used to filter faces (foreground values retained)
     background_value : integer
         background value
+    file_format : string
+        'ascii' or 'binary' (legacy VTK), 'vtp' (zlib-compressed XML
+        PolyData), or '' for the pipeline-wide default (see get_vtk_format())
+    copy_geometry : Boolean
+        copy the geometry sections of the input file verbatim if possible?
 
     Returns
     -------
@@ -723,7 +1474,12 @@ def rewrite_scalars(input_vtk, output_vtk, new_scalars,
 
     from mindboggle.utils.mesh import remove_faces
     from mindboggle.utils.io_vtk import write_header, write_points, \
-        write_vertices, write_faces, write_scalars, read_vtk, scalars_checker
+        write_vertices, write_faces, write_scalars, read_vtk, \
+        read_vtk_arrays, read_vtk_index, scalars_checker, get_vtk_format, \
+        write_vtp
+
+    file_format = get_vtk_format(file_format)
+    binary = file_format == 'binary'
 
     # Convert numpy arrays to lists
     if isinstance(new_scalars, np.ndarray):
@@ -734,59 +1490,127 @@ def rewrite_scalars(input_vtk, output_vtk, new_scalars,
     # Output VTK file to current working directory
     output_vtk = os.path.join(os.getcwd(), output_vtk)
 
-    # Load VTK file
-    faces, lines, indices, points, npoints, scalars, name, \
-        input_vtk = read_vtk(input_vtk)
-
     # Find indices to foreground values
     if filter_scalars:
         indices_keep = [i for i,x in enumerate(filter_scalars)
                         if x != background_value]
         indices_remove = [i for i,x in enumerate(filter_scalars)
                           if x == background_value]
-        # Remove surface faces whose three vertices are not all in indices
-        faces = remove_faces(faces, indices_keep)
 
-    # Write VTK file
-    Fp = open(output_vtk,'w')
-    write_header(Fp)
-    write_points(Fp, points)
-    if indices:
-        write_vertices(Fp, indices)
-    if faces:
-        write_faces(Fp, faces)
-    if new_scalars:
-        new_scalars, new_scalar_names = scalars_checker(new_scalars,
-                                                        new_scalar_names)
-
-        # scalars_checker() returns a list of lists for scalars:
-        for i, new_scalar_list in enumerate(new_scalars):
+    #-------------------------------------------------------------------------
+    # Copy geometry bytes (before and after any rewritten POLYGONS section):
+    #-------------------------------------------------------------------------
+    geometry = None
+    if copy_geometry and file_format != 'vtp':
+        index = read_vtk_index(input_vtk)
+        if index is not None and index['format'] != file_format:
+            index = None
+        if index is not None and filter_scalars:
+            keys = [x[0] for x in index['sections']]
+            if keys.count('POLYGONS') != 1 or 'CELL_DATA' in keys:
+                index = None
+        if index is not None:
+            Fin = open(input_vtk, 'rb')
             if filter_scalars:
-                for iremove in indices_remove:
-                    new_scalar_list[iremove] = background_value
-            if np.ndim(new_scalar_list) == 1:
-                scalar_type = type(new_scalar_list[0]).__name__
-            elif np.ndim(new_scalar_list) == 2:
-                scalar_type = type(new_scalar_list[0][0]).__name__
+                for key, start, end in index['sections']:
+                    if key == 'POLYGONS':
+                        polygons_start, polygons_end = start, end
+                head = Fin.read(polygons_start)
+                header, data = Fin.read(polygons_end -
+                                        polygons_start).split(b'\n', 1)
+                nfaces, ncells = [int(x) for x in header.split()[1:3]]
+                tail = Fin.read(index['point_data'] - polygons_end)
+                if ncells == 4 * nfaces:
+                    if binary:
+                        cells = np.frombuffer(data, dtype='>i4',
+                                              count=ncells)
+                    else:
+                        cells = np.array(data.split()[0:ncells], dtype=int)
+                    faces = cells.reshape(-1, 4)[:, 1:]
+                    # Remove surface faces whose three vertices
+                    # are not all in indices:
+                    faces = remove_faces(faces, indices_keep)
+                    geometry = [head, faces, tail]
             else:
-                print("Undefined scalar type!")
-            if i == 0:
-                new_scalar_name = new_scalar_names[0]
-                write_scalars(Fp, new_scalar_list, new_scalar_name,
-                              begin_scalars=True,
-                              scalar_type=scalar_type)
-            else:
-                if len(new_scalar_names) < i + 1:
-                    new_scalar_name = new_scalar_names[0]
-                else:
-                    new_scalar_name = new_scalar_names[i]
-                write_scalars(Fp, new_scalar_list, new_scalar_name,
-                              begin_scalars=False,
-                              scalar_type=scalar_type)
-    else:
+                geometry = [Fin.read(index['point_data']), [], b'']
+            Fin.close()
+
+    # Load VTK file (geometry stays in arrays for binary formats)
+    if geometry is None:
+        if file_format == 'ascii':
+            faces, lines, indices, points, npoints, scalars, name, \
+                input_vtk = read_vtk(input_vtk)
+        else:
+            faces, lines, indices, points, npoints, scalars, name, \
+                input_vtk = read_vtk_arrays(input_vtk)
+
+        # Remove surface faces whose three vertices are not all in indices
+        if filter_scalars:
+            faces = remove_faces(faces, indices_keep)
+
+    if not new_scalars:
         print('Error: new_scalars is empty')
         exit()
 
+    # scalars_checker() returns a list of lists for scalars:
+    new_scalars, new_scalar_names = scalars_checker(new_scalars,
+                                                    new_scalar_names)
+    scalar_types = []
+    for new_scalar_list in new_scalars:
+        if filter_scalars:
+            for iremove in indices_remove:
+                new_scalar_list[iremove] = background_value
+        if np.ndim(new_scalar_list) == 1:
+            scalar_type = type(new_scalar_list[0]).__name__
+        elif np.ndim(new_scalar_list) == 2:
+            scalar_type = type(new_scalar_list[0][0]).__name__
+        else:
+            print("Undefined scalar type!")
+        scalar_types.append(scalar_type)
+
+    # Write XML PolyData file
+    if file_format == 'vtp':
+        return write_vtp(output_vtk, points, indices, [], faces,
+                         new_scalars, new_scalar_names, scalar_types)
+
+    # Write VTK file
+    if binary:
+        Fp = open(output_vtk,'wb')
+    else:
+        Fp = open(output_vtk,'w')
+    if geometry is not None:
+        head, faces, tail = geometry
+        Fp.write(head)
+        if len(faces):
+            write_faces(Fp, faces, binary)
+        Fp.write(tail)
+        if not (tail or head).endswith(b'\n'):
+            Fp.write('\n')
+    else:
+        if binary:
+            write_header(Fp, fileType='BINARY')
+        else:
+            write_header(Fp)
+        write_points(Fp, points, binary=binary)
+        if len(indices):
+            write_vertices(Fp, indices, binary)
+        if len(faces):
+            write_faces(Fp, faces, binary)
+    for i, new_scalar_list in enumerate(new_scalars):
+        if i == 0:
+            new_scalar_name = new_scalar_names[0]
+            write_scalars(Fp, new_scalar_list, new_scalar_name,
+                          begin_scalars=True,
+                          scalar_type=scalar_types[i], binary=binary)
+        else:
+            if len(new_scalar_names) < i + 1:
+                new_scalar_name = new_scalar_names[0]
+            else:
+                new_scalar_name = new_scalar_names[i]
+            write_scalars(Fp, new_scalar_list, new_scalar_name,
+                          begin_scalars=False,
+                          scalar_type=scalar_types[i], binary=binary)
+
     Fp.close()
 
     if not os.path.exists(output_vtk):
@@ -1430,7 +2254,8 @@ def freesurfer_surface_to_vtk(surface_file, output_vtk):
     import os
     import nibabel as nb
 
-    from mindboggle.utils.io_vtk import write_header, write_points, write_faces
+    from mindboggle.utils.io_vtk import write_header, write_points, \
+        write_faces, get_vtk_format
 
     surf = nb.freesurfer.read_geometry(surface_file)
     points = surf[0]
@@ -1460,10 +2285,17 @@ def freesurfer_surface_to_vtk(surface_file, output_vtk):
     if not output_vtk:
         output_vtk = os.path.join(os.getcwd(),
                                   os.path.basename(surface_file + '.vtk'))
-    Fp = open(output_vtk, 'w')
-    write_header(Fp, Title='vtk output from ' + surface_file)
-    write_points(Fp, points)
-    write_faces(Fp, faces)
+    # This surface is also read by the C++ tools, so it stays legacy VTK:
+    binary = get_vtk_format() != 'ascii'
+    if binary:
+        Fp = open(output_vtk, 'wb')
+        write_header(Fp, Title='vtk output from ' + surface_file,
+                     fileType='BINARY')
+    else:
+        Fp = open(output_vtk, 'w')
+        write_header(Fp, Title='vtk output from ' + surface_file)
+    write_points(Fp, points, binary=binary)
+    write_faces(Fp, faces, binary)
     Fp.close()
 
     if not os.path.exists(output_vtk):
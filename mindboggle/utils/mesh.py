@@ -11,15 +11,256 @@ Copyright 2013,  Mindboggle team (http://mindboggle.info), Apache v2.0 License
 """
 
 
+class Surface(object):
+    """
+    Triangular surface mesh with lazily computed, cached topology.
+
+    Points and faces are stored as numpy arrays. Derived structures
+    (neighbor lists and their CSR arrays, one-rings in cyclic order, edges,
+    adjacent faces, vertex areas, border vertices and a KD-tree of the
+    points) are computed on first access and kept for later use, so they
+    are built once per mesh rather than once per function call.
+
+    Functions that take a VTK file name to construct such structures
+    also accept a Surface (see Surface.load()).
+
+    If the $MINDBOGGLE_CACHE environment variable is set, topology that
+    depends only on the faces (neighbor CSR arrays, one-rings, edges and
+    adjacent faces) is also stored on disk under a hash of the faces (see
+    mindboggle.utils.cache), so that other processes working on the same
+    mesh load it as memory-mapped arrays instead of recomputing it.
+
+    Parameters
+    ----------
+    points : list of lists or (N,3) numpy array of floats
+        coordinates of each vertex
+    faces : list of lists or (F,3) numpy array of integers
+        indices to the three vertices of each triangular face
+    scalars : list of numpy arrays (optional)
+        scalar lookup tables for the vertices
+    scalar_names : list of strings (optional)
+        name of each lookup table
+    input_vtk : string (optional)
+        VTK file the surface was read from
+
+    Examples
+    --------
+    >>> from mindboggle.utils.mesh import Surface
+    >>> points = [[0,0,0], [1,0,0], [0,1,0], [0,0,1], [1,1,1]]
+    >>> faces = [[0,1,2],[0,2,3],[0,3,4],[0,1,4],[4,3,1]]
+    >>> surface = Surface(points, faces)
+    >>> surface.neighbor_lists
+        [[1, 2, 3, 4], [0, 2, 4, 3], [0, 1, 3], [0, 2, 4, 1], [0, 3, 1]]
+    >>> surface.borders
+        array([1, 2, 3])
+    >>> # Surface from a file (reused by later calls in the same process):
+    >>> import os
+    >>> path = os.environ['MINDBOGGLE_DATA']
+    >>> depth_file = os.path.join(path, 'arno', 'shapes', 'lh.pial.travel_depth.vtk')
+    >>> surface = Surface.load(depth_file)
+    >>> neighbor_lists = surface.neighbor_lists
+
+    """
+    # Surfaces loaded from files, keyed by file name, size and mtime:
+    _loaded = {}
+    _max_loaded = 4
+    # Smaller meshes are faster to recompute than to load from disk:
+    _min_cached_faces = 1000
+
+    def __init__(self, points, faces, scalars=[], scalar_names=[],
+                 input_vtk=''):
+        import numpy as np
+
+        self.points = np.asarray(points)
+        self.faces = np.asarray(faces, dtype=np.int32).reshape(-1, 3)
+        self.npoints = len(self.points)
+        self.scalars = scalars
+        self.scalar_names = scalar_names
+        self.input_vtk = input_vtk
+        self._cache = {}
+
+    @classmethod
+    def load(cls, surface_or_file):
+        """
+        Return a Surface, reading it from a VTK file if given a file name.
+
+        Surfaces read from a file are kept (for a few files), so that calls
+        with the same unchanged file return the same Surface object.
+        """
+        import os
+        from mindboggle.utils.io_vtk import read_vtk_arrays
+
+        if isinstance(surface_or_file, Surface):
+            return surface_or_file
+
+        stat = os.stat(surface_or_file)
+        key = (os.path.abspath(surface_or_file), stat.st_size, stat.st_mtime)
+        if key not in cls._loaded:
+            faces, lines, indices, points, npoints, scalars, scalar_names, \
+                input_vtk = read_vtk_arrays(surface_or_file)
+            if len(cls._loaded) >= cls._max_loaded:
+                cls._loaded.clear()
+            cls._loaded[key] = cls(points, faces, scalars, scalar_names,
+                                   surface_or_file)
+
+        return cls._loaded[key]
+
+    def scalar_values(self):
+        """
+        Return the first scalar lookup table as a numpy array,
+        as read_scalars(input_vtk, True, True) does.
+        """
+        from mindboggle.utils.io_vtk import scalar_arrays_to_lists
+
+        scalars, name = scalar_arrays_to_lists(self.scalars,
+                                               self.scalar_names, True, True)
+        return scalars
+
+    def _lazy(self, name, compute):
+        # Compute a derived structure once and cache it:
+        if name not in self._cache:
+            self._cache[name] = compute()
+        return self._cache[name]
+
+    def _stored(self, name, array_names, compute):
+        # As _lazy(), for arrays that depend only on the faces:
+        # also load them from (or save them to) the on-disk cache.
+        from mindboggle.utils.cache import cache_directory, \
+            load_cached_arrays, save_cached_arrays
+
+        def load_or_compute():
+            if len(self.faces) < self._min_cached_faces or \
+                    not cache_directory():
+                return tuple(compute())
+            key = self.faces_hash
+            arrays = load_cached_arrays(key, array_names)
+            if arrays is None:
+                arrays = compute()
+                save_cached_arrays(key, array_names, arrays)
+            return tuple(arrays)
+
+        return self._lazy(name, load_or_compute)
+
+    @property
+    def faces_hash(self):
+        """Hash of the faces and number of points (key to the disk cache)."""
+        import numpy as np
+        from mindboggle.utils.cache import hash_arrays
+
+        return self._lazy('faces_hash', lambda:
+            hash_arrays([self.faces, np.array([self.npoints])]))
+
+    @property
+    def neighbor_lists(self):
+        """List of lists of neighboring vertices (as find_neighbors())."""
+        from mindboggle.utils.mesh import neighbor_lists_from_csr
+
+        return self._lazy('neighbor_lists', lambda:
+                          neighbor_lists_from_csr(*self.neighbor_csr))
+
+    @property
+    def neighbor_csr(self):
+        """(indptr, indices) arrays: neighbors of vertex i are
+        indices[indptr[i]:indptr[i+1]], in find_neighbors() order."""
+        from mindboggle.utils.mesh import find_neighbors_csr
+
+        return self._stored('neighbor_csr', ['neighbor_indptr',
+                                             'neighbor_indices'],
+            lambda: find_neighbors_csr(self.faces, self.npoints))
+
+    @property
+    def rings(self):
+        """(indptr, rings, is_closed) arrays: neighbors of vertex i
+        in cyclic order are rings[indptr[i]:indptr[i+1]] if is_closed[i]
+        (as find_rings())."""
+        from mindboggle.utils.mesh import find_rings
+
+        return self._stored('rings', ['ring_indptr', 'rings', 'ring_closed'],
+            lambda: find_rings(self.faces, self.npoints))
+
+    @property
+    def edges(self):
+        """(E,2) array of unique edges, each sorted by vertex index."""
+        return self._edge_counts()[0]
+
+    def _edge_counts(self):
+        # Unique sorted edges and the number of faces sharing each edge:
+        import numpy as np
+
+        def compute():
+            edges = np.sort(self.faces[:, [0, 1, 1, 2, 0, 2]].reshape(-1, 2),
+                            axis=1).astype(np.int64)
+            keys = edges[:, 0] * self.npoints + edges[:, 1]
+            keys, counts = np.unique(keys, return_counts=True)
+            edges = np.column_stack((keys // self.npoints,
+                                     keys % self.npoints)).astype(np.int32)
+            return edges, counts
+
+        return self._stored('edge_counts', ['edges', 'edge_counts'], compute)
+
+    @property
+    def adjacent_faces(self):
+        """(F,2,3) array of adjacent faces and opposite vertices
+        (as find_adjacent_faces())."""
+        from mindboggle.utils.mesh import find_adjacent_faces
+
+        return self._stored('adjacent_faces', ['adjacent_faces'],
+            lambda: [find_adjacent_faces(self.faces)])[0]
+
+    @property
+    def face_areas(self):
+        """Array of the area of each face."""
+        import numpy as np
+
+        def compute():
+            p = self.points.astype(np.float64)
+            cross = np.cross(p[self.faces[:, 1]] - p[self.faces[:, 0]],
+                             p[self.faces[:, 2]] - p[self.faces[:, 0]])
+            return 0.5 * np.sqrt((cross * cross).sum(axis=1))
+
+        return self._lazy('face_areas', compute)
+
+    @property
+    def vertex_areas(self):
+        """Array of one third of the area of the faces around each vertex."""
+        import numpy as np
+
+        return self._lazy('vertex_areas', lambda:
+            np.bincount(self.faces.ravel(),
+                        weights=np.repeat(self.face_areas / 3.0, 3),
+                        minlength=self.npoints))
+
+    @property
+    def borders(self):
+        """Array of vertices on edges that belong to only one face."""
+        import numpy as np
+
+        def compute():
+            edges, counts = self._edge_counts()
+            return np.unique(edges[counts == 1])
+
+        return self._lazy('borders', compute)
+
+    @property
+    def kdtree(self):
+        """scipy.spatial.cKDTree of the points."""
+        from scipy.spatial import cKDTree
+
+        return self._lazy('kdtree', lambda: cKDTree(self.points))
+
+
 def find_neighbors_from_file(input_vtk):
     """
     Generate the list of unique, sorted indices of neighboring vertices
     for all vertices in the faces of a triangular mesh in a VTK file.
 
+    The neighbor lists are cached by the file's Surface object,
+    so repeated calls for the same file do not recompute them.
+
     Parameters
     ----------
-    input_vtk : string
-        name of input VTK file containing surface mesh
+    input_vtk : string or Surface
+        name of input VTK file containing surface mesh (or a Surface)
 
     Returns
     -------
@@ -47,12 +288,122 @@ def find_neighbors_from_file(input_vtk):
     >>> plot_surfaces('find_neighbors_from_file.vtk')
 
     """
-    from mindboggle.utils.io_vtk import read_faces_points
-    from mindboggle.utils.mesh import find_neighbors
+    from mindboggle.utils.mesh import Surface
+
+    neighbor_lists = Surface.load(input_vtk).neighbor_lists
+
+    return neighbor_lists
+
+
+def find_neighbors_csr(faces, npoints):
+    """
+    Find the neighboring vertices of all vertices of a triangular mesh,
+    as compressed sparse row (CSR) arrays.
+
+    The neighbors of vertex i are indices[indptr[i]:indptr[i+1]],
+    in the same order as in find_neighbors(). Unique edge pairs are found
+    by sorting rather than by searching lists, so this takes well under
+    a second for a 300,000-vertex surface.
+
+    Parameters
+    ----------
+    faces : list of lists of three integers (or (F,3) numpy array)
+        the integers for each face are indices to vertices, starting from zero
+    npoints: integer
+        number of vertices on the mesh
+
+    Returns
+    -------
+    indptr : numpy array of integers (length npoints + 1)
+        offsets in indices to the neighbors of each vertex
+    indices : numpy array of integers
+        indices to neighboring vertices
+
+    Examples
+    --------
+    >>> from mindboggle.utils.mesh import find_neighbors_csr
+    >>> faces = [[0,1,2],[0,2,3],[0,3,4],[0,1,4],[4,3,1]]
+    >>> npoints = 5
+    >>> indptr, indices = find_neighbors_csr(faces, npoints)
+    >>> indptr
+        array([ 0,  4,  8, 11, 15, 18])
+    >>> indices
+        array([1, 2, 3, 4, 0, 2, 4, 3, 0, 1, 3, 0, 2, 4, 1, 0, 3, 1], dtype=int32)
+
+    """
+    import numpy as np
+
+    faces = np.asarray(faces, dtype=np.int64).reshape(-1, 3)
+
+    #-------------------------------------------------------------------------
+    # Directed edges, in the order find_neighbors() visits them:
+    # (v0,v1), (v0,v2), (v1,v0), (v1,v2), (v2,v0), (v2,v1) for each face
+    #-------------------------------------------------------------------------
+    sources = faces[:, [0, 0, 1, 1, 2, 2]].ravel()
+    targets = faces[:, [1, 2, 0, 2, 0, 1]].ravel()
+
+    #-------------------------------------------------------------------------
+    # Find the first occurrence (rank) of each edge: sort edges by
+    # (edge, rank), packed in one integer key if it fits in 64 bits
+    # (a plain sort is much faster than a stable argsort):
+    #-------------------------------------------------------------------------
+    nedges = len(sources)
+    keys = sources * npoints + targets
+    if float(npoints) * npoints * nedges < 2**63:
+        keys = np.sort(keys * nedges + np.arange(nedges))
+        ranks = keys % nedges
+        keys //= nedges
+    else:
+        ranks = np.argsort(keys, kind='mergesort')
+        keys = keys[ranks]
+    first = np.ones(nedges, dtype=bool)
+    first[1:] = keys[1:] != keys[:-1]
+    ranks = ranks[first]
+
+    #-------------------------------------------------------------------------
+    # Group the edges by source vertex, in order of first occurrence:
+    #-------------------------------------------------------------------------
+    ranks = np.sort(sources[ranks] * nedges + ranks) % nedges
+
+    indptr = np.zeros(npoints + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(np.bincount(sources[ranks], minlength=npoints))
+    indices = targets[ranks].astype(np.int32)
+
+    return indptr, indices
+
+
+def neighbor_lists_from_csr(indptr, indices):
+    """
+    Convert neighbor CSR arrays to a list of lists of neighboring vertices.
+
+    Parameters
+    ----------
+    indptr : numpy array of integers (length npoints + 1)
+        offsets in indices to the neighbors of each vertex
+    indices : numpy array of integers
+        indices to neighboring vertices
+
+    Returns
+    -------
+    neighbor_lists : list of lists of integers
+        each list contains indices to neighboring vertices for each vertex
+
+    Examples
+    --------
+    >>> from mindboggle.utils.mesh import find_neighbors_csr
+    >>> from mindboggle.utils.mesh import neighbor_lists_from_csr
+    >>> faces = [[0,1,2],[0,2,3],[0,3,4],[0,1,4],[4,3,1]]
+    >>> neighbor_lists_from_csr(*find_neighbors_csr(faces, 5))
+        [[1, 2, 3, 4], [0, 2, 4, 3], [0, 1, 3], [0, 2, 4, 1], [0, 3, 1]]
+
+    """
+    import numpy as np
 
-    faces, points, npoints = read_faces_points(input_vtk)
+    indptr = np.asarray(indptr).tolist()
+    indices = np.asarray(indices).tolist()
 
-    neighbor_lists = find_neighbors(faces, npoints)
+    neighbor_lists = [indices[indptr[i]:indptr[i + 1]]
+                      for i in range(len(indptr) - 1)]
 
     return neighbor_lists
 
@@ -62,9 +413,13 @@ def find_neighbors(faces, npoints):
     Generate the list of unique, sorted indices of neighboring vertices
     for all vertices in the faces of a triangular mesh.
 
+    Calls find_neighbors_csr() and converts its arrays to lists;
+    use find_neighbors_csr() (or Surface.neighbor_csr) directly
+    where arrays will do.
+
     Parameters
     ----------
-    faces : list of lists of three integers
+    faces : list of lists of three integers (or (F,3) numpy array)
         the integers for each face are indices to vertices, starting from zero
     npoints: integer
         number of vertices on the mesh
@@ -104,29 +459,115 @@ def find_neighbors(faces, npoints):
     >>> plot_surfaces('find_neighbors.vtk')
 
     """
+    from mindboggle.utils.mesh import find_neighbors_csr, \
+        neighbor_lists_from_csr
 
-    neighbor_lists = [[] for x in range(npoints)]
-
-    for face in faces:
-        [v0, v1, v2] = face
-        if v1 not in neighbor_lists[v0]:
-            neighbor_lists[v0].append(v1)
-        if v2 not in neighbor_lists[v0]:
-            neighbor_lists[v0].append(v2)
-
-        if v0 not in neighbor_lists[v1]:
-            neighbor_lists[v1].append(v0)
-        if v2 not in neighbor_lists[v1]:
-            neighbor_lists[v1].append(v2)
-
-        if v0 not in neighbor_lists[v2]:
-            neighbor_lists[v2].append(v0)
-        if v1 not in neighbor_lists[v2]:
-            neighbor_lists[v2].append(v1)
+    neighbor_lists = neighbor_lists_from_csr(*find_neighbors_csr(faces,
+                                                                 npoints))
 
     return neighbor_lists
 
 
+def find_rings(faces, npoints):
+    """
+    Find the neighbors of each vertex in cyclic order around the vertex.
+
+    The faces around a vertex form a fan, and the edges of the fan's faces
+    opposite the vertex link its neighbors in order around the vertex
+    (its one-ring). Each one-ring is found by following these links,
+    for all vertices at once. A vertex whose fan is not one closed cycle
+    of consistently oriented faces (at the border of the mesh or where
+    the mesh is not a manifold) is marked as not closed, and its part
+    of rings is not to be used.
+
+    Parameters
+    ----------
+    faces : list of lists of three integers (or (F,3) numpy array)
+        the integers for each face are indices to vertices, starting from zero
+    npoints: integer
+        number of vertices on the mesh
+
+    Returns
+    -------
+    indptr : numpy array of integers (length npoints + 1)
+        offsets in rings to the one-ring of each vertex
+    rings : numpy array of integers
+        neighbors of each vertex, in cyclic order
+    is_closed : numpy array of Booleans
+        is each vertex surrounded by a closed fan of faces?
+
+    Examples
+    --------
+    >>> from mindboggle.utils.mesh import find_rings
+    >>> faces = [[0,1,2],[0,2,3],[0,3,4],[0,4,1],[5,2,1],[5,3,2],[5,4,3],[5,1,4]]
+    >>> indptr, rings, is_closed = find_rings(faces, 6)
+    >>> rings[indptr[0]:indptr[1]]
+        array([1, 2, 3, 4], dtype=int32)
+    >>> is_closed
+        array([ True,  True,  True,  True,  True,  True])
+
+    """
+    import numpy as np
+
+    faces = np.asarray(faces, dtype=np.int64).reshape(-1, 3)
+
+    #-------------------------------------------------------------------------
+    # Link edges: each face (v0,v1,v2) links v1 to v2 around v0,
+    # v2 to v0 around v1, and v0 to v1 around v2. Sort them by vertex
+    # and then by the neighbor they start from:
+    #-------------------------------------------------------------------------
+    centers = faces.ravel()
+    starts = faces[:, [1, 2, 0]].ravel()
+    stops = faces[:, [2, 0, 1]].ravel()
+    keys = centers * npoints + starts
+    order = np.argsort(keys)
+    keys = keys[order]
+    centers = centers[order]
+    starts = starts[order]
+    stops = stops[order]
+    nlinks = len(keys)
+
+    counts = np.bincount(centers, minlength=npoints)
+    indptr = np.zeros(npoints + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(counts)
+
+    #-------------------------------------------------------------------------
+    # The next link edge around a vertex starts where the last one stops.
+    # A fan is not closed if a link edge has no next edge (at a border),
+    # or if two link edges start or stop at the same neighbor:
+    #-------------------------------------------------------------------------
+    next_keys = centers * npoints + stops
+    successors = np.searchsorted(keys, next_keys)
+    successors[successors == nlinks] = 0
+    is_broken = keys[successors] != next_keys
+    stop_keys = np.sort(next_keys)
+    is_closed = counts > 0
+    is_closed[centers[is_broken]] = False
+    is_closed[centers[1:][keys[1:] == keys[:-1]]] = False
+    is_closed[stop_keys[1:][stop_keys[1:] == stop_keys[:-1]] // npoints] = \
+        False
+
+    #-------------------------------------------------------------------------
+    # Follow the link edges around all closed fans at once;
+    # a fan made of more than one cycle returns to its start too early:
+    #-------------------------------------------------------------------------
+    walked = starts.copy()
+    vertices = np.flatnonzero(is_closed)
+    firsts = indptr[vertices]
+    current = firsts.copy()
+    for step in range(1, counts.max() if nlinks else 0):
+        is_active = counts[vertices] > step
+        vertices = vertices[is_active]
+        firsts = firsts[is_active]
+        current = successors[current[is_active]]
+        is_closed[vertices[current == firsts]] = False
+        walked[firsts + step] = starts[current]
+
+    rings = np.where(is_closed[centers], walked, starts).astype(np.int32)
+
+    return indptr, rings, is_closed
+
+
 def find_neighbors_vertex(faces, index):
     """
     Find neighbors to a surface mesh vertex.
@@ -230,6 +671,130 @@ def find_neighborhood(neighbor_lists, indices, nedges=1):
     return neighborhood
 
 
+def find_neighborhoods(neighbor_csr, indices, nedges=1):
+    """
+    Find the neighborhoods of many surface mesh vertices at once.
+
+    For each of the given vertices, find the vertices within nedges edges
+    (excluding the vertex itself), as find_neighborhood() does for one
+    vertex. All neighborhoods are grown together by multiplying a sparse
+    matrix of the vertices reached so far with the mesh's adjacency matrix.
+
+    Parameters
+    ----------
+    neighbor_csr : tuple of two numpy arrays (or Surface)
+        (indptr, indices) neighbor arrays (see find_neighbors_csr())
+    indices : list or numpy array of integers
+        indices of surface vertices
+    nedges : integer
+        number of edges to propagate from each vertex
+
+    Returns
+    -------
+    indptr : numpy array of integers (length len(indices) + 1)
+        offsets in neighborhoods to the neighborhood of each vertex
+    neighborhoods : numpy array of integers
+        indices to vertices in the neighborhoods (sorted per vertex)
+
+    Examples
+    --------
+    >>> from mindboggle.utils.mesh import find_neighbors_csr
+    >>> from mindboggle.utils.mesh import find_neighborhoods
+    >>> faces = [[0,1,2],[0,2,3],[0,3,4],[0,1,4],[4,3,1],[4,5,6]]
+    >>> neighbor_csr = find_neighbors_csr(faces, 7)
+    >>> indptr, neighborhoods = find_neighborhoods(neighbor_csr, [2, 6], 2)
+    >>> indptr
+        array([0, 4, 9])
+    >>> neighborhoods
+        array([0, 1, 3, 4, 0, 1, 3, 4, 5], dtype=int32)
+
+    """
+    import numpy as np
+    from scipy.sparse import csr_matrix
+    from mindboggle.utils.mesh import Surface
+
+    if isinstance(neighbor_csr, Surface):
+        neighbor_csr = neighbor_csr.neighbor_csr
+    neighbor_indptr, neighbors = neighbor_csr
+    npoints = len(neighbor_indptr) - 1
+    indices = np.asarray(indices, dtype=np.int64)
+    nindices = len(indices)
+
+    #-------------------------------------------------------------------------
+    # Grow boolean "reached" matrix (one row per vertex) one edge at a time:
+    #-------------------------------------------------------------------------
+    adjacency = csr_matrix((np.ones(len(neighbors), dtype=bool), neighbors,
+                            neighbor_indptr), shape=(npoints, npoints))
+    reached = csr_matrix((np.ones(nindices, dtype=bool), indices,
+                          np.arange(nindices + 1)), shape=(nindices, npoints))
+    for iedge in range(nedges):
+        reached = reached + reached * adjacency
+    reached.sort_indices()
+
+    #-------------------------------------------------------------------------
+    # Remove each vertex from its own neighborhood:
+    #-------------------------------------------------------------------------
+    rows = np.repeat(np.arange(nindices), np.diff(reached.indptr))
+    keep = reached.indices != indices[rows]
+    neighborhoods = reached.indices[keep].astype(np.int32)
+    indptr = np.zeros(nindices + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(np.bincount(rows[keep], minlength=nindices))
+
+    return indptr, neighborhoods
+
+
+def gather_neighbors(neighbor_lists, indices):
+    """
+    Find the neighbors of many surface mesh vertices at once, as arrays.
+
+    Parameters
+    ----------
+    neighbor_lists : list of lists of integers (or tuple of two arrays)
+        each list contains indices to neighboring vertices for each vertex
+        (or (indptr, indices) neighbor arrays, see find_neighbors_csr())
+    indices : list or numpy array of integers
+        indices of surface vertices
+
+    Returns
+    -------
+    sources : numpy array of integers
+        index (from indices) of the vertex each neighbor is a neighbor of
+    neighbors : numpy array of integers
+        neighbors of each vertex in indices, concatenated
+
+    Examples
+    --------
+    >>> from mindboggle.utils.mesh import gather_neighbors, find_neighbors_csr
+    >>> neighbor_lists = [[1, 2, 3, 4], [0, 2, 4, 3], [0, 1, 3], [0, 2, 4, 1], [0, 3, 1]]
+    >>> gather_neighbors(neighbor_lists, [2, 4])
+        (array([2, 2, 2, 4, 4, 4]), array([0, 1, 3, 0, 3, 1]))
+    >>> faces = [[0,1,2],[0,2,3],[0,3,4],[0,1,4],[4,3,1]]
+    >>> gather_neighbors(find_neighbors_csr(faces, 5), [2, 4])
+        (array([2, 2, 2, 4, 4, 4]), array([0, 1, 3, 0, 3, 1]))
+
+    """
+    import numpy as np
+    from itertools import chain
+
+    indices = np.asarray(indices, dtype=np.int64).ravel()
+
+    if isinstance(neighbor_lists, tuple):
+        indptr, neighbor_indices = neighbor_lists
+        starts = indptr[indices]
+        counts = indptr[indices + 1] - starts
+        offsets = np.repeat(starts - np.cumsum(counts) + counts, counts) + \
+                  np.arange(counts.sum())
+        neighbors = neighbor_indices[offsets].astype(np.int64)
+    else:
+        lists = [neighbor_lists[i] for i in indices.tolist()]
+        counts = [len(x) for x in lists]
+        neighbors = np.fromiter(chain.from_iterable(lists), dtype=np.int64,
+                                count=sum(counts))
+    sources = np.repeat(indices, counts)
+
+    return sources, neighbors
+
+
 def find_endpoints(indices, neighbor_lists):
     """
     Extract endpoints from connected set of vertices.
@@ -290,34 +855,98 @@ def find_endpoints(indices, neighbor_lists):
     return indices_endpoints
 
 
+def find_edge_table(faces):
+    """
+    Find the unique edges of a triangular mesh and the edges of each face.
+
+    Edges are matched by sorting integer keys made from their vertex pairs,
+    so this takes O(F log F) numpy operations rather than comparing faces
+    or searching lists. find_edges(), find_faces_at_edges() and
+    find_adjacent_faces() are built on this table.
+
+    Parameters
+    ----------
+    faces : list of lists of three integers (or (F,3) numpy array)
+        the integers for each face are indices to vertices, starting from zero
+
+    Returns
+    -------
+    edges : (E,2) numpy array of integers
+        unique (undirected) edges, in order of first appearance in the faces
+        and with the orientation in which they first appear
+    face_edges : (F,3) numpy array of integers
+        indices to edges for the edges [v0,v1], [v1,v2] and [v0,v2]
+        of each face [v0,v1,v2]
+
+    Examples
+    --------
+    >>> from mindboggle.utils.mesh import find_edge_table
+    >>> faces=[[0,1,2], [0,1,4], [1,2,3], [0,2,5]]
+    >>> edges, face_edges = find_edge_table(faces)
+    >>> edges.tolist()
+        [[0, 1], [1, 2], [0, 2], [1, 4], [0, 4], [2, 3], [1, 3], [2, 5], [0, 5]]
+    >>> face_edges.tolist()
+        [[0, 1, 2], [0, 3, 4], [1, 5, 6], [2, 7, 8]]
+
+    """
+    import numpy as np
+
+    faces = np.asarray(faces, dtype=np.int64).reshape(-1, 3)
+    npoints = faces.max() + 1 if len(faces) else 0
+
+    #-------------------------------------------------------------------------
+    # Edges [v0,v1], [v1,v2], [v0,v2] of each face, with undirected keys:
+    #-------------------------------------------------------------------------
+    pairs = faces[:, [0, 1, 1, 2, 0, 2]].reshape(-1, 2)
+    keys = pairs.min(axis=1) * npoints + pairs.max(axis=1)
+
+    #-------------------------------------------------------------------------
+    # Sort keys (stably, so each edge's first appearance comes first),
+    # then number the unique edges in order of first appearance:
+    #-------------------------------------------------------------------------
+    order = np.argsort(keys, kind='mergesort')
+    starts = np.ones(len(keys), dtype=bool)
+    starts[1:] = keys[order[1:]] != keys[order[:-1]]
+    group = np.cumsum(starts) - 1
+    first = order[starts]
+    renumber = np.empty(len(first), dtype=np.int64)
+    renumber[np.argsort(first)] = np.arange(len(first))
+
+    edges = pairs[np.sort(first)].astype(np.int32)
+    face_edges = np.empty(len(keys), dtype=np.int64)
+    face_edges[order] = renumber[group]
+    face_edges = face_edges.reshape(-1, 3).astype(np.int32)
+
+    return edges, face_edges
+
+
 def find_edges(faces):
     """
     Find all edges on a mesh
 
     Parameters
     ----------
-    faces : list of lists of three integers
+    faces : list of lists of three integers (or (F,3) numpy array)
         the integers for each face are indices to vertices, starting from zero
 
     Returns
     -------
-    edges : list of lists of integers
-        each element is a 2-tuple of vertex ids representing an edge
+    edges : (E,2) numpy array of integers
+        each row holds the two vertex ids of a unique edge, in order of
+        first appearance in the faces (see find_edge_table())
 
     Examples
     --------
     >>> # Simple example:
     >>> from mindboggle.utils.mesh import find_edges
     >>> faces=[[0,1,2], [0,1,4], [1,2,3], [0,2,5]]
-    >>> find_edges(faces)
+    >>> find_edges(faces).tolist()
     [[0, 1], [1, 2], [0, 2], [1, 4], [0, 4], [2, 3], [1, 3], [2, 5], [0, 5]]
 
     """
-    edges = [ ]
-    for face in faces:
-        for edge in [face[0:2], face[1:3], [face[0], face[2]] ]:
-            if not edge in edges: # I know that this is costly
-                edges.append(edge)
+    from mindboggle.utils.mesh import find_edge_table
+
+    edges, face_edges = find_edge_table(faces)
 
     return edges
 
@@ -328,7 +957,7 @@ def find_faces_at_edges(faces):
 
     Parameters
     ----------
-    faces : list of lists of three integers
+    faces : list of lists of three integers (or (F,3) numpy array)
         the integers for each face are indices to vertices, starting from zero
 
     Returns
@@ -365,12 +994,27 @@ def find_faces_at_edges(faces):
         The faces are assumed to be triangular.
 
     """
+    import numpy as np
+    from mindboggle.utils.mesh import find_edge_table
+
+    edges, face_edges = find_edge_table(faces)
 
-    faces_at_edges = {}
-    for face_id, face in enumerate(faces):
-        for edge in [face[0:2], face[1:3], [face[0], face[2]] ]:
-            faces_at_edges.setdefault((edge[0], edge[1]), []).append(face_id)
-            faces_at_edges.setdefault((edge[1], edge[0]), []).append(face_id) # make it symmetric
+    #-------------------------------------------------------------------------
+    # Group faces by edge (in increasing order of face within each edge):
+    #-------------------------------------------------------------------------
+    face_edges = face_edges.ravel()
+    order = np.argsort(face_edges, kind='mergesort')
+    indptr = np.zeros(len(edges) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(np.bincount(face_edges, minlength=len(edges)))
+    indptr = indptr.tolist()
+    face_ids = (order // 3).tolist()
+    face_lists = [face_ids[indptr[i]:indptr[i + 1]]
+                  for i in range(len(edges))]
+
+    # Make it symmetric:
+    faces_at_edges = dict(zip(map(tuple, edges.tolist()), face_lists))
+    faces_at_edges.update(zip(map(tuple, edges[:, ::-1].tolist()),
+                              map(list, face_lists)))
 
     return faces_at_edges
 
@@ -414,7 +1058,7 @@ def find_faces_at_vertices(faces, npoints):
 
     Parameters
     ----------
-    faces : list of lists of three integers
+    faces : list of lists of integers (or 2-D numpy array)
         the integers for each face are indices to vertices, starting from zero
     npoints: integer
         number of vertices on the mesh
@@ -434,10 +1078,31 @@ def find_faces_at_vertices(faces, npoints):
         [[0, 1, 2, 3], [0, 3, 4], [0, 1], [1, 2, 4], [2, 3, 4]]
 
     """
-    faces_at_vertices = [[] for i in range(npoints)]
-    for face_id, face in enumerate(faces):
-        for vertex in face:
-           faces_at_vertices[vertex].append(face_id)
+    import numpy as np
+
+    #-------------------------------------------------------------------------
+    # Vertex and face index of each corner of each face:
+    #-------------------------------------------------------------------------
+    if isinstance(faces, np.ndarray):
+        vertices = faces.ravel()
+        face_ids = np.repeat(np.arange(len(faces)), faces.shape[1])
+    else:
+        vertices = np.array([v for face in faces for v in face],
+                            dtype=np.int64)
+        face_ids = np.repeat(np.arange(len(faces)),
+                             [len(face) for face in faces])
+
+    #-------------------------------------------------------------------------
+    # Group faces by vertex (in increasing order of face within each vertex):
+    #-------------------------------------------------------------------------
+    order = np.argsort(vertices, kind='mergesort')
+    indptr = np.zeros(npoints + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(np.bincount(vertices, minlength=npoints))
+    indptr = indptr.tolist()
+    face_ids = face_ids[order].tolist()
+
+    faces_at_vertices = [face_ids[indptr[i]:indptr[i + 1]]
+                         for i in range(npoints)]
 
     return faces_at_vertices
 
@@ -446,19 +1111,22 @@ def find_adjacent_faces(faces):
     """
     For each face in a list of faces, find adjacent faces.
 
+    Faces sharing an edge are matched with the edge table of
+    find_edge_table(), so this takes O(F log F) numpy operations
+    rather than comparing every pair of faces.
+
     Parameters
     ----------
-    faces : list of lists of three integers
+    faces : list of lists of three integers (or (F,3) numpy array)
         the integers for each face are indices to vertices, starting from zero
-        (-1 indicates no result for a given face or vertex)
 
     Returns
     -------
-    adjacent_faces: list of pairs of lists of three integers
-        list 1 indexes three faces adjacent to the three face's edges; 
-        list 2 indexes three vertices opposite the adjacent faces:
-        adjacent_faces[i]: two lists, each of length 3
-        adjacent_faces[i][0] = [face0, face1, face2]: 
+    adjacent_faces: (F,2,3) numpy array of integers
+        row 0 indexes three faces adjacent to the three face's edges;
+        row 1 indexes three vertices opposite the adjacent faces
+        (-1 indicates no result for a given face or vertex):
+        adjacent_faces[i][0] = [face0, face1, face2]:
                                 face0 is the neighbor of face i facing vertex0
         adjacent_faces[i][1] = [vertex0, vertex1, vertex2], which is face i:
                                 vertex0 is the vertex of face0 not in face i
@@ -468,7 +1136,7 @@ def find_adjacent_faces(faces):
     >>> # Simple example:
     >>> from mindboggle.utils.mesh import find_adjacent_faces
     >>> faces = [[0,1,2],[0,2,3],[0,3,4],[0,1,4],[4,3,1]]
-    >>> find_adjacent_faces(faces)
+    >>> find_adjacent_faces(faces).tolist()
         [[[-1, 1, 3], [-1, 3, 4]],
          [[-1, 2, 0], [-1, 4, 1]],
          [[4, 3, 1], [1, 1, 2]],
@@ -476,47 +1144,40 @@ def find_adjacent_faces(faces):
          [[-1, 3, 2], [-1, 0, 0]]]
 
     """
+    import numpy as np
+    from mindboggle.utils.mesh import find_edge_table
 
-    print "Calculating face neighbor list"
-
-    n_faces = len(faces)
-
-    adjacent_faces = []
-    [adjacent_faces.append([[-1,-1,-1], [-1,-1,-1]]) for i in range(n_faces)]
-
-    Done =[]
-    [Done.append(0) for i in range(n_faces)]
-
-    # Loop through faces:
-    for i1, face1 in enumerate(faces):
-        # Loop through remaining faces:
-        for i2 in range(i1+1, n_faces):
-            face2 = faces[i2]
-
-            # Loop through first two vertices of face:
-            for ivertex in [0,1]:
-                index1 = face1[ivertex]
-                # Loop through remaining vertices of face:
-                for index2 in face1[ivertex+1:3]:
-
-                    # If pair of vertices in face2:
-                    if index1 in face2 and index2 in face2:
-
-                        # Determine if it is face0, face1 or face2:
-                        NbrID1 = 3 - face1.index(index1) - face1.index(index2)
-                        NbrID2 = 3 - face2.index(index1) - face2.index(index2)
-
-                        adjacent_faces[i1][0][NbrID1] = i2
-                        adjacent_faces[i2][0][NbrID2] = i1
-                        adjacent_faces[i1][1][NbrID1] = face2[NbrID2]
-                        adjacent_faces[i2][1][NbrID2] = face1[NbrID1]
+    faces = np.asarray(faces, dtype=np.int64).reshape(-1, 3)
+    nfaces = len(faces)
+    adjacent_faces = -np.ones((nfaces, 2, 3), dtype=np.int32)
+    if not nfaces:
+        return adjacent_faces
 
-                        Done[i1] += 1
-                        Done[i2] += 1
+    #-------------------------------------------------------------------------
+    # Reorder each face's edges so that edge k is opposite vertex k
+    # (face_edges holds edges [v0,v1], [v1,v2], [v0,v2]):
+    #-------------------------------------------------------------------------
+    edges, face_edges = find_edge_table(faces)
+    edge_ids = face_edges[:, [1, 2, 0]].ravel()
 
-            # Break if all three neighbors of face1 have been found:
-            if Done[i] == 3:
-                break
+    #-------------------------------------------------------------------------
+    # Match each face-edge with the next face-edge on the same edge
+    # (two per edge on a manifold mesh):
+    #-------------------------------------------------------------------------
+    order = np.argsort(edge_ids, kind='mergesort')
+    shared = edge_ids[order[1:]] == edge_ids[order[:-1]]
+    half1 = order[:-1][shared]
+    half2 = order[1:][shared]
+
+    neighbors = adjacent_faces[:, 0, :].ravel()
+    opposites = adjacent_faces[:, 1, :].ravel()
+    corners = faces.ravel()
+    neighbors[half1] = half2 // 3
+    neighbors[half2] = half1 // 3
+    opposites[half1] = corners[half2]
+    opposites[half2] = corners[half1]
+    adjacent_faces[:, 0, :] = neighbors.reshape(-1, 3)
+    adjacent_faces[:, 1, :] = opposites.reshape(-1, 3)
 
     return adjacent_faces
 
@@ -546,14 +1207,24 @@ def find_complete_faces(indices, faces):
     [2, 3, 7, 5]
 
     """
+    import numpy as np
 
-    indices_complete_list = []
-    for face in faces:
-        if len(list(frozenset(face).intersection(indices))) == 3:
-            indices_complete_list.extend(face)
-    indices_complete = []
-    [indices_complete.append(x) for x in indices_complete_list
-     if x not in indices_complete]
+    faces = np.asarray(faces, dtype=int).reshape(-1, 3)
+    indices = np.asarray(indices, dtype=int).ravel()
+    if not len(faces) or not len(indices):
+        return []
+
+    # Select faces whose three vertices are all indices:
+    is_index = np.zeros(max(faces.max(), indices.max()) + 1, dtype=bool)
+    is_index[indices] = True
+    complete = faces[is_index[faces].all(axis=1)].ravel()
+
+    # Keep the vertices in order of first appearance:
+    complete_sorted = np.sort(complete, kind='mergesort')
+    order = np.argsort(complete, kind='mergesort')
+    first = np.ones(len(complete), dtype=bool)
+    first[1:] = complete_sorted[1:] != complete_sorted[:-1]
+    indices_complete = complete[np.sort(order[first])].tolist()
 
     return indices_complete
 
@@ -946,8 +1617,8 @@ def rescale_by_neighborhood(input_vtk, indices=[], nedges=10, p=99,
 
     Parameters
     ----------
-    input_vtk : string
-        name of VTK file with a scalar value for each vertex
+    input_vtk : string or Surface
+        name of VTK file with a scalar value for each vertex (or a Surface)
     indices : list of integers (optional)
         indices of scalars to normalize
     nedges : integer
@@ -1000,31 +1671,37 @@ def rescale_by_neighborhood(input_vtk, indices=[], nedges=10, p=99,
     """
     import os
     import numpy as np
-    from mindboggle.utils.io_vtk import read_scalars, rewrite_scalars
-    from mindboggle.utils.mesh import find_neighbors_from_file, find_neighborhood
+    from mindboggle.utils.io_vtk import rewrite_scalars
+    from mindboggle.utils.mesh import Surface, find_neighborhoods
+    from mindboggle.utils.compute import percentile_per_group
 
-    # Load scalars and vertex neighbor lists:
-    scalars, name = read_scalars(input_vtk, True, True)
-    if not indices:
+    # Number of vertices whose neighborhoods are found at once:
+    chunk_size = 10000
+
+    # Load scalars and vertex neighbor arrays:
+    surface = Surface.load(input_vtk)
+    scalars = surface.scalar_values()
+    if not len(indices):
         indices = [i for i,x in enumerate(scalars) if x != background_value]
+    indices = np.asarray(indices, dtype=np.int64)
     print("  Rescaling {0} scalar values by neighborhood...".format(len(indices)))
-    neighbor_lists = find_neighbors_from_file(input_vtk)
+    neighbor_csr = surface.neighbor_csr
 
-    # Loop through vertices:
-    rescaled_scalars = scalars.copy()
-    for index in indices:
+    # Compute a high neighborhood percentile to normalize each vertex's value
+    # (for chunks of vertices at a time):
+    normalization_factors = np.zeros(len(indices))
+    for start in range(0, len(indices), chunk_size):
+        chunk = indices[start:start + chunk_size]
+        indptr, neighborhoods = find_neighborhoods(neighbor_csr, chunk, nedges)
+        normalization_factors[start:start + chunk_size] = \
+            percentile_per_group(scalars[neighborhoods], indptr, p)
 
-        # Determine the scalars in the vertex's neighborhood:
-        neighborhood = find_neighborhood(neighbor_lists, [index], nedges)
-
-        # Compute a high neighborhood percentile to normalize vertex's value:
-        normalization_factor = np.percentile(scalars[neighborhood], p)
-        rescaled_scalar = scalars[index] / normalization_factor
-        rescaled_scalars[index] = rescaled_scalar
+    rescaled_scalars = scalars.copy()
+    rescaled_scalars[indices] = scalars[indices] / normalization_factors
 
     # Make any rescaled value greater than 1 equal to 1:
     if set_max_to_1:
-        rescaled_scalars[[x for x in indices if rescaled_scalars[x] > 1.0]] = 1
+        rescaled_scalars[indices[rescaled_scalars[indices] > 1.0]] = 1
 
     rescaled_scalars = rescaled_scalars.tolist()
 
@@ -1034,7 +1711,7 @@ def rescale_by_neighborhood(input_vtk, indices=[], nedges=10, p=99,
     if save_file:
 
         rescaled_scalars_file = os.path.join(os.getcwd(), output_filestring + '.vtk')
-        rewrite_scalars(input_vtk, rescaled_scalars_file,
+        rewrite_scalars(surface.input_vtk, rescaled_scalars_file,
                         rescaled_scalars, 'rescaled_scalars')
         if not os.path.exists(rescaled_scalars_file):
             raise(IOError(rescaled_scalars_file + " not found"))
@@ -661,13 +661,28 @@ def close_surface_pair_from_files(patch_surface1, whole_surface2,
 #-----------------------------------------------------------------------------
 # Test for simple points
 #-----------------------------------------------------------------------------
-def topo_test(index, values, neighbor_lists):
+def topo_test(index, values, neighbor_lists, rings=None):
     """
     Test to see if vertex is a "simple point".
 
     A simple point is a vertex that when added to or removed from an object
     (e.g., a curve) on a surface mesh does not alter the object's topology.
 
+    By default, inside neighbors are grouped by the (inside) neighbors
+    they share, and the vertex is a simple point if they form one group.
+
+    If the neighbors in cyclic order are given (rings) and the vertex is
+    surrounded by a closed fan of faces, a different, local definition
+    is used instead: the vertex is a simple point if its inside neighbors
+    form one unbroken run around its one-ring, which is found by counting
+    inside-to-outside transitions around the ring. The two definitions
+    agree on regular meshes, but not always on irregular meshes: inside
+    neighbors that are apart on the one-ring but share an inside vertex
+    outside of it form one group, so the grouping test accepts vertices
+    that the ring test rejects (see the last example below). The ring
+    test is therefore only used when rings are given, and changes
+    the results of functions that pass rings to topo_test().
+
     "Simple" is not to be mistaken with the following usage:
     "A vertex is usually assigned one of five possible classifications:
     simple, complex, boundary, interior edge, or corner vertex.
@@ -681,6 +696,9 @@ def topo_test(index, values, neighbor_lists):
         values for all vertices
     neighbor_lists : list of lists of integers
         each list contains indices to neighboring vertices for each vertex
+    rings : tuple of three numpy arrays (optional)
+        (indptr, rings, is_closed) one-rings in cyclic order
+        (see mindboggle.utils.mesh.find_rings() and Surface.rings)
 
     Returns
     -------
@@ -689,6 +707,33 @@ def topo_test(index, values, neighbor_lists):
     n_inside : integer
         number of neighboring vertices with a value greater than threshold
 
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from mindboggle.utils.mesh import find_neighbors, find_rings
+    >>> from mindboggle.utils.morph import topo_test
+    >>> faces = [[0,1,2],[0,2,3],[0,3,4],[0,4,1],[5,2,1],[5,3,2],[5,4,3],[5,1,4]]
+    >>> neighbor_lists = find_neighbors(faces, 6)
+    >>> rings = find_rings(faces, 6)
+    >>> values = np.array([1, 1, 1, 0, 0, 0])
+    >>> topo_test(0, values, neighbor_lists, rings)
+        (True, 2)
+    >>> values = np.array([1, 1, 0, 1, 0, 0])
+    >>> topo_test(0, values, neighbor_lists, rings)
+        (False, 2)
+    >>> # Compare the two tests on an irregular mesh (vertex 6 splits
+    >>> # a face of the above octahedron); inside neighbors 2 and 4 of
+    >>> # vertex 0 are apart on its one-ring, but share inside vertex 5:
+    >>> faces = [[0,1,6],[1,2,6],[2,0,6],[0,2,3],[0,3,4],[0,4,1],
+    >>>          [5,2,1],[5,3,2],[5,4,3],[5,1,4]]
+    >>> neighbor_lists = find_neighbors(faces, 7)
+    >>> rings = find_rings(faces, 7)
+    >>> values = np.array([0, 0, 1, 0, 1, 1, 0])
+    >>> [topo_test(i, values, neighbor_lists)[0] for i in range(7)]
+        [True, True, True, True, True, False, True]
+    >>> [topo_test(i, values, neighbor_lists, rings)[0] for i in range(7)]
+        [False, True, True, True, True, False, True]
+
     """
     import numpy as np
 
@@ -696,6 +741,17 @@ def topo_test(index, values, neighbor_lists):
     if not isinstance(values, np.ndarray):
         values = np.array(values)
 
+    # If the vertex has a closed one-ring, count the transitions
+    # from inside to outside neighbors around the ring:
+    if rings is not None and rings[2][index]:
+        ring = rings[1][rings[0][index]:rings[0][index + 1]]
+        inside = (values[ring] > 0.5).tolist()
+        n_inside = sum(inside)
+        sp = 0 < n_inside < len(inside) and \
+             len([1 for x, y in zip(inside, inside[1:] + inside[:1])
+                  if x and not y]) == 1
+        return sp, n_inside
+
     # Find neighbors to the input vertex, and binarize them
     # into those greater or less than a class boundary threshold equal to 0.5
     # ("inside" and "outside"); count inside and outside neighbors:
@@ -758,3 +814,92 @@ def topo_test(index, values, neighbor_lists):
             sp = False
 
     return sp, n_inside
+
+
+def topo_tests(indices, values, neighbor_lists, rings):
+    """
+    Test to see if each of many vertices is a "simple point".
+
+    Applies topo_test() with rings to all of the vertices at once.
+    Vertices with a closed one-ring are tested together by counting
+    inside-to-outside transitions around their rings; any others are
+    tested one at a time. On irregular meshes, the results can differ
+    from those of topo_test() without rings (see topo_test()).
+
+    Parameters
+    ----------
+    indices : list or numpy array of integers
+        indices of vertices to test
+    values : numpy array of integers or floats
+        values for all vertices
+    neighbor_lists : list of lists of integers
+        each list contains indices to neighboring vertices for each vertex
+    rings : tuple of three numpy arrays
+        (indptr, rings, is_closed) one-rings in cyclic order
+        (see mindboggle.utils.mesh.find_rings() and Surface.rings)
+
+    Returns
+    -------
+    sp : numpy array of Booleans
+        simple point or not, for each vertex
+    n_inside : numpy array of integers
+        number of neighboring vertices with a value greater than threshold,
+        for each vertex
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from mindboggle.utils.mesh import find_neighbors, find_rings
+    >>> from mindboggle.utils.morph import topo_tests
+    >>> faces = [[0,1,2],[0,2,3],[0,3,4],[0,4,1],[5,2,1],[5,3,2],[5,4,3],[5,1,4]]
+    >>> neighbor_lists = find_neighbors(faces, 6)
+    >>> rings = find_rings(faces, 6)
+    >>> values = np.array([1, 1, 0, 1, 0, 0])
+    >>> topo_tests([0, 1, 2, 5], values, neighbor_lists, rings)
+        (array([False,  True,  True, False]), array([2, 1, 3, 2]))
+
+    """
+    import numpy as np
+
+    from mindboggle.utils.morph import topo_test
+
+    # Make sure arguments are numpy arrays:
+    if not isinstance(values, np.ndarray):
+        values = np.array(values)
+    indices = np.asarray(indices, dtype=np.int64).ravel()
+    indptr, ring_indices, is_closed = rings
+
+    sp = np.zeros(len(indices), dtype=bool)
+    n_inside = np.zeros(len(indices), dtype=int)
+
+    #-------------------------------------------------------------------------
+    # Gather the one-rings of the vertices with closed fans, with
+    # the offset of the next neighbor around each ring:
+    #-------------------------------------------------------------------------
+    closed = np.flatnonzero(is_closed[indices])
+    starts = indptr[indices[closed]]
+    counts = indptr[indices[closed] + 1] - starts
+    stops = np.cumsum(counts)
+    offsets = np.repeat(starts - stops + counts, counts) + \
+              np.arange(stops[-1] if len(stops) else 0)
+    following = np.arange(1, len(offsets) + 1)
+    following[stops[counts > 0] - 1] = (stops - counts)[counts > 0]
+    positions = np.repeat(np.arange(len(closed)), counts)
+
+    #-------------------------------------------------------------------------
+    # Count inside neighbors and inside-to-outside transitions per ring:
+    #-------------------------------------------------------------------------
+    inside = values[ring_indices[offsets]] > 0.5
+    n_in = np.bincount(positions[inside], minlength=len(closed))
+    transitions = np.bincount(positions[inside & ~inside[following]],
+                              minlength=len(closed))
+    sp[closed] = (n_in > 0) & (n_in < counts) & (transitions == 1)
+    n_inside[closed] = n_in
+
+    #-------------------------------------------------------------------------
+    # Test the other vertices one at a time:
+    #-------------------------------------------------------------------------
+    for i in np.flatnonzero(~is_closed[indices]):
+        sp[i], n_inside[i] = topo_test(indices[i], values, neighbor_lists)
+
+    return sp, n_inside
@@ -13,13 +13,19 @@ Copyright 2013,  Mindboggle team (http://mindboggle.info), Apache v2.0 License
 
 def connect_points_erosion(S, neighbor_lists, outer_anchors, inner_anchors=[],
                            values=[], erode_ratio=0.1, erode_min_size=10,
-                           save_steps=[], save_vtk='', background_value=-1):
+                           save_steps=[], save_vtk='', background_value=-1,
+                           rings=None):
     """
     Connect mesh vertices with a skeleton of 1-vertex-thick curves by erosion.
 
     This algorithm iteratively removes simple topological points and endpoints,
     optionally in order of lowest to highest values.
 
+    The edge of the region and the number of region neighbors of each vertex
+    are updated as vertices are removed, so each iteration only visits
+    the edge of the region, and only the neighbors of removed vertices
+    are tested as new endpoints.
+
     Parameters
     ----------
     S : numpy array of integers
@@ -43,6 +49,12 @@ def connect_points_erosion(S, neighbor_lists, outer_anchors, inner_anchors=[],
         name of VTK file to transfer incremental values (if save_steps)
     background_value : integer
         background value
+    rings : tuple of three numpy arrays (optional)
+        (indptr, rings, is_closed) one-rings in cyclic order, to test
+        simple points by counting transitions around each vertex
+        (see mindboggle.utils.mesh.find_rings() and topo_test());
+        if None, use topo_test()'s neighbor-grouping test, which the
+        ring test does not always agree with on irregular meshes
 
     Returns
     -------
@@ -57,7 +69,7 @@ def connect_points_erosion(S, neighbor_lists, outer_anchors, inner_anchors=[],
     >>> from mindboggle.utils.io_vtk import read_scalars, read_vtk, rewrite_scalars
     >>> from mindboggle.utils.compute import median_abs_dev
     >>> from mindboggle.utils.paths import find_max_values
-    >>> from mindboggle.utils.mesh import find_neighbors_from_file
+    >>> from mindboggle.utils.mesh import Surface
     >>> from mindboggle.utils.paths import connect_points_erosion, find_outer_anchors
     >>> from mindboggle.utils.plots import plot_surfaces
     >>> path = os.environ['MINDBOGGLE_DATA']
@@ -67,7 +79,8 @@ def connect_points_erosion(S, neighbor_lists, outer_anchors, inner_anchors=[],
     >>> depth_file = os.path.join(path, 'arno', 'shapes', 'travel_depth_rescaled.vtk')
     >>> depths, name = read_scalars(depth_file, True, True)
     >>> values = curvs * depths
-    >>> neighbor_lists = find_neighbors_from_file(curv_file)
+    >>> surface = Surface.load(curv_file)
+    >>> neighbor_lists = surface.neighbor_lists
     >>> background_value = -1
     >>> #
     >>> # Single fold:
@@ -111,9 +124,8 @@ def connect_points_erosion(S, neighbor_lists, outer_anchors, inner_anchors=[],
     """
     import numpy as np
 
-    from mindboggle.utils.morph import topo_test, extract_edge
-    from mindboggle.utils.segment import segment
-    from mindboggle.utils.mesh import find_endpoints
+    from mindboggle.utils.morph import topo_test
+    from mindboggle.utils.mesh import gather_neighbors
 
     # Make sure arguments are numpy arrays:
     if not isinstance(S, np.ndarray):
@@ -124,52 +136,83 @@ def connect_points_erosion(S, neighbor_lists, outer_anchors, inner_anchors=[],
         if not isinstance(values, np.ndarray):
             values = np.array(values)
 
-    keep = outer_anchors[:]
+    keep = list(outer_anchors)
     keep.extend(inner_anchors)
+    outer_anchors = set(outer_anchors)
     remove_endpoints = True
 
     if save_steps:
         from mindboggle.utils.io_vtk import rewrite_scalars
         S0 = S.copy()
 
+    #-------------------------------------------------------------------------
+    # Find the region, the number of region neighbors of each vertex,
+    # and the edge of the region (region vertices with outside neighbors):
+    #-------------------------------------------------------------------------
+    inside = S != background_value
+    indices = np.where(inside)[0]
+    sources, neighbors = gather_neighbors(neighbor_lists, indices)
+    n_inside = np.bincount(neighbors, minlength=len(S))
+    n_neighbors = np.bincount(sources, minlength=len(S))
+    edge_set = set(indices[n_inside[indices] < n_neighbors[indices]].tolist())
+
+    # Vertices that may have become endpoints:
+    endpoint_candidates = set(indices.tolist())
+
+    def remove(removed):
+        # Remove vertices from the region, and update the edge,
+        # the numbers of region neighbors and the endpoint candidates:
+        S[removed] = background_value
+        inside[removed] = False
+        for index in removed:
+            edge_set.discard(index)
+            for neighbor in neighbor_lists[index]:
+                n_inside[neighbor] -= 1
+                if inside[neighbor]:
+                    edge_set.add(neighbor)
+                    endpoint_candidates.add(neighbor)
+
     #-------------------------------------------------------------------------
     # Iteratively remove simple points:
     #-------------------------------------------------------------------------
     print('  Remove up to {0} of edge vertices per iteration'.
           format(erode_ratio))
-    complex = []
+    complex = set()
     count = -1
     exist_simple = True
     while exist_simple:
         exist_simple = False
         count += 1
+        if count in save_steps:
+            indices = np.where(S != background_value)[0].tolist()
 
         #---------------------------------------------------------------------
         # Only consider updating vertices that are on the edge of the
         # region and are not among the indices to keep or known simple points:
         #---------------------------------------------------------------------
-        indices = np.where(S != background_value)[0].tolist()
-        edge = extract_edge(indices, neighbor_lists)
-        if edge:
-            edge = np.array(list(set(edge).difference(complex)))
+        if edge_set:
+            edge = np.array(sorted(edge_set.difference(complex)), dtype=int)
             len_edge = np.shape(edge)[0]
             if len_edge:
 
                 #-------------------------------------------------------------
-                # Segment edge vertices into separate connected groups:
+                # Segment edge vertices into separate connected groups
+                # (in order of their lowest vertex, as segment() does):
                 #-------------------------------------------------------------
-                edge_segs = segment(edge, neighbor_lists)
-                edge_seg_numbers = [x for x in np.unique(edge_segs)
-                                    if x != background_value]
-                len_numbers = len(edge_seg_numbers)
-                #if len_numbers > 1:
-                #    print('    {0}: {1} edge points in {2} segments'.
-                #          format(count, len_edge, len_numbers))
-                #else:
-                #    print('    {0}: {1} edge points'.format(count, len_edge))
+                edge_segs = []
+                unvisited = set(edge.tolist())
+                for seed in edge.tolist():
+                    if seed in unvisited:
+                        unvisited.remove(seed)
+                        edge_seg = [seed]
+                        for index in edge_seg:
+                            for neighbor in neighbor_lists[index]:
+                                if neighbor in unvisited:
+                                    unvisited.remove(neighbor)
+                                    edge_seg.append(neighbor)
+                        edge_segs.append(np.sort(edge_seg))
                 first_seg = True
-                for edge_seg_number in edge_seg_numbers:
-                    edge_seg = np.where(edge_segs == edge_seg_number)[0]
+                for edge_seg in edge_segs:
                     edge_seg = np.array(list(set(edge_seg).difference(keep)))
                     len_edge_seg = np.shape(edge_seg)[0]
                     if len_edge_seg:
@@ -188,29 +231,31 @@ def connect_points_erosion(S, neighbor_lists, outer_anchors, inner_anchors=[],
                         for index in edge_seg[0:ntests]:
 
                             # Test to see if each index is a simple point:
-                            simple, d = topo_test(index, S, neighbor_lists)
+                            simple, d = topo_test(index, S, neighbor_lists,
+                                                  rings)
 
                             # If a simple point, remove and run again:
                             # (Note: Must remove at each iteration)
                             if simple:
-                                S[index] = background_value
+                                remove([index])
                                 exist_simple = True
                             # Else store to exclude in future:
                             else:
-                                complex.append(index)
+                                complex.add(index)
 
                         # If no simple points, test all of the indices:
                         if not exist_simple and erode_by_value:
                             print('    No simple points')
                             for index in edge_seg[ntests::]:
-                                simple, d = topo_test(index, S, neighbor_lists)
+                                simple, d = topo_test(index, S,
+                                                      neighbor_lists, rings)
                                 # If a simple point, remove and run again:
                                 if simple:
-                                    S[index] = background_value
+                                    remove([index])
                                     exist_simple = True
                                 # Else store to exclude in future:
                                 else:
-                                    complex.append(index)
+                                    complex.add(index)
 
                         # Save incremental VTK files for debugging:
                         if count in save_steps and first_seg:
@@ -222,26 +267,29 @@ def connect_points_erosion(S, neighbor_lists, outer_anchors, inner_anchors=[],
                         first_seg = False
 
                 #-------------------------------------------------------------
-                # Remove branches by iteratively removing endpoints:
+                # Remove branches by iteratively removing endpoints
+                # (vertices with one neighbor in the region), all
+                # endpoints at a time, testing only vertices next to
+                # vertices removed since the last test:
                 #-------------------------------------------------------------
                 if remove_endpoints:
-                    indices = np.where(S != background_value)[0].tolist()
                     endpts = True
                     while endpts:
-                        endpts = find_endpoints(indices, neighbor_lists)
+                        endpts = [x for x in endpoint_candidates
+                                  if inside[x] and n_inside[x] == 1 and
+                                  x not in outer_anchors]
+                        endpoint_candidates.clear()
                         if endpts:
-                            endpts = [x for x in endpts if x not in outer_anchors]
-                            if endpts:
-                                S[endpts] = background_value
-                                indices = list(set(indices).difference(endpts))
+                            remove(endpts)
 
-    skeleton = indices
+    skeleton = np.where(S != background_value)[0].tolist()
 
     return skeleton
 
 
 def connect_points_hmmf(indices_points, indices, L, neighbor_lists,
-                        wN_max=1.0, background_value=-1):
+                        wN_max=1.0, background_value=-1, rings=None,
+                        callback=None):
     """
     Connect mesh vertices with a skeleton of 1-vertex-thick curves using HMMF.
 
@@ -258,6 +306,11 @@ def connect_points_hmmf(indices_points, indices, L, neighbor_lists,
     threshold such that a H_step makes it cross the threshold,
     and the vertex is a "simple point" (its addition/removal alters topology).
 
+    Costs are computed from the concatenated neighbors of all of the vertices
+    at once, and the topology of the vertices whose values cross the
+    threshold is tested together; a vertex is retested only if one of its
+    neighbors changed sides of the threshold before it in the same iteration.
+
     Parameters for computing the cost and cost gradients:
 
         ``wL``: weight influence of likelihood on the cost function
@@ -278,6 +331,18 @@ def connect_points_hmmf(indices_points, indices, L, neighbor_lists,
         maximum neighborhood weight (trust prior more for smoother fundi)
     background_value : integer
         background value
+    rings : tuple of three numpy arrays (optional)
+        (indptr, rings, is_closed) one-rings in cyclic order, to test
+        threshold-crossing vertices together by counting transitions
+        around each vertex (see mindboggle.utils.mesh.find_rings() and
+        topo_tests()); if None, test them one at a time with topo_test()'s
+        neighbor-grouping test, which the ring test does not always agree
+        with on irregular meshes
+    callback : function (optional)
+        called after each iteration as callback(count, costs, npoints_thr,
+        seconds): the iteration number, the sum of the costs, the number
+        of HMMF values above the threshold, and the duration of the
+        iteration (for example, to profile the optimization)
 
     Returns
     -------
@@ -329,9 +394,11 @@ def connect_points_hmmf(indices_points, indices, L, neighbor_lists,
 
     """
     import numpy as np
-    from mindboggle.utils.morph import topo_test
+    from time import time
+
+    from mindboggle.utils.morph import topo_test, topo_tests
     from mindboggle.utils.paths import connect_points_erosion
-    from mindboggle.utils.segment import extract_borders
+    from mindboggle.utils.mesh import gather_neighbors
 
     # Make sure argument is a numpy array
     if not isinstance(L, np.ndarray):
@@ -359,8 +426,8 @@ def connect_points_hmmf(indices_points, indices, L, neighbor_lists,
     do_erode = False
     print_interval = 10
 
-    def compute_costs(likelihoods, hmmfs, hmmfs_neighbors, numbers_of_neighbors,
-                      wN, Z=[]):
+    def compute_costs(likelihoods, hmmfs, hmmfs_neighbors, rows,
+                      numbers_of_neighbors, wN):
         """
         Cost function for penalizing unlikely fundus curve vertices.
 
@@ -384,13 +451,13 @@ def connect_points_hmmf(indices_points, indices, L, neighbor_lists,
         hmmf : numpy array of floats
             HMMF values
         hmmf_neighbors : numpy array of floats
-            HMMF values of neighboring vertices for each vertex
+            HMMF values of the neighbors of the vertices, concatenated
+        rows : numpy array of integers
+            index (in hmmfs) of the vertex each neighbor is a neighbor of
         numbers_of_neighbors : numpy array of integers
             number of neighbors for each vertex
         wN : float
             weight influence of neighbors on cost (term 2)
-        Z : numpy array of integers in {0,1} (same shape as hmmf_neighbors)
-            to remove zero-padded neighborhood elements after hmmf subtraction
 
         Returns
         -------
@@ -402,16 +469,14 @@ def connect_points_hmmf(indices_points, indices, L, neighbor_lists,
 
         if all(numbers_of_neighbors):
 
-            # Subtract each HMMF value from its neighbors:
-            diff = abs(hmmfs - hmmfs_neighbors)
-
-            # Since the above neighbors may have been padded,
-            # remove the extra differences by multiplying them times zero:
-            diff = diff * Z
+            # Subtract each HMMF value from its neighbors,
+            # and sum the differences for each vertex:
+            diff = np.bincount(rows, weights=abs(hmmfs[rows] - hmmfs_neighbors),
+                               minlength=len(hmmfs))
 
             # Compute the cost for each vertex:
             costs = hmmfs * (1.1 - likelihoods) + \
-                    wN * np.sum(diff, axis=0) / numbers_of_neighbors
+                    wN * diff / numbers_of_neighbors
         else:
             import sys
             sys.exit('ERROR: No HMMF neighbors to compute cost.')
@@ -432,30 +497,21 @@ def connect_points_hmmf(indices_points, indices, L, neighbor_lists,
     H[indices_points] = 1
     H_new = H.copy()
     H_tests = H.copy()
+    is_anchor = np.zeros(len(L), dtype=bool)
+    is_anchor[indices_points] = True
 
-    # Find the HMMF values for the neighbors of each vertex:
+    # Find the neighbors of each vertex, concatenated, with the position
+    # (in indices) of the vertex each neighbor is a neighbor of:
     N = neighbor_lists
-    N_sizes = np.array([len(x) for x in N])
-    max_num_neighbors = max(N_sizes[indices])
-    N_array = np.zeros((max_num_neighbors, len(L)))
-    for index in indices:
-        N_array[0:N_sizes[index], index] = N[index]
-    N_array_shape = np.shape(N_array)
-    N_flat = np.ravel(N_array)
-    N_flat_list = N_flat.tolist()
-    H_N = np.reshape(H[N_flat_list], N_array_shape)
-    ind_flat = [i for i,x in enumerate(N_flat_list) if x > 0]
-    len_flat = len(N_flat_list)
-
-    # A zero in N calls H[0], so remove zero-padded neighborhood elements:
-    Z = np.zeros((max_num_neighbors, len(L)))
-    for index in indices:
-        Z[0:N_sizes[index], index] = 1
+    indices = np.asarray(indices, dtype=int).ravel()
+    sources, neighbors = gather_neighbors(N, indices)
+    N_sizes = np.array([len(N[x]) for x in indices.tolist()], dtype=int)
+    rows = np.repeat(np.arange(len(indices)), N_sizes)
 
     # Assign cost values to each vertex (for indices):
     C = np.zeros(len(L))
-    C[indices] = compute_costs(L[indices], H[indices], H_N[:,indices],
-                               N_sizes[indices], wN_max, Z[:,indices])
+    C[indices] = compute_costs(L[indices], H[indices], H[neighbors], rows,
+                               N_sizes, wN_max)
     npoints = len(indices)
 
     # Loop until count reaches max_count or until end_flag equals zero
@@ -465,50 +521,84 @@ def connect_points_hmmf(indices_points, indices, L, neighbor_lists,
     wN = wN_max
     gradient_factor = grad_min
     while end_flag < n_tries_no_change and count < max_count:
+        t0 = time()
 
         # Select indices with a positive HMMF value:
-        V = [indices[i] for i,x in enumerate(H[indices]) if x > 0.0]
+        I_V = np.where(H[indices] > 0.0)[0]
+        V = indices[I_V]
+        if not all(N_sizes[I_V]):
+            import sys
+            sys.exit('ERROR: No HMMF neighbors to compute cost.')
 
         # Update neighborhood H values:
-        #H_N = np.reshape(H[N_flat_list], N_array_shape)
-        H_N = np.zeros(len_flat)
-        H_N[ind_flat] = H[N_flat[ind_flat].tolist()]
-        H_N = np.reshape(H_N, N_array_shape)
+        H_N = H[neighbors]
 
         # Compute the cost gradient for the HMMF values:
         H_decr = H - H_step
         H_decr[H_decr < 0] = 0.0
-        C_decr = compute_costs(L[V], H_decr[V], H_N[:,V], N_sizes[V], wN, Z[:,V])
+        C_decr = compute_costs(L[indices], H_decr[indices], H_N, rows,
+                               N_sizes, wN)[I_V]
         H_tests[V] = H[V] - gradient_factor * (C[V] - C_decr)
         H_tests[H_tests < 0] = 0.0
         H_tests[H_tests > 1] = 1.0
 
-        # For each index:
-        for index in V:
-
-                # Do not update anchor point costs:
-                if index not in indices_points:
-
-                    # Update a vertex HMMF value if it is away from the threshold:
-                    update = True
-                    # Or if it crosses the threshold and is a topologically
-                    # "simple point" (0.5 not considered part of the fundus):
-                    if H[index] > 0.5 >= H_tests[index]:
-                        update, n_in = topo_test(index, H_new, N)
-                    elif H[index] <= 0.5 < H_tests[index]:
-                        update, n_in = topo_test(index, 1 - H_new, N)
-                    if update:
-                        H_new[index] = H_tests[index]
+        #---------------------------------------------------------------------
+        # Update HMMF values (not of anchor points).
+        # Update a vertex HMMF value if it is away from the threshold,
+        # or if it crosses the threshold and is a topologically
+        # "simple point" (0.5 not considered part of the fundus).
+        # Updates that do not change which side of the threshold
+        # a value is on do not affect topology, so they are made at once;
+        # the others are made in order:
+        #---------------------------------------------------------------------
+        U = V[~is_anchor[V]]
+        H_U = H[U]
+        H_tests_U = H_tests[U]
+        decreasing = (H_U > 0.5) & (0.5 >= H_tests_U)
+        increasing = (H_U <= 0.5) & (0.5 < H_tests_U)
+        in_order = decreasing | increasing | \
+                   ((H_U < 0.5) != (H_tests_U < 0.5))
+        H_new[U[~in_order]] = H_tests_U[~in_order]
+        H_new_complement = 1 - H_new
+
+        # Test the topology of threshold-crossing vertices together:
+        tested = {}
+        if rings is not None:
+            for crossing, values in [(decreasing, H_new),
+                                     (increasing, H_new_complement)]:
+                if np.any(crossing):
+                    simple, n_in = topo_tests(U[crossing], values, N, rings)
+                    tested.update(zip(U[crossing].tolist(), simple.tolist()))
+
+        # Retest vertices whose neighbors changed sides in the meantime:
+        changed = set()
+        for index, is_decreasing, is_increasing in \
+                zip(U[in_order].tolist(), decreasing[in_order].tolist(),
+                    increasing[in_order].tolist()):
+            update = True
+            if is_decreasing or is_increasing:
+                if index in tested and index not in changed:
+                    update = tested[index]
+                elif is_decreasing:
+                    update, n_in = topo_test(index, H_new, N, rings)
+                else:
+                    update, n_in = topo_test(index, H_new_complement, N,
+                                             rings)
+            if update:
+                H_new[index] = H_tests[index]
+                H_new_complement[index] = 1 - H_new[index]
+                changed.update(N[index])
 
         # Update the cost values:
-        C[V] = compute_costs(L[V], H_new[V], H_N[:,V], N_sizes[V], wN, Z[:,V])
+        C[V] = compute_costs(L[indices], H_new[indices], H_N, rows,
+                             N_sizes, wN)[I_V]
 
         # Sum the cost values across all vertices and tally the number
         # of HMMF values greater than the threshold.
         # After iteration 1, compare current and previous values.
         # If the values are similar, increment end_flag:
         costs = sum(C[V].tolist())
-        npoints_thr = len([x for x in H[V].tolist() if x > 0.5])
+        npoints_thr = int(np.sum(H[V] > 0.5))
 
         # Terminate the loop if there are insufficient changes:
         if count > 0:
@@ -534,6 +624,9 @@ def connect_points_hmmf(indices_points, indices, L, neighbor_lists,
             if wN > wN_min:
                 wN = wN_max - factor * (wN_max - wN_min)
 
+        if callback:
+            callback(count, costs, npoints_thr, time() - t0)
+
         # Reset for next iteration:
         costs_previous = costs
         npoints_thr_previous = npoints_thr
@@ -552,8 +645,9 @@ def connect_points_hmmf(indices_points, indices, L, neighbor_lists,
 
     # Skeletonize:
     if do_erode:
-        skeleton = connect_points_erosion(S, indices_points, N,
-                                          values=H, erode_ratio=0.5)
+        skeleton = connect_points_erosion(S, N, list(indices_points),
+                                          values=H, erode_ratio=0.5,
+                                          background_value=0, rings=rings)
         print('      Removed {0} points to create one-vertex-thin skeletons'.
               format(int(npoints_thr - len(skeleton))))
     else:
@@ -564,7 +658,7 @@ def connect_points_hmmf(indices_points, indices, L, neighbor_lists,
 
 def smooth_skeleton(skeletons, bounds, vtk_file, likelihoods,
                     wN_max=1.0, erode_again=False, save_file=False,
-                    background_value=-1):
+                    background_value=-1, ring_test=False):
     """
     Smooth skeleton by dilation followed by connect_points_hmmf().
 
@@ -581,8 +675,9 @@ def smooth_skeleton(skeletons, bounds, vtk_file, likelihoods,
         skeleton number for each vertex
     bounds : list of integers
         region number for each vertex; constrains smoothed skeletons
-    vtk_file : string
+    vtk_file : string or Surface
         file from which to extract neighboring vertices for each vertex
+        (or a Surface read from such a file)
     likelihoods : list of integers
         fundus likelihood value for each vertex
     wN_max : float
@@ -593,6 +688,10 @@ def smooth_skeleton(skeletons, bounds, vtk_file, likelihoods,
         save output VTK file?
     background_value : integer
         background value
+    ring_test : Boolean
+        test simple points around cyclically ordered one-rings
+        (faster, but on irregular meshes it can give different skeletons;
+        see mindboggle.utils.morph.topo_test())
 
     Returns
     -------
@@ -639,14 +738,19 @@ def smooth_skeleton(skeletons, bounds, vtk_file, likelihoods,
     from time import time
 
     from mindboggle.utils.io_vtk import rewrite_scalars
-    from mindboggle.utils.mesh import find_neighbors_from_file, find_endpoints
+    from mindboggle.utils.mesh import Surface, find_endpoints
     from mindboggle.utils.segment import segment
     from mindboggle.utils.morph import dilate
     from mindboggle.utils.paths import connect_points_erosion, connect_points_hmmf
 
     t0 = time()
 
-    neighbor_lists = find_neighbors_from_file(vtk_file)
+    surface = Surface.load(vtk_file)
+    neighbor_lists = surface.neighbor_lists
+    if ring_test:
+        rings = surface.rings
+    else:
+        rings = None
     indices = np.where(bounds != background_value)[0]
     npoints = len(bounds)
 
@@ -701,7 +805,8 @@ def smooth_skeleton(skeletons, bounds, vtk_file, likelihoods,
                     S = Z.copy()
                     S[indices] = 1
                     dilated = connect_points_erosion(S, neighbor_lists,
-                        dilated, [], [], 1, 0, [], '')
+                        dilated, [], [], 1, 0, [], '', background_value,
+                        rings)
     
                 #-------------------------------------------------------------
                 # Set undilated likelihoods to background to keep neighbors:
@@ -714,7 +819,7 @@ def smooth_skeleton(skeletons, bounds, vtk_file, likelihoods,
                 #-------------------------------------------------------------
                 print('    Smoothly re-skeletonize dilated skeleton...')
                 new_skeleton = connect_points_hmmf(endpoints, dilated, L,
-                    neighbor_lists, wN_max)
+                    neighbor_lists, wN_max, rings=rings)
     
                 ## Plot overlap of dilated and pre-/post-smoothed skeleton:
                 #from mindboggle.utils.plots import plot_surfaces
@@ -738,7 +843,7 @@ def smooth_skeleton(skeletons, bounds, vtk_file, likelihoods,
 
     if save_file:
         skeletons_file = os.path.join(os.getcwd(), 'smooth_skeletons.vtk')
-        rewrite_scalars(vtk_file, skeletons_file, smooth_skeletons,
+        rewrite_scalars(surface.input_vtk, skeletons_file, smooth_skeletons,
                         'smooth_skeletons', bounds)
     else:
         skeletons_file = None
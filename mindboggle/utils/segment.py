@@ -14,7 +14,8 @@ Copyright 2013,  Mindboggle team (http://mindboggle.info), Apache v2.0 License
 # Propagate ring_labels to segment surface into contiguous regions
 #-----------------------------------------------------------------------------
 def propagate(points, faces, region, seeds, labels,
-              max_iters=500, tol=0.001, sigma=10, background_value=-1):
+              max_iters=500, tol=0.001, sigma=10, background_value=-1,
+              method='propagate_labels'):
     """
     Propagate labels to segment surface into contiguous regions,
     starting from seed vertices.
@@ -41,6 +42,9 @@ def propagate(points, faces, region, seeds, labels,
         gaussian kernel parameter
     background_value : integer
         background value
+    method : string
+        graph-based learning method: 'propagate_labels' (iterative)
+        or 'solve_labels' (direct; max_iters and tol are not used)
 
     Returns
     -------
@@ -135,7 +139,7 @@ def propagate(points, faces, region, seeds, labels,
                 B.num_points = len(B.Points)
 
                 # Propagate seed IDs from seeds:
-                B.graph_based_learning(method='propagate_labels', realign=False,
+                B.graph_based_learning(method=method, realign=False,
                                        kernel=kernels.rbf_kernel, sigma=sigma,
                                        max_iters=max_iters, tol=tol, vis=False)
 
@@ -162,12 +166,25 @@ def segment(vertices_to_segment, neighbor_lists, min_region_size=1,
     Segment vertices of surface into contiguous regions by seed growing,
     starting from zero or more lists of seed vertices.
 
+    Each seed list grows by one ring of neighbors per step, and seed lists
+    take turns growing. Vertices still to segment and vertices already
+    in a region are kept as Boolean arrays, and each step finds
+    the neighbors of all of a seed list's vertices at once, so a step
+    takes time in proportion to the size of the seed list.
+
+    Without seed lists, the first vertex of vertices_to_segment
+    is the first seed, and each new region is seeded from the
+    lowest-numbered vertex remaining to be segmented.
+
     Parameters
     ----------
-    vertices_to_segment : list of integers
+    vertices_to_segment : list or array of integers (or Boolean array)
         indices to mesh vertices to be segmented
-    neighbor_lists : list of lists of integers
+        (or True for each mesh vertex to be segmented)
+    neighbor_lists : list of lists of integers (or tuple or Surface)
         each list contains indices to neighboring vertices for each vertex
+        (or (indptr, indices) neighbor arrays, see find_neighbors_csr(),
+        or a Surface)
     min_region_size : integer
         minimum size of segmented set of vertices
     seed_lists : list of lists, or empty list
@@ -240,45 +257,71 @@ def segment(vertices_to_segment, neighbor_lists, min_region_size=1,
 
     """
     import numpy as np
+    from mindboggle.utils.mesh import Surface, gather_neighbors
 
     verbose = False
 
-    # Make sure arguments are lists:
-    if isinstance(vertices_to_segment, np.ndarray):
-        vertices_to_segment = vertices_to_segment.tolist()
-    if isinstance(labels, np.ndarray):
-        labels = [int(x) for x in labels]
-    if isinstance(values, np.ndarray):
-        values = values.tolist()
+    if isinstance(neighbor_lists, Surface):
+        neighbor_lists = neighbor_lists.neighbor_csr
+    if isinstance(neighbor_lists, tuple):
+        npoints = len(neighbor_lists[0]) - 1
+    else:
+        npoints = len(neighbor_lists)
+
+    #-------------------------------------------------------------------------
+    # Boolean array of vertices remaining to be segmented, and
+    # candidates for new seeds (lowest-numbered first):
+    #-------------------------------------------------------------------------
+    vertices_to_segment = np.asarray(vertices_to_segment)
+    remaining = np.zeros(npoints, dtype=bool)
+    if vertices_to_segment.dtype == bool:
+        remaining[:] = vertices_to_segment
+        vertices_to_segment = np.flatnonzero(remaining)
+    else:
+        vertices_to_segment = vertices_to_segment.astype(np.int64).ravel()
+        remaining[vertices_to_segment] = True
+    nremaining = np.sum(remaining)
+    seed_candidates = np.flatnonzero(remaining).tolist()
+    icandidate = 0
+
+    segments = background_value * np.ones(npoints)
+    if not nremaining and not len(seed_lists):
+        return segments
+
+    if len(values):
+        values = np.asarray(values)
+    if spread_within_labels:
+        labels = np.asarray(labels)
 
     #-------------------------------------------------------------------------
     # If seed_lists is empty, select first vertex from vertices_to_segment
     # (single vertex selection does not affect result -- see below*):
     #-------------------------------------------------------------------------
-    if seed_lists:
+    if len(seed_lists):
         select_single_seed = False
+        seed_lists = [np.asarray(x, dtype=np.int64).ravel() for x in seed_lists]
         if verbose:
             if len(seed_lists) == 1:
                 print('    Segment {0} vertices from seed vertices'.
-                      format(len(vertices_to_segment)))
+                      format(nremaining))
             else:
                 print('    Segment {0} vertices from {1} sets of seed vertices'.
-                      format(len(vertices_to_segment), len(seed_lists)))
+                      format(nremaining, len(seed_lists)))
     else:
         select_single_seed = True
-        seed_lists = [[vertices_to_segment[0]]]
+        seed_lists = [vertices_to_segment[0:1]]
         if verbose:
             print('    Segment {0} vertices from first vertex as initial seed'.
-                  format(len(vertices_to_segment)))
+                  format(nremaining))
 
     #-------------------------------------------------------------------------
-    # Initialize variables, including the list of vertex indices for each region,
-    # vertex indices for all regions, and Boolean list indicating which regions
-    # are fully grown, number of segments, etc.:
+    # Initialize variables, including the list of vertex arrays for each
+    # region (and its size), Boolean array of vertices in all regions, and
+    # Boolean list indicating which regions are fully grown, etc.:
     #-------------------------------------------------------------------------
-    segments = background_value * np.ones(len(neighbor_lists))
     region_lists = [[] for x in seed_lists]
-    all_regions = []
+    region_sizes = [0 for x in seed_lists]
+    all_regions = np.zeros(npoints, dtype=bool)
     fully_grown = [False for x in seed_lists]
     new_segment_index = 0
     counter = 0
@@ -290,10 +333,7 @@ def segment(vertices_to_segment, neighbor_lists, min_region_size=1,
     #-------------------------------------------------------------------------
     if spread_within_labels:
         if not len(label_lists):
-            label_lists = []
-            for seed_list in seed_lists:
-                seed_labels = np.unique([labels[x] for x in seed_list])
-                label_lists.append(seed_labels)
+            label_lists = [np.unique(labels[x]) for x in seed_lists]
 
     #-------------------------------------------------------------------------
     # Loop until all of the seed lists have grown to their full extent:
@@ -301,7 +341,8 @@ def segment(vertices_to_segment, neighbor_lists, min_region_size=1,
     count = 0
     while not all(fully_grown):
         # Loop through seed lists over and over again:
-        for ilist, seed_list in enumerate(seed_lists):
+        for ilist in range(len(seed_lists)):
+            seed_list = seed_lists[ilist]
             # If seed list empty
             if not len(seed_list):
                 fully_grown[ilist] = True
@@ -309,45 +350,41 @@ def segment(vertices_to_segment, neighbor_lists, min_region_size=1,
             if not fully_grown[ilist]:
 
                 # Add seeds to region:
-                region_lists[ilist].extend(seed_list)
-                all_regions.extend(seed_list)
+                region_lists[ilist].append(seed_list)
+                region_sizes[ilist] += len(seed_list)
+                all_regions[seed_list] = True
 
                 # Remove seeds from vertices to segment:
-                vertices_to_segment = list(frozenset(vertices_to_segment).
-                difference(seed_list))
-
-                if vertices_to_segment:
-
-                    # Find neighbors of each seed with lower values than the seed:
-                    if values:
-                        neighbors = []
-                        for seed in seed_list:
-                            seed_neighbors = neighbor_lists[seed]
-                            seed_neighbors = [x for x in seed_neighbors
-                                              if values[x] <= values[seed]]
-                            if seed_neighbors:
-                                neighbors.extend(seed_neighbors)
-                    else:
-                        # Find neighbors of seeds:
-                        neighbors = []
-                        [neighbors.extend(neighbor_lists[x]) for x in seed_list]
+                removed = np.unique(seed_list[remaining[seed_list]])
+                remaining[removed] = False
+                nremaining -= len(removed)
+
+                if nremaining:
+
+                    # Find neighbors of seeds (with values no higher than
+                    # the seed's, if values are given):
+                    sources, neighbors = gather_neighbors(neighbor_lists,
+                                                          seed_list)
+                    if len(values):
+                        neighbors = neighbors[values[neighbors] <=
+                                              values[sources]]
 
                     # Select neighbors that have not been previously selected
                     # and are among the vertices to segment:
-                    seed_list = list(frozenset(neighbors).intersection(vertices_to_segment))
-                    seed_list = list(frozenset(seed_list).difference(all_regions))
+                    seed_list = np.unique(neighbors[remaining[neighbors] &
+                                                    ~all_regions[neighbors]])
 
                 else:
-                    seed_list = []
+                    seed_list = seed_list[:0]
 
                 # If there are seeds remaining:
-                if seed_list and count < max_steps:
+                if len(seed_list) and count < max_steps:
 
                     # Select neighbors with the same labels
                     # as the initial seed labels:
                     if spread_within_labels:
-                        seed_list = [x for x in seed_list
-                                     if labels[x] in label_lists[ilist]]
+                        seed_list = seed_list[np.in1d(labels[seed_list],
+                                                      label_lists[ilist])]
 
                     # Continue growing seed list:
                     seed_lists[ilist] = seed_list
@@ -359,7 +396,7 @@ def segment(vertices_to_segment, neighbor_lists, min_region_size=1,
                     fully_grown[ilist] = True
 
                     # If the region size is large enough:
-                    size_region = len(region_lists[ilist])
+                    size_region = region_sizes[ilist]
                     if size_region >= min_region_size:
 
                         # Assign ID to segmented region and increment ID:
@@ -368,82 +405,93 @@ def segment(vertices_to_segment, neighbor_lists, min_region_size=1,
                             counter += 1
                         else:
                             new_segment_index = ilist
-                        segments[region_lists[ilist]] = new_segment_index
+                        segments[np.concatenate(region_lists[ilist])] = \
+                            new_segment_index
 
                         # Display current number and size of region:
                         if verbose and size_region > 1:
-                            if len(seed_lists) == 1 and vertices_to_segment:
+                            if len(seed_lists) == 1 and nremaining:
                                 print("      {0} vertices remain".
-                                      format(len(vertices_to_segment)))
+                                      format(nremaining))
                             else:
                                 print("      Region {0}: {1} vertices ({2} remain)".
                                       format(int(new_segment_index), size_region,
-                                             len(vertices_to_segment)))
+                                             nremaining))
 
                     # If selecting a single seed, continue growing
                     # if there are more vertices to segment:
                     if select_single_seed and count < max_steps:
-                        if len(vertices_to_segment) >= min_region_size:
+                        if nremaining and nremaining >= min_region_size:
+                            while not remaining[seed_candidates[icandidate]]:
+                                icandidate += 1
                             fully_grown[0] = False
-                            seed_lists[0] = [vertices_to_segment[0]]
+                            seed_lists[0] = np.array(
+                                [seed_candidates[icandidate]])
                             region_lists[0] = []
+                            region_sizes[0] = 0
 
     #-------------------------------------------------------------------------
     # Keep growing from new seeds even after all seed lists have fully grown:
     #-------------------------------------------------------------------------
-    if keep_seeding and len(vertices_to_segment) >= min_region_size:
+    if keep_seeding and nremaining and nremaining >= min_region_size:
         if verbose:
             print('    Keep seeding to segment {0} remaining vertices'.
-                  format(len(vertices_to_segment)))
+                  format(nremaining))
 
         # Select first unsegmented vertex as new seed:
-        seed_list = [vertices_to_segment[0]]
+        while not remaining[seed_candidates[icandidate]]:
+            icandidate += 1
+        seed_list = np.array([seed_candidates[icandidate]])
 
         # Loop until the seed list has grown to its full extent:
-        new_segment_index = ilist + 1
+        new_segment_index = len(seed_lists)
         region = []
-        while len(vertices_to_segment) >= min_region_size:
+        size_region = 0
+        while nremaining and nremaining >= min_region_size:
 
             # Add seeds to region:
-            region.extend(seed_list)
-            all_regions.extend(seed_list)
+            region.append(seed_list)
+            size_region += len(seed_list)
+            all_regions[seed_list] = True
 
             # Remove seeds from vertices to segment:
-            vertices_to_segment = list(frozenset(vertices_to_segment).
-            difference(seed_list))
-            if vertices_to_segment:
+            removed = np.unique(seed_list[remaining[seed_list]])
+            remaining[removed] = False
+            nremaining -= len(removed)
+            if nremaining:
 
                 # Identify neighbors of seeds:
-                neighbors = []
-                [neighbors.extend(neighbor_lists[x]) for x in seed_list]
+                sources, neighbors = gather_neighbors(neighbor_lists,
+                                                      seed_list)
 
                 # Select neighbors that have not been previously selected
                 # and are among the vertices to segment:
-                seed_list = list(frozenset(vertices_to_segment).intersection(neighbors))
-                seed_list = list(frozenset(seed_list).difference(all_regions))
+                seed_list = np.unique(neighbors[remaining[neighbors] &
+                                                ~all_regions[neighbors]])
             else:
-                seed_list = []
+                seed_list = seed_list[:0]
 
             # If there are no seeds remaining:
             if not len(seed_list):
 
                 # If the region size is large enough:
-                size_region = len(region)
                 if size_region >= min_region_size:
 
                     # Assign ID to segmented region and increment ID:
-                    segments[region] = new_segment_index
+                    segments[np.concatenate(region)] = new_segment_index
                     new_segment_index += 1
 
                     # Display current number and size of region:
                     if verbose and size_region > 1:
-                        print("      {0} vertices remain".
-                              format(len(vertices_to_segment)))
+                        print("      {0} vertices remain".format(nremaining))
 
                 # Select first unsegmented vertex as new seed:
-                if len(vertices_to_segment) >= min_region_size:
-                    seed_list = [vertices_to_segment[0]]
+                if nremaining and nremaining >= min_region_size:
+                    while not remaining[seed_candidates[icandidate]]:
+                        icandidate += 1
+                    seed_list = np.array([seed_candidates[icandidate]])
                     region = []
+                    size_region = 0
 
     return segments
 
@@ -687,7 +735,7 @@ def segment_rings(region, seeds, neighbor_lists, step=1, background_value=-1):
 #-----------------------------------------------------------------------------
 def watershed(depths, points, indices, neighbor_lists, min_size=1,
               depth_factor=0.25, depth_ratio=0.1, tolerance=0.01, regrow=True,
-              background_value=-1):
+              background_value=-1, merge=True):
     """
     Segment vertices of a surface mesh into contiguous "watershed basins"
     by seed growing from an iterative selection of the deepest vertices.
@@ -701,6 +749,16 @@ def watershed(depths, points, indices, neighbor_lists, min_size=1,
         4. Merge segments if their seeds are too close to each other
             or their depths are very different.
 
+    Vertices are visited in order of decreasing depth (sorted once), so each
+    new seed is the deepest unsegmented vertex without a search, and each
+    basin is grown with Boolean arrays of unsegmented and segmented
+    vertices, so every vertex and edge is visited a bounded number of
+    times: the segmentation takes O(N log N) rather than quadratic time.
+    Basins are merged with a union-find structure, so that a basin
+    merged into a basin that is itself merged ends up in the deepest one.
+    Apart from ties in depth and chains of merges, the result is the same
+    as watershed_reference(), the original implementation.
+
     Note ::
 
         Despite the above precautions, the order of seed selection in segment()
@@ -714,7 +772,7 @@ def watershed(depths, points, indices, neighbor_lists, min_size=1,
         depth values for all vertices
     points : list of lists of floats
         each element is a list of 3-D coordinates of a vertex on a surface mesh
-    indices : list of integers
+    indices : list or array of integers
         indices to mesh vertices to be segmented
     min_size : index
         the minimum number of vertices in a basin
@@ -734,6 +792,8 @@ def watershed(depths, points, indices, neighbor_lists, min_size=1,
         regrow segments from watershed seeds?
     background_value : integer
         background value
+    merge : Boolean
+        merge watershed catchment basins (step 4)?
 
     Returns
     -------
@@ -741,6 +801,9 @@ def watershed(depths, points, indices, neighbor_lists, min_size=1,
         region numbers for all vertices
     seed_indices : list of integers
         list of indices to seed vertices
+    basin_depths : list of floats
+        depth of each seed's basin before merging (the distance between
+        its deepest and shallowest vertices), in the order of seed_indices
 
     Examples
     --------
@@ -764,7 +827,7 @@ def watershed(depths, points, indices, neighbor_lists, min_size=1,
     >>> regrow = True
     >>> background_value = -1
     >>> #
-    >>> segments, seed_indices = watershed(depths, points,
+    >>> segments, seed_indices, basin_depths = watershed(depths, points,
     >>>     indices, neighbor_lists, min_size, depth_factor, depth_ratio,
     >>>     tolerance, regrow, background_value)
     >>> #
@@ -779,6 +842,358 @@ def watershed(depths, points, indices, neighbor_lists, min_size=1,
     >>> rewrite_scalars(depth_file, 'watershed_seeds.vtk',
     >>>                 seeds, 'seeds', seeds)
     >>> plot_surfaces('watershed_seeds.vtk')
+    >>> #
+    >>> # Compare with watershed_reference() before merging basins,
+    >>> # on a synthetic surface:
+    >>> from mindboggle.utils.segment import watershed_reference
+    >>> n = 30
+    >>> grid = np.arange(n * n).reshape(n, n)
+    >>> faces = np.vstack([np.column_stack([grid[:-1, :-1].ravel(),
+    >>>     grid[1:, :-1].ravel(), grid[:-1, 1:].ravel()]),
+    >>>     np.column_stack([grid[1:, :-1].ravel(), grid[1:, 1:].ravel(),
+    >>>     grid[:-1, 1:].ravel()])]).tolist()
+    >>> x, y = np.mgrid[0:n, 0:n]
+    >>> depths = (np.sin(x / 3.0) * np.cos(y / 4.0) + x * y / 1e4).ravel()
+    >>> points = np.column_stack([x.ravel(), y.ravel(), depths]).tolist()
+    >>> neighbor_lists = find_neighbors(faces, n * n)
+    >>> indices = np.where(depths > 0.1)[0]
+    >>> segments, seed_indices, basin_depths = watershed(depths, points,
+    >>>     indices, neighbor_lists, min_size=5, merge=False)
+    >>> segments0, seed_indices0 = watershed_reference(depths, points,
+    >>>     indices.tolist(), neighbor_lists, min_size=5, merge=False)
+    >>> segments == segments0, seed_indices == seed_indices0
+    (True, True)
+
+    """
+    import numpy as np
+    from time import time
+    from mindboggle.utils.mesh import gather_neighbors
+    from mindboggle.utils.segment import extract_borders
+    from mindboggle.utils.segment import segment
+    from mindboggle.utils.compute import point_distance
+
+    depths = np.asarray(depths)
+    indices = np.unique(np.asarray(indices, dtype=np.int64))
+    npoints = len(depths)
+
+    print('Segment {0} vertices by a surface watershed algorithm'.
+          format(len(indices)))
+    verbose = False
+    t0 = time()
+    tiny = 0.000001
+
+    use_depth_ratio = True
+
+    #-------------------------------------------------------------------------
+    # Find the borders of the given mesh vertices (indices):
+    #-------------------------------------------------------------------------
+    D = np.ones(npoints)
+    D[indices] = 2
+    borders, foo1, foo2 = extract_borders(range(npoints), D,
+        neighbor_lists, ignore_values=[], return_label_pairs=False)
+    is_border = np.zeros(npoints, dtype=bool)
+    is_border[borders] = True
+
+    def shallower_neighbors(seed_list, remaining, all_regions):
+        # Neighbors of seeds that remain to be segmented, are not in a region
+        # and are shallower than (or within tolerance of) a seed's depth:
+        sources, neighbors = gather_neighbors(neighbor_lists, seed_list)
+        keep = remaining[neighbors] & ~all_regions[neighbors] & \
+               (depths[neighbors] - tolerance <= depths[sources])
+        return np.unique(neighbors[keep])
+
+    #-------------------------------------------------------------------------
+    # Order vertices from deepest to shallowest (seed candidates):
+    #-------------------------------------------------------------------------
+    deepest_first = indices[np.argsort(-depths[indices],
+                                       kind='mergesort')].tolist()
+    ideepest = 0
+
+    #-------------------------------------------------------------------------
+    # Loop until all vertices have been segmented.
+    # This limits the number of possible seeds:
+    #-------------------------------------------------------------------------
+    remaining = np.zeros(npoints, dtype=bool)
+    remaining[indices] = True
+    nremaining = len(indices)
+    all_regions = np.zeros(npoints, dtype=bool)
+    segments = background_value * np.ones(npoints)
+    seed_indices = []
+    seed_points = []
+    basin_depths = []
+    counter = 0
+    while nremaining:
+
+        # Select deepest unsegmented vertex as new seed:
+        while not remaining[deepest_first[ideepest]]:
+            ideepest += 1
+        index_deepest = deepest_first[ideepest]
+        seed_list = np.array([index_deepest])
+
+        # Grow region until there are no more shallower neighbors:
+        region = []
+        while len(seed_list):
+            region.append(seed_list)
+            all_regions[seed_list] = True
+            remaining[seed_list] = False
+            nremaining -= len(seed_list)
+            if nremaining:
+                seed_list = shallower_neighbors(seed_list, remaining,
+                                                all_regions)
+            else:
+                seed_list = seed_list[:0]
+        region = np.concatenate(region)
+
+        # If there is at least min_size points, assign counter to
+        # segmented region, store index, and increment counter:
+        if len(region) >= min_size:
+            segments[region] = counter
+            seed_indices.append(index_deepest)
+            seed_points.append(points[index_deepest])
+            counter += 1
+
+            # Compute basin depth (max - min):
+            Imax = region[np.argmax(depths[region])]
+            Imin = region[np.argmin(depths[region])]
+            max_depth = point_distance(points[Imax], [points[Imin]])[0]
+            basin_depths.append(max_depth)
+
+        # Display current number and size of region:
+        if verbose:
+            print("    {0} vertices remain".format(nremaining))
+
+    print('  ...Segmented {0} initial watershed regions ({1:.2f} seconds)'.
+          format(counter, time() - t0))
+
+    #-------------------------------------------------------------------------
+    # Regrow from (deep) watershed seeds, stopping at borders:
+    #-------------------------------------------------------------------------
+    if regrow:
+
+        print('  Regrow segments from watershed seeds, stopping at borders')
+        remaining[indices] = True
+        nremaining = len(indices)
+        all_regions[:] = False
+        segments = background_value * np.ones(npoints)
+        for iseed, seed_index in enumerate(seed_indices):
+            seed_list = np.array([seed_index])
+            region = []
+            while len(seed_list):
+
+                # Add seeds to region:
+                region.append(seed_list)
+                all_regions[seed_list] = True
+
+                # Remove seeds from vertices to segment:
+                removed = seed_list[remaining[seed_list]]
+                remaining[removed] = False
+                nremaining -= len(removed)
+                if nremaining:
+
+                    # Select shallower neighbors not previously selected:
+                    seed_list = shallower_neighbors(seed_list, remaining,
+                                                    all_regions)
+
+                    # Remove seed list if it contains a border vertex:
+                    if np.any(is_border[seed_list]):
+                        seed_list = seed_list[:0]
+                else:
+                    seed_list = seed_list[:0]
+
+            # If there is at least min_size points, store index:
+            region = np.concatenate(region)
+            if len(region) >= min_size:
+                segments[region] = iseed
+
+            # Display current number and size of region:
+            if verbose:
+                print("    {0} vertices remain".format(nremaining))
+
+        #---------------------------------------------------------------------
+        # Continue growth until there are no more vertices to segment:
+        #---------------------------------------------------------------------
+        # Note: As long as keep_seeding=False, the segment values in `segments`
+        # are equal to the order of the `basin_depths` and `seed_points` below.
+        seed_lists = [np.flatnonzero(segments == s)
+                      for s in np.unique(segments) if s != background_value]
+        segments = segment(remaining, neighbor_lists, min_region_size=1,
+            seed_lists=seed_lists, keep_seeding=False, spread_within_labels=False,
+            labels=[], label_lists=[], values=[], max_steps='', verbose=False)
+
+        print('  ...Regrew {0} watershed regions from seeds ({1:.2f} seconds)'.
+              format(len(seed_indices), time() - t0))
+
+    #-------------------------------------------------------------------------
+    # Merge watershed catchment basins:
+    #-------------------------------------------------------------------------
+    if merge:
+
+        # Extract segments pairs at borders between watershed basins:
+        print('  Merge watershed catchment basins with deeper neighboring basins')
+        if verbose:
+            print('    Extract basin borders')
+        foo1, foo2, pairs = extract_borders(indices.tolist(), segments,
+                                            neighbor_lists,
+                                            ignore_values=[background_value],
+                                            return_label_pairs=True)
+        # Sort basin depths (descending order) -- return segment indices:
+        Isort = np.argsort(basin_depths).tolist()
+        Isort.reverse()
+
+        # Union-find structure: each basin points to the (deeper) basin
+        # it is merged into; a basin pointing to itself is not merged,
+        # and is the root of the basins merged into it:
+        parents = list(range(len(basin_depths)))
+
+        def find_root(basin):
+            while parents[basin] != basin:
+                parents[basin] = parents[parents[basin]]
+                basin = parents[basin]
+            return basin
+
+        # Find neighboring basins to each of the sorted basins:
+        if verbose:
+            print("    Find neighboring basins")
+        # (a border vertex may have more than two basins as neighbors):
+        for index in Isort:
+            index_neighbors = [int(y) for x in pairs if index in x
+                               for y in x if y != index]
+
+            # Merge neighbors whose depth is less than a fraction of the
+            # basin's depth and farther away than half the basin's depth
+            # (each basin is merged into the first such deeper basin):
+            for x in index_neighbors:
+                if parents[x] != x or find_root(index) == x:
+                    continue
+                far = point_distance(seed_points[x], [seed_points[index]])[0] > \
+                      depth_factor * max([basin_depths[x], basin_depths[index]])
+                if use_depth_ratio:
+                    shallow = basin_depths[x] / (basin_depths[index] + tiny) < \
+                              depth_ratio
+                else:
+                    shallow = True
+                if far and shallow:
+                    parents[x] = index
+
+        # Replace basin numbers by their merged basins' roots,
+        # and renumber segments so they are sequential:
+        is_segment = segments != background_value
+        if np.any(is_segment):
+            roots = np.array([find_root(x) for x in range(len(parents))])
+            merged = roots[segments[is_segment].astype(int)]
+            segment_numbers, renumbered = np.unique(merged, return_inverse=True)
+            segments[is_segment] = renumbered
+        else:
+            segment_numbers = []
+
+        # Print statement:
+        print('  ...Merged segments to form {0} watershed regions ({1:.2f} seconds)'.
+              format(len(segment_numbers), time() - t0))
+
+    return segments.tolist(), seed_indices, basin_depths
+
+
+def watershed_reference(depths, points, indices, neighbor_lists, min_size=1,
+              depth_factor=0.25, depth_ratio=0.1, tolerance=0.01, regrow=True,
+              background_value=-1, merge=True):
+    """
+    Segment vertices of a surface mesh into contiguous "watershed basins"
+    by seed growing from an iterative selection of the deepest vertices.
+
+    This is the original, set-based implementation of watershed(),
+    kept as a reference for testing it. It selects each new seed by
+    searching all unsegmented vertices and rebuilds sets of them at each
+    growth step, so it takes time quadratic in the number of vertices.
+
+    Steps ::
+
+        1. Grow segments from an iterative selection of the deepest seeds.
+        2. Regrow segments from the resulting seeds, until each seed's
+            segment touches a boundary.
+        3. Use the segment() function to fill in the rest.
+        4. Merge segments if their seeds are too close to each other
+            or their depths are very different.
+
+    Note ::
+
+        Despite the above precautions, the order of seed selection in segment()
+        could possibly influence the resulting borders between adjoining
+        segments (vs. propagate(), which is slower and insensitive to depth,
+        but is not biased by seed order).
+
+    Parameters
+    ----------
+    depths : numpy array of floats
+        depth values for all vertices
+    points : list of lists of floats
+        each element is a list of 3-D coordinates of a vertex on a surface mesh
+    indices : list of integers
+        indices to mesh vertices to be segmented
+    min_size : index
+        the minimum number of vertices in a basin
+    neighbor_lists : list of lists of integers
+        each list contains indices to neighboring vertices for each vertex
+    depth_factor : float
+        factor to determine whether to merge two neighboring watershed catchment
+        basins -- they are merged if the Euclidean distance between their basin
+        seeds is less than this fraction of the maximum Euclidean distance
+        between points having minimum and maximum depths
+    depth_ratio : float
+        the minimum fraction of depth for a neighboring shallower
+        watershed catchment basin (otherwise merged with the deeper basin)
+    tolerance : float
+        tolerance for detecting differences in depth between vertices
+    regrow : Boolean
+        regrow segments from watershed seeds?
+    background_value : integer
+        background value
+    merge : Boolean
+        merge watershed catchment basins (step 4)?
+
+    Returns
+    -------
+    segments : list of integers
+        region numbers for all vertices
+    seed_indices : list of integers
+        list of indices to seed vertices
+
+    Examples
+    --------
+    >>> # Perform watershed segmentation on the deeper portions of a surface:
+    >>> import os
+    >>> import numpy as np
+    >>> from mindboggle.utils.mesh import find_neighbors
+    >>> from mindboggle.utils.plots import plot_surfaces
+    >>> from mindboggle.utils.segment import watershed_reference
+    >>> from mindboggle.utils.io_vtk import read_vtk, read_scalars, rewrite_scalars
+    >>> path = os.environ['MINDBOGGLE_DATA']
+    >>> depth_file = os.path.join(path, 'arno', 'shapes', 'lh.pial.travel_depth.vtk')
+    >>> faces, lines, indices, points, npoints, depths, name, input_vtk = read_vtk(depth_file,
+    >>>     return_first=True, return_array=True)
+    >>> indices = np.where(depths > 0.01)[0]  # high to speed up
+    >>> neighbor_lists = find_neighbors(faces, npoints)
+    >>> min_size = 50
+    >>> depth_factor = 0.25
+    >>> depth_ratio = 0.1
+    >>> tolerance = 0.01
+    >>> regrow = True
+    >>> background_value = -1
+    >>> #
+    >>> segments, seed_indices = watershed_reference(depths, points,
+    >>>     indices, neighbor_lists, min_size, depth_factor, depth_ratio,
+    >>>     tolerance, regrow, background_value)
+    >>> #
+    >>> # Write results to vtk file and view:
+    >>> rewrite_scalars(depth_file, 'watershed_reference.vtk',
+    >>>                 segments, 'segments', segments)
+    >>> plot_surfaces('watershed_reference.vtk')
+    >>> # View watershed seeds:
+    >>> seeds = background_value * np.ones(len(depths))
+    >>> for i, s in enumerate(seed_indices):
+    >>>     seeds[s] = i
+    >>> rewrite_scalars(depth_file, 'watershed_reference_seeds.vtk',
+    >>>                 seeds, 'seeds', seeds)
+    >>> plot_surfaces('watershed_reference_seeds.vtk')
 
     """
     import numpy as np
@@ -794,7 +1209,6 @@ def watershed(depths, points, indices, neighbor_lists, min_size=1,
     print('Segment {0} vertices by a surface watershed algorithm'.
           format(len(indices)))
     verbose = False
-    merge = True
     t0 = time()
     tiny = 0.000001
 
@@ -1189,16 +1603,24 @@ def extract_borders(indices, labels, neighbor_lists,
     Label borders are the set of all vertices
     whose neighbors do not share the same label.
 
+    The labels at the far end of each mesh edge leaving the vertices
+    are gathered into arrays, so only the edges of the given vertices
+    are visited, however large the mesh.
+
     Parameters
     ----------
     indices : list of integers
         indices to (a subset of) vertices
     labels : numpy array of integers
         label numbers for all vertices
-    neighbor_lists : list of lists of integers
+    neighbor_lists : list of lists of integers (or tuple or Surface)
         each list contains indices to neighboring vertices for each vertex
+        (or (indptr, indices) neighbor arrays, see find_neighbors_csr(),
+        or a mindboggle.utils.mesh.Surface)
     ignore_values : list of integers
         integers to ignore (e.g., background)
+    return_label_pairs : Boolean
+        return label pairs?
 
     Returns
     -------
@@ -1213,13 +1635,13 @@ def extract_borders(indices, labels, neighbor_lists,
     --------
     >>> # Small example:
     >>> from mindboggle.utils.segment import extract_borders
-    >>> indices = [0,1,2,4,5,8,9]
+    >>> indices = [0,1,2,4,5]
     >>> labels = [10, 20, 30, 40, 50, 60, 70, 80, 90, 100, -1, -1]
     >>> neighbor_lists = [[1,2,3], [1,2], [2,3], [2], [4,7], [3,2,3]]
     >>> extract_borders(indices, labels, neighbor_lists, [], True)
-        ([1, 2, 4, 5],
-         [[20, 30], [30, 40], [50, 80], [30, 40]],
-         [[20, 30], [30, 40], [50, 80]])
+        ([0, 1, 2, 4, 5],
+         [[20, 30, 40], [20, 30], [30, 40], [50, 80], [30, 40]],
+         [[20, 30, 40], [20, 30], [30, 40], [50, 80]])
     >>> # Real example -- extract sulcus label boundaries:
     >>> import os
     >>> import numpy as np
@@ -1246,41 +1668,81 @@ def extract_borders(indices, labels, neighbor_lists,
     """
     import numpy as np
 
+    from mindboggle.utils.mesh import Surface, gather_neighbors
+
     # Make sure arguments are numpy arrays:
     if not isinstance(labels, np.ndarray):
         labels = np.array(labels)
+    indices = np.asarray(indices, dtype=np.int64).ravel()
+    if isinstance(neighbor_lists, Surface):
+        neighbor_lists = neighbor_lists.neighbor_csr
+    nindices = len(indices)
 
-    # Construct an array of labels corresponding to the neighbor lists:
-    L = np.array([list(set(labels[lst])) for lst in neighbor_lists])
-
-    # Find indices to sets of two labels:
-    border_indices = [indices[y] for y in
-                      [i for i,x in enumerate(L[indices])
-                       if len(set(x)) >= 2]]
-
-    if return_label_pairs:
-        border_label_tuples = [np.sort(L[indices[j]]).tolist() for j in
-                                [i for i,x in enumerate(L[indices])
-                                 if len(set(x)) >= 2]]
+    #-------------------------------------------------------------------------
+    # Gather the labels of the neighbors of each vertex (by its position
+    # in indices, so that repeated indices are kept, as before):
+    #-------------------------------------------------------------------------
+    foo, neighbors = gather_neighbors(neighbor_lists, indices)
+    if isinstance(neighbor_lists, tuple):
+        indptr = neighbor_lists[0]
+        counts = indptr[indices + 1] - indptr[indices]
     else:
-        border_label_tuples = []
+        counts = [len(neighbor_lists[i]) for i in indices.tolist()]
+    counts = np.asarray(counts, dtype=np.int64)
+    positions = np.repeat(np.arange(nindices, dtype=np.int64), counts)
+    neighbor_labels = labels[neighbors]
+
+    #-------------------------------------------------------------------------
+    # Vertices whose neighbors have two or more labels have a neighbor
+    # label that differs from that of their first neighbor:
+    #-------------------------------------------------------------------------
+    firsts = np.cumsum(counts) - counts
+    has_neighbors = counts > 0
+    first_labels = np.zeros(nindices, dtype=neighbor_labels.dtype)
+    first_labels[has_neighbors] = neighbor_labels[firsts[has_neighbors]]
+    differs = neighbor_labels != first_labels[positions]
+    is_border = np.bincount(positions[differs], minlength=nindices) > 0
 
-    if ignore_values:
-        Ikeep = [i for i,x in enumerate(border_label_tuples)
-                 if not len(set(x).intersection(ignore_values))]
-        border_indices = [x for i,x in enumerate(border_indices)
-                            if i in Ikeep]
-        if return_label_pairs:
-            border_label_tuples = [x for i,x in enumerate(border_label_tuples)
-                                    if i in Ikeep]
+    #-------------------------------------------------------------------------
+    # Find the distinct neighbor labels of each border vertex, sorted by
+    # position and then by label:
+    #-------------------------------------------------------------------------
+    on_border = is_border[positions]
+    unique_labels, label_codes = np.unique(neighbor_labels[on_border],
+                                           return_inverse=True)
+    nlabels = max(len(unique_labels), 1)
+    keys = np.unique(positions[on_border] * nlabels + label_codes.ravel())
+    key_positions = keys // nlabels
+    key_codes = keys % nlabels
+
+    # Remove vertices with a neighbor label to ignore:
+    if len(ignore_values):
+        is_ignored = np.in1d(unique_labels, ignore_values)
+        is_border[key_positions[is_ignored[key_codes]]] = False
+
+    border_positions = np.flatnonzero(is_border)
+    border_indices = indices[border_positions].tolist()
 
+    #-------------------------------------------------------------------------
+    # Sorted label tuples per border vertex, and unique tuples
+    # in order of first appearance:
+    #-------------------------------------------------------------------------
+    border_label_tuples = []
+    unique_border_label_tuples = []
     if return_label_pairs:
-        unique_border_label_tuples = []
-        for pair in border_label_tuples:
-            if pair not in unique_border_label_tuples:
-                unique_border_label_tuples.append(pair)
-    else:
-        unique_border_label_tuples = []
+        key_labels = unique_labels[key_codes].tolist()
+        nlabels_per_position = np.bincount(key_positions,
+                                           minlength=nindices)
+        stops = np.cumsum(nlabels_per_position)
+        starts = (stops - nlabels_per_position).tolist()
+        stops = stops.tolist()
+        found = set()
+        for position in border_positions.tolist():
+            label_tuple = key_labels[starts[position]:stops[position]]
+            border_label_tuples.append(label_tuple)
+            if tuple(label_tuple) not in found:
+                found.add(tuple(label_tuple))
+                unique_border_label_tuples.append(label_tuple)
 
     return border_indices, border_label_tuples, unique_border_label_tuples
 
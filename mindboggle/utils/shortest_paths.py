@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+"""
+Shortest paths along the edges of a surface mesh.
+
+The mesh is represented as a sparse graph (scipy CSR matrix) whose
+entries are the lengths of the edges between neighboring vertices.
+Paths are found with Dijkstra's algorithm (using a binary heap), from one
+or more sources at a time, and the search stops as soon as it reaches
+a target vertex, so that paths to nearby targets only explore the
+vertices near the sources.
+
+Authors:
+    - agent, 2026  (agent@local)
+
+Copyright 2026,  Mindboggle team (http://mindboggle.info), Apache v2.0 License
+
+"""
+
+
+def edge_length_graph(points, neighbor_lists, squared=False):
+    """
+    Construct a sparse graph of edge lengths between neighboring vertices.
+
+    Parameters
+    ----------
+    points : numpy array of floats
+        coordinates for all vertices
+    neighbor_lists : list of lists of integers (or tuple or Surface)
+        each list contains indices to neighboring vertices for each vertex
+        (or (indptr, indices) neighbor arrays, see find_neighbors_csr(),
+        or a Surface)
+    squared : Boolean
+        use squared edge lengths?
+
+    Returns
+    -------
+    graph : scipy sparse matrix in csr format
+        length of the edge between vertices i and j at [i, j]
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from mindboggle.utils.shortest_paths import edge_length_graph
+    >>> points = np.array([[0,0,0],[1,0,0],[1,1,0],[0,2,0]], dtype=float)
+    >>> neighbor_lists = [[1,2,3],[0,2],[0,1,3],[0,2]]
+    >>> graph = edge_length_graph(points, neighbor_lists)
+    >>> graph[0, 3], graph[2, 3]
+    (2.0, 1.4142135623730951)
+
+    """
+    import numpy as np
+    from scipy.sparse import csr_matrix
+
+    from mindboggle.utils.mesh import Surface, gather_neighbors
+
+    points = np.asarray(points)
+    if isinstance(neighbor_lists, Surface):
+        neighbor_lists = neighbor_lists.neighbor_csr
+    npoints = len(points)
+
+    sources, neighbors = gather_neighbors(neighbor_lists, np.arange(npoints))
+    lengths = np.sum((points[sources] - points[neighbors])**2, axis=1)
+    if not squared:
+        lengths = np.sqrt(lengths)
+
+    return csr_matrix((lengths, (sources, neighbors)),
+                      shape=(npoints, npoints))
+
+
+def shortest_path_tree(graph, sources, targets=[], limit=None):
+    """
+    Find shortest paths from a set of source vertices with Dijkstra's method.
+
+    Each vertex is reached from its nearest source. The search stops
+    when the first target vertex (other than a source) is reached,
+    or when all vertices within the given distance have been reached.
+
+    Parameters
+    ----------
+    graph : scipy sparse matrix in csr format
+        edge lengths (see edge_length_graph())
+    sources : integer or list of integers
+        indices of source vertices
+    targets : list of integers
+        indices of target vertices (search the whole graph if empty)
+    limit : float
+        maximum distance from the sources (None for no limit)
+
+    Returns
+    -------
+    distances : numpy array of floats
+        distance to each vertex from the nearest source
+        (Inf for vertices that were not reached)
+    predecessors : numpy array of integers
+        previous vertex on the shortest path to each vertex
+        (-1 for sources and for vertices that were not reached)
+    target : integer
+        index of the target vertex reached (-1 if none)
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from mindboggle.utils.shortest_paths import edge_length_graph
+    >>> from mindboggle.utils.shortest_paths import shortest_path_tree
+    >>> points = np.array([[0,0,0],[1,0,0],[1,1,0],[0,2,0]], dtype=float)
+    >>> neighbor_lists = [[1,2,3],[0,2],[0,1,3],[0,2]]
+    >>> graph = edge_length_graph(points, neighbor_lists)
+    >>> distances, predecessors, target = shortest_path_tree(graph, [1])
+    >>> distances
+    array([ 1.        ,  0.        ,  1.        ,  2.41421356])
+    >>> predecessors
+    array([ 1, -1,  1,  2])
+    >>> distances, predecessors, target = shortest_path_tree(graph, [1], [3])
+    >>> target
+    3
+
+    """
+    import numpy as np
+    from heapq import heappush, heappop
+
+    indptr = graph.indptr
+    indices = graph.indices
+    lengths = graph.data
+    npoints = graph.shape[0]
+
+    if limit is None:
+        limit = np.Inf
+    if isinstance(sources, (int, np.integer)):
+        sources = [sources]
+    sources = [int(x) for x in sources]
+    is_target = np.zeros(npoints, dtype=bool)
+    is_target[list(targets)] = True
+    is_target[sources] = False
+
+    distances = np.Inf * np.ones(npoints)
+    predecessors = -1 * np.ones(npoints, dtype=int)
+    done = np.zeros(npoints, dtype=bool)
+
+    #-------------------------------------------------------------------------
+    # Visit vertices in order of distance from the sources:
+    #-------------------------------------------------------------------------
+    heap = []
+    for source in sources:
+        distances[source] = 0.0
+        heappush(heap, (0.0, source))
+    target = -1
+    while heap:
+        distance, vertex = heappop(heap)
+        if done[vertex]:
+            continue
+        done[vertex] = True
+        if is_target[vertex]:
+            target = vertex
+            break
+
+        # Shorten the paths to the vertex's neighbors:
+        start, stop = indptr[vertex], indptr[vertex + 1]
+        for neighbor, length in zip(indices[start:stop].tolist(),
+                                    lengths[start:stop].tolist()):
+            neighbor_distance = distance + length
+            if neighbor_distance < distances[neighbor] and \
+                    neighbor_distance <= limit and not done[neighbor]:
+                distances[neighbor] = neighbor_distance
+                predecessors[neighbor] = vertex
+                heappush(heap, (neighbor_distance, neighbor))
+
+    # Vertices left in the heap were reached, but not by a shortest path:
+    distances[~done] = np.Inf
+    predecessors[~done] = -1
+
+    return distances, predecessors, target
+
+
+def trace_path(predecessors, vertex):
+    """
+    Trace the shortest path to a vertex back to its source.
+
+    Parameters
+    ----------
+    predecessors : numpy array of integers
+        previous vertex on the shortest path to each vertex
+        (see shortest_path_tree())
+    vertex : integer
+        index of the last vertex of the path
+
+    Returns
+    -------
+    path : list of integers
+        indices of the vertices from the source to the vertex
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from mindboggle.utils.shortest_paths import trace_path
+    >>> trace_path(np.array([1, -1, 1, 2]), 3)
+    [1, 2, 3]
+
+    """
+    path = [vertex]
+    previous = predecessors[vertex]
+    while previous != -1:
+        path.append(int(previous))
+        previous = predecessors[previous]
+    path.reverse()
+
+    return path
+
+
+def shortest_paths(graph, sources, targets, limit=None):
+    """
+    Find the shortest path from each source vertex to its nearest target.
+
+    Each source is searched from separately, stopping at the first
+    target vertex other than the source itself.
+
+    Parameters
+    ----------
+    graph : scipy sparse matrix in csr format
+        edge lengths (see edge_length_graph())
+    sources : list of integers
+        indices of source vertices
+    targets : list of integers
+        indices of target vertices
+    limit : float
+        maximum length of a path (None for no limit)
+
+    Returns
+    -------
+    paths : list of lists of integers
+        indices of the vertices from each source to its nearest target
+        (empty if no target is reachable)
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from mindboggle.utils.shortest_paths import edge_length_graph
+    >>> from mindboggle.utils.shortest_paths import shortest_paths
+    >>> points = np.array([[0,0,0],[1,0,0],[1,1,0],[0,2,0]], dtype=float)
+    >>> neighbor_lists = [[1,2,3],[0,2],[0,1,3],[0,2]]
+    >>> graph = edge_length_graph(points, neighbor_lists)
+    >>> shortest_paths(graph, [1, 3], [1, 3])
+    [[1, 2, 3], [3, 2, 1]]
+
+    """
+    from mindboggle.utils.shortest_paths import shortest_path_tree, trace_path
+
+    paths = []
+    for source in sources:
+        distances, predecessors, target = shortest_path_tree(graph, [source],
+                                                             targets, limit)
+        if target == -1:
+            paths.append([])
+        else:
+            paths.append(trace_path(predecessors, target))
+
+    return paths